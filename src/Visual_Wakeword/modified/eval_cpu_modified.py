@@ -1,6 +1,7 @@
 # Copyright (c) Microsoft Corporation. All rights reserved.
 # Licensed under the MIT license.
 
+import time
 import torch
 import torch.nn as nn
 import torch.optim as optim
@@ -31,6 +32,24 @@ parser.add_argument('--model_arch',
                              'mobilenet_fg_last', 'mobilenet_gru_last', 'mobilenet_lstm_last',
                              'mobilenet_fg_fl', 'mobilenet_gru_fl', 'mobilenet_lstm_fl'],
                     help='choose architecture among rpool variants')
+parser.add_argument('--bf16', action='store_true',
+                    help='run the model under bfloat16 autocast')
+parser.add_argument('-b', '--batch-size', type=int, default=64, help='evaluation batch size')
+parser.add_argument('--num-workers', default=4, type=int,
+                    help='processes decoding and transforming images, 0 to do it in the main process')
+
+
+class ImageFolderList(torch.utils.data.Dataset):
+    # images by path, returned with their position in the list
+    def __init__(self, paths, transform):
+        self.paths = paths
+        self.transform = transform
+
+    def __getitem__(self, index):
+        return self.transform(Image.open(self.paths[index]).convert('RGB')), index
+
+    def __len__(self):
+        return len(self.paths)
 
 
 if __name__ == '__main__':
@@ -52,13 +71,11 @@ if __name__ == '__main__':
     model = module.mobilenetv2_rnnpool(num_classes=2, width_mult=0.35, last_channel=320)
     model = model.to(device)
 
-    # Because model is trained on 4 GPUs (default) with DataParallel, here DataParallel is necessary,
-    # or model.load_state_dict will raise error "Unexpected key(s) in state_dict"
-    model = torch.nn.DataParallel(model)
-
     # load checkpoint
     checkpoint = torch.load(args.weights, map_location=device)
-    checkpoint_dict = checkpoint['model']
+    # checkpoints saved from the DataParallel wrapper carry a module. prefix
+    checkpoint_dict = {k[len('module.'):] if k.startswith('module.') else k: v
+                       for k, v in checkpoint['model'].items()}
     model_dict = model.state_dict()
     model_dict.update(checkpoint_dict) 
     model.load_state_dict(model_dict)
@@ -67,24 +84,37 @@ if __name__ == '__main__':
 
     # list eval image
     img_path = args.image_folder
-    img_list = [os.path.join(img_path, x)
-                for x in os.listdir(img_path) if x.endswith('jpg')]
+    img_list = sorted(os.path.join(img_path, x)
+                      for x in os.listdir(img_path) if x.endswith('jpg'))
+
+    # the loader workers decode and transform the next batches while the
+    # model runs, and return the batches in the order of img_list
+    loader = torch.utils.data.DataLoader(ImageFolderList(img_list, transform_test),
+                                         batch_size=args.batch_size, shuffle=False,
+                                         num_workers=args.num_workers)
 
     # count MAdds and number of parameters in the model
     summary(model, input_size=(1, 3, 224, 224))
 
-    for i, path in enumerate(sorted(img_list)):
-        img = Image.open(path).convert('RGB')
-        img = transform_test(img)
-        img = img.unsqueeze(0)
-
-        out = model(img)
-
-        print(path)
-        print(out)
-
-        # if out[0][0] > 0.15:
-        if out[0][0] > out[0][1]:
-            print('No person present\n')
-        else:
-            print('Person present\n')
+    start = time.perf_counter()
+    model_time = 0.0
+    with torch.no_grad():
+        for imgs, indices in loader:
+            model_start = time.perf_counter()
+            with torch.autocast('cpu', dtype=torch.bfloat16, enabled=args.bf16):
+                outs = model(imgs).float()
+            model_time += time.perf_counter() - model_start
+
+            for out, index in zip(outs.split(1), indices.tolist()):
+                print(img_list[index])
+                print(out)
+
+                # if out[0][0] > 0.15:
+                if out[0][0] > out[0][1]:
+                    print('No person present\n')
+                else:
+                    print('Person present\n')
+    wall_time = time.perf_counter() - start
+
+    print(f'{len(img_list)} images in {wall_time:.2f} s: {len(img_list) / wall_time:.1f} images/s, '
+          f'{len(img_list) / max(model_time, 1e-9):.1f} images/s in the model')
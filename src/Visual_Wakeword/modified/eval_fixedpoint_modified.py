@@ -0,0 +1,193 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT license.
+
+'''
+Exports the RNNPool layers of a trained checkpoint to the int8/int16
+fixed-point runtime (edgeml_pytorch.graph.fixedpoint) and compares it with
+the float model on the same CPU: the RNNPool layer alone (max abs diff and
+time per batch) and the whole network (accuracy, or agreement with the
+float predictions when no labels are given, and images/s).
+
+python eval_fixedpoint_modified.py --model_arch mobilenet_fg_fl --weights checkpoints/fg_fl_132_150.pth \
+    --data path-to-mscoco-dataset --ann new-path-to-visualwakewords-dataset
+python eval_fixedpoint_modified.py --model_arch mobilenet_fg_last --weights checkpoints/fg_last_147_150.pth \
+    --image_folder images
+
+Only the FastGRNN variants can be exported, the LSTM and GRU RNNPool
+layers stay in float.
+'''
+
+import copy
+import time
+import torch
+import torchvision.transforms as transforms
+import os
+import argparse
+from PIL import Image
+from importlib import import_module
+
+from edgeml_pytorch.graph.quantize import QuantizedRNNPool, quantize_rnnpool
+from edgeml_pytorch.graph.rnnpool import RNNPool2d
+
+device = torch.device('cpu')
+
+# path for modified-model
+MODIFIED_MODELS_DIR = 'modified_models'
+
+# RNNPool layers that are exported, if the model has them
+RNNPOOL_LAYERS = ['rnn_model', 'rnn_model_end']
+
+# arg parser
+parser = argparse.ArgumentParser(description='PyTorch VisualWakeWords fixed-point evaluation')
+parser.add_argument('--weights', default=None, type=str, help='load from checkpoint')
+parser.add_argument('--image_folder', default=None, type=str, help='folder containing images')
+parser.add_argument('--data', default=None, type=str, help='path-to-mscoco-dataset, evaluates on the val split')
+parser.add_argument('--ann', default=None, type=str, help='new-path-to-visualwakewords-dataset')
+parser.add_argument('--model_arch',
+                    default='mobilenet_fg_fl', type=str,
+                    choices=['mobilenet_fg_fl', 'mobilenet_fg_last'],
+                    help='choose architecture among rpool variants with FastGRNN RNNPool')
+parser.add_argument('--weight_bits', default=8, type=int, choices=[8, 16], help='storage of W and U')
+parser.add_argument('--calib_images', default=64, type=int, help='images used to calibrate the input scale')
+parser.add_argument('--max_images', default=None, type=int, help='evaluate on at most this many images')
+parser.add_argument('-b', '--batch-size', type=int, default=32, help='evaluation batch size')
+parser.add_argument('--num-workers', default=4, type=int, help='number of dataloader workers')
+parser.add_argument('--save', default=None, type=str,
+                    help='save the exported layers as <save>_<layer>.npz')
+
+
+class ImageFolderList(torch.utils.data.Dataset):
+    # unlabelled images, the target is -1
+    def __init__(self, paths, transform):
+        self.paths = paths
+        self.transform = transform
+
+    def __getitem__(self, index):
+        return self.transform(Image.open(self.paths[index]).convert('RGB')), -1
+
+    def __len__(self):
+        return len(self.paths)
+
+
+def evaluate(model, loader):
+    # returns predictions, targets and images/s
+    predictions, targets = [], []
+    elapsed = 0.0
+    with torch.no_grad():
+        for inputs, target in loader:
+            start = time.perf_counter()
+            outputs = model(inputs)
+            elapsed += time.perf_counter() - start
+            predictions.append(outputs.argmax(1))
+            targets.append(torch.as_tensor(target))
+    predictions, targets = torch.cat(predictions), torch.cat(targets)
+    return predictions, targets, len(predictions) / elapsed
+
+
+def capture_inputs(model, loader, layers, num_images):
+    # inputs of every RNNPool layer over the first num_images images
+    captured = {name: [] for name in layers}
+    hooks = [getattr(model, name).register_forward_hook(
+        lambda module, inputs, output, name=name: captured[name].append(inputs[0].detach()))
+        for name in layers]
+    seen = 0
+    with torch.no_grad():
+        for inputs, _ in loader:
+            model(inputs)
+            seen += inputs.shape[0]
+            if seen >= num_images:
+                break
+    for hook in hooks:
+        hook.remove()
+    return {name: torch.cat(xs)[:num_images] for name, xs in captured.items()}
+
+
+def call_layer(layer, x):
+    # RNNPool2d takes the feature map, RNNPool also the batch size
+    return layer(x) if isinstance(layer, RNNPool2d) else layer(x, x.shape[0])
+
+
+def time_layer(fn, inputs, batch_size):
+    start = time.perf_counter()
+    outputs = [fn(x) for x in torch.split(inputs, batch_size)]
+    return torch.cat(outputs), 1000 * (time.perf_counter() - start) * batch_size / inputs.shape[0]
+
+
+def run(args, layers):
+    normalize = transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
+    transform_test = transforms.Compose([
+        transforms.Resize(256),
+        transforms.CenterCrop(224),
+        transforms.ToTensor(),
+        normalize
+    ])
+
+    # evaluation images, labelled when the dataset is given
+    if args.data is not None and args.ann is not None:
+        from train_vww_modified import VisualWakeWordsClassification
+        dataset = VisualWakeWordsClassification(root=os.path.join(args.data, 'all2014'),
+                                                annFile=os.path.join(args.ann, 'annotations/instances_val.json'),
+                                                transform=transform_test, split='val')
+    else:
+        img_list = [os.path.join(args.image_folder, x)
+                    for x in os.listdir(args.image_folder) if x.endswith('jpg')]
+        dataset = ImageFolderList(sorted(img_list), transform_test)
+    if args.max_images is not None:
+        dataset = torch.utils.data.Subset(dataset, range(min(args.max_images, len(dataset))))
+    loader = torch.utils.data.DataLoader(dataset, batch_size=args.batch_size, shuffle=False,
+                                         num_workers=args.num_workers)
+
+    # load the float model as eval_cpu does
+    module = args.module
+    model = module.mobilenetv2_rnnpool(num_classes=2, width_mult=0.35, last_channel=320)
+    model = model.to(device)
+    checkpoint = torch.load(args.weights, map_location=device)
+    # checkpoints saved from the DataParallel wrapper carry a module. prefix
+    checkpoint_dict = {k[len('module.'):] if k.startswith('module.') else k: v
+                       for k, v in checkpoint['model'].items()}
+    model_dict = model.state_dict()
+    model_dict.update(checkpoint_dict)
+    model.load_state_dict(model_dict)
+    model.eval()
+    layers = [name for name in layers if hasattr(model, name)]
+
+    # calibrate and export
+    calibration = capture_inputs(model, loader, layers, args.calib_images)
+    quantized = copy.deepcopy(model)
+    for name in layers:
+        layer = getattr(model, name)
+        runtime = quantize_rnnpool(layer, calibration[name], args.weight_bits)
+        if args.save is not None:
+            runtime.save('{}_{}.npz'.format(args.save, name))
+        setattr(quantized, name, QuantizedRNNPool(runtime))
+
+        # the layer alone, on the calibration inputs
+        x = calibration[name]
+        batch_size = args.batch_size
+        with torch.no_grad():
+            reference, float_ms = time_layer(lambda t: call_layer(layer, t), x, batch_size)
+        output, int_ms = time_layer(lambda t: torch.from_numpy(runtime(t.numpy())), x, batch_size)
+        print('{}: input scale {:.3e}, max abs diff {:.3e} (output max {:.3f}), '
+              '{:.2f} ms -> {:.2f} ms per batch of {}'.format(
+                  name, runtime.rnn1.input_scale, (reference - output).abs().max().item(),
+                  reference.abs().max().item(), float_ms, int_ms, batch_size))
+
+    # the whole network
+    float_pred, targets, float_ips = evaluate(model, loader)
+    int_pred, _, int_ips = evaluate(quantized, loader)
+    print()
+    print('images: {}'.format(len(targets)))
+    if (targets >= 0).all():
+        print('accuracy: float {:.2f}%, fixed-point {:.2f}%'.format(
+            100.0 * (float_pred == targets).float().mean().item(),
+            100.0 * (int_pred == targets).float().mean().item()))
+    print('prediction agreement: {:.2f}%'.format(100.0 * (float_pred == int_pred).float().mean().item()))
+    print('throughput: float {:.1f} images/s, fixed-point {:.1f} images/s'.format(float_ips, int_ips))
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    print(f'Model: {args.model_arch}, int{args.weight_bits} weights')
+    print()
+    args.module = import_module(f'{MODIFIED_MODELS_DIR}.{args.model_arch}')
+    run(args, RNNPOOL_LAYERS)
@@ -137,7 +137,7 @@ class MobileNetV2(nn.Module):
         # self.rnn_model = RNNPool(6, 6, 8, 8, input_channel)#num_init_features)
         # self.fold = nn.Fold(kernel_size=(1,1),output_size=(27,27))
 
-        self.rnn_model_end = RNNPool(7, 7, int(self.last_channel/4), int(self.last_channel/4), self.last_channel)
+        self.rnn_model_end = RNNPool(7, 7, int(self.last_channel/4), int(self.last_channel/4), self.last_channel, batchSweeps=True)
 
         features=[] 
 
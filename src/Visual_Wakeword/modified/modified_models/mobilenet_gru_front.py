@@ -26,10 +26,12 @@ class ModifiedRNNPool(RNNPool):
 
     def __init__(self, nRows, nCols, nHiddenDims,
                  nHiddenDimsBiDir, inputDims, 
-                 w1Sparsity=1.0, u1Sparsity=1.0, w2Sparsity=1.0, u2Sparsity=1.0):
+                 w1Sparsity=1.0, u1Sparsity=1.0, w2Sparsity=1.0, u2Sparsity=1.0,
+                 batchSweeps=False):
         super(ModifiedRNNPool, self).__init__(nRows, nCols, nHiddenDims,
                                               nHiddenDimsBiDir, inputDims,
-                                              w1Sparsity, u1Sparsity, w2Sparsity, u2Sparsity)
+                                              w1Sparsity, u1Sparsity, w2Sparsity, u2Sparsity,
+                                              batchSweeps)
 
     def _build(self):
         self.cell_rnn = GRU(self.inputDims, self.nHiddenDims, gate_nonlinearity="sigmoid",
@@ -41,6 +43,11 @@ class ModifiedRNNPool(RNNPool):
                                  batch_first=False, bidirectional=True, is_shared_bidirectional=True)
 
 
+class ModifiedRNNPool2d(RNNPool2d, ModifiedRNNPool):
+    """GRU RNNPool slid over a feature map, see RNNPool2d."""
+    pass
+
+
 def _make_divisible(v, divisor, min_value=None):
     """
     This function is taken from the original tf repo.
@@ -107,7 +114,8 @@ class MobileNetV2(nn.Module):
                  inverted_residual_setting=None, 
                  round_nearest=8,
                  block=None,
-                 last_channel = 1280):
+                 last_channel = 1280,
+                 rnnpool_tile_bytes=None):
         """
         MobileNet V2 main class
         Args:
@@ -117,6 +125,8 @@ class MobileNetV2(nn.Module):
             round_nearest (int): Round the number of channels in each layer to be a multiple of this number
             Set to 1 to turn off rounding
             block: Module specifying inverted residual building block for mobilenet
+            rnnpool_tile_bytes (int): Memory budget per tile of the front RNNPool, which then
+            runs a few patch rows at a time (for high resolution inputs). None pools the whole map
         """
         super(MobileNetV2, self).__init__()
         
@@ -144,10 +154,8 @@ class MobileNetV2(nn.Module):
         self.last_channel = _make_divisible(last_channel * max(1.0, width_mult), round_nearest)
         self.features_init = ConvBNReLU(3, input_channel, stride=2)
 
-        self.unfold = nn.Unfold(kernel_size=(6,6),stride=(4,4))
-
-        self.rnn_model = ModifiedRNNPool(6, 6, 8, 8, input_channel)#num_init_features)
-        self.fold = nn.Fold(kernel_size=(1,1),output_size=(27,27))
+        self.rnn_model = ModifiedRNNPool2d(6, 4, 8, 8, input_channel, batchSweeps=True,
+                                           padding=(0, 1, 0, 1), tileBytes=rnnpool_tile_bytes)#num_init_features)
 
 
         features=[]
@@ -185,26 +193,9 @@ class MobileNetV2(nn.Module):
                 nn.init.zeros_(m.bias)
 
     def forward(self, x):
-        batch_size = x.shape[0]
-        
-        
         x = self.features_init(x)
      
-        patches = self.unfold(x)
-        patches = torch.cat(torch.unbind(patches,dim=2),dim=0)
-        patches = torch.reshape(patches,(-1,8,6,6))
-        
-
-        output_x = int((x.shape[2]-6)/4 + 1)
-        output_y = int((x.shape[3]-6)/4 + 1)
-
-        rnnX = self.rnn_model(patches, int(batch_size)*output_x*output_y)
-
-        x = torch.stack(torch.split(rnnX, split_size_or_sections=int(batch_size), dim=0),dim=2)
-
-        x = self.fold(x)
-
-        x = F.pad(x, (0,1,0,1), mode='replicate')        
+        x = self.rnn_model(x)
 
         x = self.features(x)
         x = x.mean([2, 3])
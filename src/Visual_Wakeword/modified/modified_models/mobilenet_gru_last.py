@@ -26,10 +26,12 @@ class ModifiedRNNPool(RNNPool):
 
     def __init__(self, nRows, nCols, nHiddenDims,
                  nHiddenDimsBiDir, inputDims, 
-                 w1Sparsity=1.0, u1Sparsity=1.0, w2Sparsity=1.0, u2Sparsity=1.0):
+                 w1Sparsity=1.0, u1Sparsity=1.0, w2Sparsity=1.0, u2Sparsity=1.0,
+                 batchSweeps=False):
         super(ModifiedRNNPool, self).__init__(nRows, nCols, nHiddenDims,
                                               nHiddenDimsBiDir, inputDims,
-                                              w1Sparsity, u1Sparsity, w2Sparsity, u2Sparsity)
+                                              w1Sparsity, u1Sparsity, w2Sparsity, u2Sparsity,
+                                              batchSweeps)
 
     def _build(self):
         self.cell_rnn = GRU(self.inputDims, self.nHiddenDims, gate_nonlinearity="sigmoid",
@@ -158,7 +160,7 @@ class MobileNetV2(nn.Module):
         # self.rnn_model = RNNPool(6, 6, 8, 8, input_channel)#num_init_features)
         # self.fold = nn.Fold(kernel_size=(1,1),output_size=(27,27))
 
-        self.rnn_model_end = ModifiedRNNPool(7, 7, int(self.last_channel/4), int(self.last_channel/4), self.last_channel)
+        self.rnn_model_end = ModifiedRNNPool(7, 7, int(self.last_channel/4), int(self.last_channel/4), self.last_channel, batchSweeps=True)
 
         features=[] 
 
@@ -8,6 +8,7 @@ import torch.nn.functional as F
 import numpy as np
 import torch.utils.checkpoint as cp
 from collections import OrderedDict
+from typing import Tuple
 # from torchvision.models.utils import load_state_dict_from_url
 from torch.hub import load_state_dict_from_url
 from edgeml_pytorch.graph.rnnpool import *
@@ -26,10 +27,12 @@ class ModifiedRNNPool(RNNPool):
 
     def __init__(self, nRows, nCols, nHiddenDims,
                  nHiddenDimsBiDir, inputDims, 
-                 w1Sparsity=1.0, u1Sparsity=1.0, w2Sparsity=1.0, u2Sparsity=1.0):
+                 w1Sparsity=1.0, u1Sparsity=1.0, w2Sparsity=1.0, u2Sparsity=1.0,
+                 batchSweeps=False):
         super(ModifiedRNNPool, self).__init__(nRows, nCols, nHiddenDims,
                                               nHiddenDimsBiDir, inputDims,
-                                              w1Sparsity, u1Sparsity, w2Sparsity, u2Sparsity)
+                                              w1Sparsity, u1Sparsity, w2Sparsity, u2Sparsity,
+                                              batchSweeps)
 
     def _build(self):
         self.cell_rnn = LSTM(self.inputDims, self.nHiddenDims, gate_nonlinearity="sigmoid",
@@ -40,39 +43,15 @@ class ModifiedRNNPool(RNNPool):
                                   update_nonlinearity="tanh", wSparsity=self.w2Sparsity, uSparsity=self.u2Sparsity,
                                   batch_first=False, bidirectional=True, is_shared_bidirectional=True)
 
-    def static_single(self,inputs, hidden, batch_size):
+    def static_single(self, inputs, hidden: Tuple[torch.Tensor, torch.Tensor], batch_size: int):
 
-        outputs = self.cell_rnn(inputs, hidden[0], hidden[1])
-        return torch.split(outputs[0][-1], split_size_or_sections=batch_size, dim=0)
+        outputs = self.cell_rnn(inputs, hidden[0], hidden[1], return_sequence=False)
+        return outputs[0].view(-1, batch_size, self.nHiddenDims)
 
-    def forward(self,inputs,batch_size):
-        ## across rows
+    def bidir_single(self, inputs, hidden: Tuple[torch.Tensor, torch.Tensor]):
 
-        row_timestack = torch.cat(torch.unbind(inputs, dim=3),dim=0) 
-
-        stateList = self.static_single(torch.stack(torch.unbind(row_timestack,dim=2)),
-                        (torch.zeros(1, batch_size * self.nRows, self.nHiddenDims).to(inputs.device),
-                        torch.zeros(1, batch_size * self.nRows, self.nHiddenDims).to(inputs.device)),batch_size)       
-
-        outputs_cols = self.cell_bidirrnn(torch.stack(stateList),
-                        torch.zeros(2, batch_size, self.nHiddenDimsBiDir).to(inputs.device),
-                        torch.zeros(2, batch_size, self.nHiddenDimsBiDir).to(inputs.device))
-
-
-        ## across columns
-        col_timestack = torch.cat(torch.unbind(inputs, dim=2),dim=0)
-
-        stateList = self.static_single(torch.stack(torch.unbind(col_timestack,dim=2)),
-                        (torch.zeros(1, batch_size * self.nRows, self.nHiddenDims).to(inputs.device),
-                        torch.zeros(1, batch_size * self.nRows, self.nHiddenDims).to(inputs.device)),batch_size)
-
-        outputs_rows = self.cell_bidirrnn(torch.stack(stateList),
-                        torch.zeros(2, batch_size, self.nHiddenDimsBiDir).to(inputs.device),
-                        torch.zeros(2, batch_size, self.nHiddenDimsBiDir).to(inputs.device))
-
-        output = torch.cat([outputs_rows[0][-1],outputs_cols[0][-1]],1)
-
-        return output
+        outputs = self.cell_bidirrnn(inputs, hidden[0], hidden[1], return_sequence=False)
+        return outputs[0]
 
 
 def _make_divisible(v, divisor, min_value=None):
@@ -192,7 +171,7 @@ class MobileNetV2(nn.Module):
         # self.rnn_model = RNNPool(6, 6, 8, 8, input_channel)#num_init_features)
         # self.fold = nn.Fold(kernel_size=(1,1),output_size=(27,27))
 
-        self.rnn_model_end = ModifiedRNNPool(7, 7, int(self.last_channel/4), int(self.last_channel/4), self.last_channel)
+        self.rnn_model_end = ModifiedRNNPool(7, 7, int(self.last_channel/4), int(self.last_channel/4), self.last_channel, batchSweeps=True)
 
         features=[] 
 
@@ -0,0 +1,164 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT license.
+
+'''
+Compares bfloat16 autocast inference with float32 on the same CPU for the
+original fg_front model: accuracy (or prediction agreement with float32
+when no labels are given), max abs difference of the logits and images/s
+of the model alone. The eight modified variants are covered by
+../modified/eval_bf16_modified.py, together the two report all nine.
+
+python eval_bf16.py --data path-to-mscoco-dataset --ann new-path-to-visualwakewords-dataset
+python eval_bf16.py --image_folder images
+'''
+
+import time
+import torch
+import torchvision.transforms as transforms
+import os
+import argparse
+from PIL import Image
+from importlib import import_module
+
+device = torch.device('cpu')
+
+# trained checkpoint of every variant, in --checkpoints
+CHECKPOINTS = {
+    'model_mobilenet_rnnpool': 'fg_front_137_150.pth',
+}
+
+# arg parser
+parser = argparse.ArgumentParser(description='PyTorch VisualWakeWords bfloat16 evaluation')
+parser.add_argument('--model_arch', default=list(CHECKPOINTS), type=str, nargs='+',
+                    choices=list(CHECKPOINTS), help='variants to evaluate (default: all)')
+parser.add_argument('--checkpoints', default='checkpoints', type=str, help='folder with the trained checkpoints')
+parser.add_argument('--image_folder', default=None, type=str, help='folder containing images')
+parser.add_argument('--data', default=None, type=str, help='path-to-mscoco-dataset, evaluates on the val split')
+parser.add_argument('--ann', default=None, type=str, help='new-path-to-visualwakewords-dataset')
+parser.add_argument('--max_images', default=None, type=int, help='evaluate on at most this many images')
+parser.add_argument('-b', '--batch-size', type=int, default=32, help='evaluation batch size')
+parser.add_argument('--num-workers', default=4, type=int, help='number of dataloader workers')
+parser.add_argument('--markdown', default=None, type=str,
+                    help='append the results as markdown table rows to this file (header written if new)')
+
+MARKDOWN_HEADER = ('| model | images | fp32 acc | bf16 acc | delta | agreement | max logit diff '
+                   '| fp32 img/s | bf16 img/s | speedup |\n'
+                   '|---|---|---|---|---|---|---|---|---|---|\n')
+
+
+class ImageFolderList(torch.utils.data.Dataset):
+    # unlabelled images, the target is -1
+    def __init__(self, paths, transform):
+        self.paths = paths
+        self.transform = transform
+
+    def __getitem__(self, index):
+        return self.transform(Image.open(self.paths[index]).convert('RGB')), -1
+
+    def __len__(self):
+        return len(self.paths)
+
+
+def evaluate(model, loader, bf16):
+    # returns logits, targets and images/s of the model alone
+    logits, targets = [], []
+    elapsed = 0.0
+    with torch.no_grad():
+        for inputs, target in loader:
+            start = time.perf_counter()
+            with torch.autocast('cpu', dtype=torch.bfloat16, enabled=bf16):
+                outputs = model(inputs)
+            elapsed += time.perf_counter() - start
+            logits.append(outputs.float())
+            targets.append(torch.as_tensor(target))
+    logits, targets = torch.cat(logits), torch.cat(targets)
+    return logits, targets, len(logits) / elapsed
+
+
+def load_model(arch, weights):
+    module = import_module(arch)
+    model = module.mobilenetv2_rnnpool(num_classes=2, width_mult=0.35, last_channel=320)
+    model = model.to(device)
+    checkpoint = torch.load(weights, map_location=device)
+    # checkpoints saved from the DataParallel wrapper carry a module. prefix
+    checkpoint_dict = {k[len('module.'):] if k.startswith('module.') else k: v
+                       for k, v in checkpoint['model'].items()}
+    model_dict = model.state_dict()
+    model_dict.update(checkpoint_dict)
+    model.load_state_dict(model_dict)
+    model.eval()
+    return model
+
+
+def percent(value, fmt='{:.2f}%'):
+    # accuracies are nan without labels
+    return 'n/a' if value != value else fmt.format(value)
+
+
+def write_markdown(path, rows, images):
+    # eval_bf16.py and eval_bf16_modified.py append to the same file, one row per variant
+    new = not os.path.exists(path) or os.path.getsize(path) == 0
+    with open(path, 'a') as f:
+        if new:
+            f.write(MARKDOWN_HEADER)
+        for arch, fp32_acc, bf16_acc, agreement, diff, fp32_ips, bf16_ips in rows:
+            f.write('| {} | {} | {} | {} | {} | {:.2f}% | {:.2e} | {:.1f} | {:.1f} | {:.2f}x |\n'.format(
+                arch, images, percent(fp32_acc), percent(bf16_acc), percent(bf16_acc - fp32_acc, '{:+.2f}'),
+                agreement, diff, fp32_ips, bf16_ips, bf16_ips / fp32_ips))
+
+
+def run(args):
+    normalize = transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
+    transform_test = transforms.Compose([
+        transforms.Resize(256),
+        transforms.CenterCrop(224),
+        transforms.ToTensor(),
+        normalize
+    ])
+
+    # evaluation images, labelled when the dataset is given
+    if args.data is not None and args.ann is not None:
+        from train_visualwakewords import VisualWakeWordsClassification
+        dataset = VisualWakeWordsClassification(root=os.path.join(args.data, 'all2014'),
+                                                annFile=os.path.join(args.ann, 'annotations/instances_val.json'),
+                                                transform=transform_test, split='val')
+    else:
+        img_list = [os.path.join(args.image_folder, x)
+                    for x in os.listdir(args.image_folder) if x.endswith('jpg')]
+        dataset = ImageFolderList(sorted(img_list), transform_test)
+    if args.max_images is not None:
+        dataset = torch.utils.data.Subset(dataset, range(min(args.max_images, len(dataset))))
+    loader = torch.utils.data.DataLoader(dataset, batch_size=args.batch_size, shuffle=False,
+                                         num_workers=args.num_workers)
+
+    rows = []
+    for arch in args.model_arch:
+        model = load_model(arch, os.path.join(args.checkpoints, CHECKPOINTS[arch]))
+        fp32_logits, targets, fp32_ips = evaluate(model, loader, False)
+        bf16_logits, _, bf16_ips = evaluate(model, loader, True)
+        fp32_pred, bf16_pred = fp32_logits.argmax(1), bf16_logits.argmax(1)
+        if (targets >= 0).all():
+            fp32_acc = 100.0 * (fp32_pred == targets).float().mean().item()
+            bf16_acc = 100.0 * (bf16_pred == targets).float().mean().item()
+        else:
+            fp32_acc = bf16_acc = float('nan')
+        rows.append((arch, fp32_acc, bf16_acc, 100.0 * (fp32_pred == bf16_pred).float().mean().item(),
+                     (fp32_logits - bf16_logits).abs().max().item(), fp32_ips, bf16_ips))
+        print('{}: accuracy {} -> {}, {:.1f} -> {:.1f} images/s'.format(
+            arch, percent(fp32_acc), percent(bf16_acc), fp32_ips, bf16_ips))
+
+    print()
+    print('images: {}'.format(len(targets)))
+    print('{:<22} {:>9} {:>9} {:>7} {:>9} {:>9} {:>10} {:>10} {:>7}'.format(
+        'model', 'fp32 acc', 'bf16 acc', 'delta', 'agree', 'max diff', 'fp32 img/s', 'bf16 img/s', 'speedup'))
+    for arch, fp32_acc, bf16_acc, agreement, diff, fp32_ips, bf16_ips in rows:
+        print('{:<22} {:>9} {:>9} {:>7} {:>8.2f}% {:>9.2e} {:>10.1f} {:>10.1f} {:>6.2f}x'.format(
+            arch, percent(fp32_acc), percent(bf16_acc), percent(bf16_acc - fp32_acc, '{:+.2f}'), agreement, diff,
+            fp32_ips, bf16_ips, bf16_ips / fp32_ips))
+    if args.markdown is not None:
+        write_markdown(args.markdown, rows, len(targets))
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    run(args)
@@ -0,0 +1,119 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT license.
+
+'''
+Checks reduced-scale JPEG decoding (train_visualwakewords.py --draft) on the
+Visual Wake Words val split: single-process decode throughput of full and
+draft decoding at the shorter side each transform needs, with the share of
+images that the decoder could downscale, and, given a checkpoint, the val
+accuracy and prediction agreement of the model with and without --draft.
+
+python eval_draft.py --data path-to-mscoco-dataset --ann new-path-to-visualwakewords-dataset \
+    --weights checkpoints/model_mobilenet_rnnpool.pth
+'''
+
+import time
+import torch
+import torchvision.transforms as transforms
+import os
+import argparse
+from importlib import import_module
+
+from train_visualwakewords import DRAFT_SIZE, VisualWakeWordsClassification, open_image
+
+device = torch.device('cpu')
+
+# arg parser
+parser = argparse.ArgumentParser(description='PyTorch VisualWakeWords draft decoding check')
+parser.add_argument('--data', default=None, type=str, required=True, help='path-to-mscoco-dataset')
+parser.add_argument('--ann', default=None, type=str, required=True, help='new-path-to-visualwakewords-dataset')
+parser.add_argument('--weights', default=None, type=str, help='checkpoint for the accuracy check')
+parser.add_argument('--model_arch',
+                    default='model_mobilenet_rnnpool', type=str,
+                    choices=['model_mobilenet_rnnpool', 'model_mobilenet_2rnnpool'],
+                    help='choose architecture among rpool variants')
+parser.add_argument('--decode_images', default=1000, type=int, help='images timed for decode throughput')
+parser.add_argument('--max_images', default=None, type=int, help='evaluate on at most this many images')
+parser.add_argument('-b', '--batch-size', type=int, default=32, help='evaluation batch size')
+parser.add_argument('--num-workers', default=4, type=int, help='number of dataloader workers')
+
+
+def decode_throughput(paths, min_side):
+    # images/s and the decoded sizes
+    start = time.perf_counter()
+    sizes = [open_image(path, min_side).size for path in paths]
+    return len(paths) / (time.perf_counter() - start), sizes
+
+
+def evaluate(model, loader):
+    # returns predictions, targets and images/s including decoding
+    predictions, targets = [], []
+    start = time.perf_counter()
+    with torch.no_grad():
+        for inputs, target in loader:
+            predictions.append(model(inputs).argmax(1))
+            targets.append(target)
+    elapsed = time.perf_counter() - start
+    predictions, targets = torch.cat(predictions), torch.cat(targets)
+    return predictions, targets, len(predictions) / elapsed
+
+
+def run(args):
+    normalize = transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
+    transform_test = transforms.Compose([
+        transforms.Resize(256),
+        transforms.CenterCrop(224),
+        transforms.ToTensor(),
+        normalize
+    ])
+    root = os.path.join(args.data, 'all2014')
+    annFile = os.path.join(args.ann, 'annotations/instances_val.json')
+
+    # decode throughput
+    datasets = {draft: VisualWakeWordsClassification(root=root, annFile=annFile, transform=transform_test,
+                                                     split='val', draft=draft) for draft in [False, True]}
+    paths = [os.path.join(root, p.decode()) for p in datasets[False].paths[:args.decode_images]]
+    full_ips, full_sizes = decode_throughput(paths, None)
+    print('decode, {} images: full {:.1f} images/s'.format(len(paths), full_ips))
+    for split, min_side in DRAFT_SIZE.items():
+        ips, sizes = decode_throughput(paths, min_side)
+        reduced = sum(size != full for size, full in zip(sizes, full_sizes))
+        print('  draft for {} (shorter side >= {}): {:.1f} images/s ({:.2f}x), {:.1f}% of images downscaled'.format(
+            split, min_side, ips, ips / full_ips, 100.0 * reduced / len(paths)))
+
+    if args.weights is None:
+        return
+
+    # val accuracy with and without draft decoding
+    module = import_module(args.model_arch)
+    model = module.mobilenetv2_rnnpool(num_classes=2, width_mult=0.35, last_channel=320)
+    model = model.to(device)
+    checkpoint = torch.load(args.weights, map_location=device)
+    # checkpoints saved from the DataParallel wrapper carry a module. prefix
+    checkpoint_dict = {k[len('module.'):] if k.startswith('module.') else k: v
+                       for k, v in checkpoint['model'].items()}
+    model_dict = model.state_dict()
+    model_dict.update(checkpoint_dict)
+    model.load_state_dict(model_dict)
+    model.eval()
+
+    results = {}
+    for draft, dataset in datasets.items():
+        if args.max_images is not None:
+            dataset = torch.utils.data.Subset(dataset, range(min(args.max_images, len(dataset))))
+        loader = torch.utils.data.DataLoader(dataset, batch_size=args.batch_size, shuffle=False,
+                                             num_workers=args.num_workers)
+        results[draft] = evaluate(model, loader)
+    (full_pred, targets, full_ips), (draft_pred, _, draft_ips) = results[False], results[True]
+    print()
+    print('images: {}'.format(len(targets)))
+    print('accuracy: full {:.2f}%, draft {:.2f}%'.format(
+        100.0 * (full_pred == targets).float().mean().item(),
+        100.0 * (draft_pred == targets).float().mean().item()))
+    print('prediction agreement: {:.2f}%'.format(100.0 * (full_pred == draft_pred).float().mean().item()))
+    print('throughput: full {:.1f} images/s, draft {:.1f} images/s'.format(full_ips, draft_ips))
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    run(args)
@@ -0,0 +1,103 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT license.
+
+'''
+Checks the MobileNetV2-RNNPool compiled with torch.jit.script (as run by
+eval_cpu.py --script) against the eager model on the same CPU: max abs
+difference of the logits, prediction agreement and images/s of the model
+alone. The model is randomly initialised unless --weights is given, and
+runs on random images unless --image_folder is given. Exits with an error
+if the scripted model differs by more than --tolerance. The modified
+variants are covered by ../modified/eval_script_modified.py.
+
+python eval_script.py --weights checkpoints/fg_front_137_150.pth --image_folder images
+'''
+
+import time
+import torch
+import torchvision.transforms as transforms
+import os
+import argparse
+from PIL import Image
+from importlib import import_module
+
+device = torch.device('cpu')
+
+# arg parser
+parser = argparse.ArgumentParser(description='PyTorch VisualWakeWords TorchScript check')
+parser.add_argument('--model_arch', default=['model_mobilenet_rnnpool'], type=str, nargs='+',
+                    choices=['model_mobilenet_rnnpool'], help='variants to check')
+parser.add_argument('--weights', default=None, type=str, help='checkpoint to load, random weights if not given')
+parser.add_argument('--image_folder', default=None, type=str, help='folder containing images, random if not given')
+parser.add_argument('--max_images', default=64, type=int, help='check on at most this many images')
+parser.add_argument('-b', '--batch-size', type=int, default=16, help='evaluation batch size')
+parser.add_argument('--repeats', default=5, type=int, help='timed passes over the images')
+parser.add_argument('--tolerance', default=1e-4, type=float, help='largest accepted logit difference')
+
+
+def load_images(args):
+    # [N, 3, 224, 224] batch of normalized images
+    if args.image_folder is None:
+        torch.manual_seed(0)
+        return torch.randn(args.max_images, 3, 224, 224)
+    normalize = transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
+    transform_test = transforms.Compose([
+        transforms.Resize(256),
+        transforms.CenterCrop(224),
+        transforms.ToTensor(),
+        normalize
+    ])
+    img_list = sorted(os.path.join(args.image_folder, x)
+                      for x in os.listdir(args.image_folder) if x.endswith('jpg'))[:args.max_images]
+    return torch.stack([transform_test(Image.open(path).convert('RGB')) for path in img_list])
+
+
+def load_model(arch, weights):
+    module = import_module(arch)
+    model = module.mobilenetv2_rnnpool(num_classes=2, width_mult=0.35, last_channel=320)
+    model = model.to(device)
+    if weights is not None:
+        checkpoint = torch.load(weights, map_location=device)
+        # checkpoints saved from the DataParallel wrapper carry a module. prefix
+        checkpoint_dict = {k[len('module.'):] if k.startswith('module.') else k: v
+                           for k, v in checkpoint['model'].items()}
+        model_dict = model.state_dict()
+        model_dict.update(checkpoint_dict)
+        model.load_state_dict(model_dict)
+    model.eval()
+    return model
+
+
+def evaluate(model, images, batch_size, repeats):
+    # returns the logits and images/s of the model alone
+    with torch.no_grad():
+        logits = torch.cat([model(batch) for batch in images.split(batch_size)])
+        start = time.perf_counter()
+        for _ in range(repeats):
+            for batch in images.split(batch_size):
+                model(batch)
+        elapsed = time.perf_counter() - start
+    return logits, repeats * len(images) / elapsed
+
+
+def run(args):
+    images = load_images(args)
+    failed = False
+    for arch in args.model_arch:
+        model = load_model(arch, args.weights)
+        scripted = torch.jit.script(model)
+        eager_logits, eager_ips = evaluate(model, images, args.batch_size, args.repeats)
+        script_logits, script_ips = evaluate(scripted, images, args.batch_size, args.repeats)
+        diff = (eager_logits - script_logits).abs().max().item()
+        agreement = 100.0 * (eager_logits.argmax(1) == script_logits.argmax(1)).float().mean().item()
+        failed = failed or diff > args.tolerance
+        print('{}: {} images, max abs diff {:.3e}, same prediction {:.2f}%, '
+              'eager {:.1f} images/s, scripted {:.1f} images/s'.format(
+                  arch, len(images), diff, agreement, eager_ips, script_ips))
+    if failed:
+        raise SystemExit('scripted model differs from eager by more than {}'.format(args.tolerance))
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    run(args)
@@ -0,0 +1,109 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT license.
+
+"""Convert the Visual WakeWords splits to pre-decoded image shards.
+    Every image is decoded once, converted to RGB and resized so that its
+    shorter side is --short_side (bilinear, as transforms.Resize does),
+    then appended as raw uint8 HWC bytes to shard files of at most
+    --shard_mb MB. The training scripts memory-map the shards with
+    --shards instead of decoding the COCO JPEGs every epoch.
+
+    Layout of <output_dir>/<split>/:
+        shard_00000.bin, shard_00001.bin, ...  concatenated uint8 HWC images
+        index.npz  per image: ids, targets, shard, offset, height, width;
+                   plus files (shard file names) and short_side
+"""
+
+import os
+from argparse import ArgumentParser
+from multiprocessing import Pool
+
+import numpy as np
+from PIL import Image
+from pyvww.utils import VisualWakeWords
+
+SPLITS = {'train': 'annotations/instances_train.json',
+          'val': 'annotations/instances_val.json'}
+
+
+def load_split(ann_file):
+    vww = VisualWakeWords(ann_file)
+    ids = list(sorted(vww.imgs.keys()))
+    paths, targets = [], []
+    for img_id in ids:
+        targets.append(vww.loadAnns(vww.getAnnIds(imgIds=img_id))[0]['category_id'])
+        paths.append(vww.loadImgs(img_id)[0]['file_name'])
+    return ids, paths, targets
+
+
+def decode(job):
+    path, short_side = job
+    img = Image.open(path).convert('RGB')
+    width, height = img.size
+    scale = short_side / min(width, height)
+    size = (max(1, int(round(width * scale))), max(1, int(round(height * scale))))
+    return np.asarray(img.resize(size, Image.BILINEAR), dtype=np.uint8)
+
+
+def convert_split(root, ann_file, output_dir, short_side, shard_bytes, workers):
+    ids, paths, targets = load_split(ann_file)
+    os.makedirs(output_dir, exist_ok=True)
+
+    count = len(ids)
+    shard = np.zeros(count, dtype=np.int32)
+    offset = np.zeros(count, dtype=np.int64)
+    height = np.zeros(count, dtype=np.int32)
+    width = np.zeros(count, dtype=np.int32)
+    files = []
+    out, written = None, 0
+
+    jobs = [(os.path.join(root, path), short_side) for path in paths]
+    with Pool(workers) as pool:
+        for i, img in enumerate(pool.imap(decode, jobs, chunksize=16)):
+            if out is None or written + img.nbytes > shard_bytes:
+                if out is not None:
+                    out.close()
+                files.append('shard_{:05d}.bin'.format(len(files)))
+                out = open(os.path.join(output_dir, files[-1]), 'wb')
+                written = 0
+            shard[i], offset[i] = len(files) - 1, written
+            height[i], width[i] = img.shape[:2]
+            out.write(img.tobytes())
+            written += img.nbytes
+            if (i + 1) % 10000 == 0:
+                print('{}/{} images'.format(i + 1, count))
+    if out is not None:
+        out.close()
+
+    np.savez(os.path.join(output_dir, 'index.npz'),
+             ids=np.array(ids, dtype=np.int64), targets=np.array(targets, dtype=np.int64),
+             shard=shard, offset=offset, height=height, width=width,
+             files=np.array(files), short_side=np.array(short_side))
+    print('{}: {} images in {} shards'.format(output_dir, count, len(files)))
+
+
+def main(args):
+    root = os.path.join(os.path.realpath(os.path.expanduser(args.data)), 'all2014')
+    ann = os.path.realpath(os.path.expanduser(args.ann))
+    output_dir = os.path.realpath(os.path.expanduser(args.output_dir))
+    for split in args.splits:
+        convert_split(root, os.path.join(ann, SPLITS[split]), os.path.join(output_dir, split),
+                      args.short_side, int(args.shard_mb * 2 ** 20), args.workers)
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('--data', type=str, required=True,
+                        help='path-to-mscoco-dataset used in dataset creation step')
+    parser.add_argument('--ann', type=str, required=True,
+                        help='new-path-to-visualwakewords-dataset used in dataset creation step')
+    parser.add_argument('--output_dir', type=str, required=True,
+                        help='Output directory of the shards, passed to the training scripts as --shards')
+    parser.add_argument('--splits', type=str, nargs='+', default=['train', 'val'], choices=list(SPLITS))
+    parser.add_argument('--short_side', type=int, default=256,
+                        help='Shorter image side stored in the shards (at least the 256 of transform_test)')
+    parser.add_argument('--shard_mb', type=float, default=1024, help='Maximum size of one shard file in MB')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Decoding processes')
+
+    args = parser.parse_args()
+    main(args)
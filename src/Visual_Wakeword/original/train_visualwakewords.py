@@ -7,6 +7,7 @@ import torch.nn as nn
 import torch.optim as optim
 import torch.nn.functional as F
 import torch.backends.cudnn as cudnn
+import torch.distributed as dist
 import torchvision
 import torchvision.models as models
 import torchvision.transforms as transforms
@@ -14,8 +15,9 @@ import os
 import argparse
 import random
 from PIL import Image
-from math import cos, pi
+from math import ceil, cos, pi
 import numpy as np
+from torch.nn.parallel import DistributedDataParallel
 from torchvision.datasets.vision import VisionDataset
 from importlib import import_module
 from pyvww.utils import VisualWakeWords
@@ -47,9 +49,71 @@ parser.add_argument('--ann', default=None, type=str,
     help='specify new-path-to-visualwakewords-dataset used in dataset creation step')
 parser.add_argument('--data', default=None, type=str, 
     help='specify path-to-mscoco-dataset used in dataset creation step')
+parser.add_argument('--shards', default=None, type=str,
+    help='read pre-resized images from the output_dir of scripts/create_vww_shards.py instead of decoding the JPEGs under --data')
+parser.add_argument('--draft', action='store_true',
+    help='let the JPEG decoder downscale by 1/2, 1/4 or 1/8 while the shorter side stays at least the transform size')
+parser.add_argument('--dist-backend', default=None, type=str, choices=['gloo', 'nccl'],
+    help='torch.distributed backend when launched with torchrun (default: nccl on GPU, gloo on CPU)')
+parser.add_argument('--bf16', action='store_true',
+    help='run forward passes under bfloat16 autocast, the RNNPool recurrences keep a float32 state')
 
 
 # Data
+# shorter side the transforms need: RandomResizedCrop(224) and Resize(256)
+DRAFT_SIZE = {'train': 224, 'val': 256}
+
+
+def open_image(path, min_side=None):
+    """Opens an image as RGB. With min_side, a JPEG is decoded at the largest
+    DCT scale (1/8, 1/4, 1/2 or 1) that keeps its shorter side at least min_side.
+    """
+    img = Image.open(path)
+    if min_side is not None and img.format == 'JPEG':
+        width, height = img.size
+        scale = min_side / min(width, height)
+        if scale < 1:
+            img.draft('RGB', (ceil(width * scale), ceil(height * scale)))
+    return img.convert('RGB')
+
+
+class ImageShards(object):
+    """Pre-decoded images written by ``scripts/create_vww_shards.py``.
+    Args:
+        path (string): Directory of one split, holding index.npz and the shard files.
+    The shard files are memory-mapped on first access, so every DataLoader
+    worker maps them itself and the pages are shared through the page cache.
+    """
+    def __init__(self, path):
+        self.path = path
+        index = np.load(os.path.join(path, 'index.npz'))
+        self.files = [str(f) for f in index['files']]
+        self.ids = index['ids']
+        self.targets = index['targets']
+        self.shard = index['shard']
+        self.offset = index['offset']
+        self.height = index['height']
+        self.width = index['width']
+        self.short_side = int(index['short_side'])
+        self.shards = None
+
+    def __getitem__(self, index):
+        if self.shards is None:
+            self.shards = [np.memmap(os.path.join(self.path, f), dtype=np.uint8, mode='r') for f in self.files]
+        h, w = int(self.height[index]), int(self.width[index])
+        start = int(self.offset[index])
+        pixels = self.shards[self.shard[index]][start:start + h * w * 3].reshape(h, w, 3)
+        return Image.fromarray(np.array(pixels))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['shards'] = None
+        return state
+
+
 class VisualWakeWordsClassification(VisionDataset):
     """`Visual Wake Words <https://arxiv.org/abs/1906.05721>`_ Dataset.
     Args:
@@ -59,16 +123,43 @@ class VisualWakeWordsClassification(VisionDataset):
             and returns a transformed version. E.g, ``transforms.ToTensor``
         target_transform (callable, optional): A function/transform that takes in the
             target and transforms it.
+        shards (string, optional): Output directory of ``scripts/create_vww_shards.py``.
+            If given, images are read from its ``split`` subdirectory and root and
+            annFile are not used.
+        draft (bool, optional): Decode JPEGs at a reduced scale that still covers
+            ``DRAFT_SIZE[split]`` (see ``open_image``).
     """
-    def __init__(self, root, annFile, transform=None, target_transform=None, split='val'):
+    def __init__(self, root, annFile, transform=None, target_transform=None, split='val', shards=None,
+                 draft=False):
         # super(VisualWakeWordsClassification, self).__init__(root, annFile, transform, target_transform, split)
-        self.vww = VisualWakeWords(annFile)
-        self.ids = list(sorted(self.vww.imgs.keys()))
         self.split = split
-
         self.transform = transform
         self.target_transform = target_transform
         self.root = root
+        self.min_side = DRAFT_SIZE[split] if draft else None
+
+        self.shards = None
+        if shards is not None:
+            self.shards = ImageShards(os.path.join(shards, split))
+            self.ids = self.shards.ids
+            self.targets = self.shards.targets
+            return
+
+        # Resolve every (file name, label) once and keep them in flat NumPy arrays,
+        # so __getitem__ is an O(1) lookup and the DataLoader workers do not each
+        # end up with a copy-on-write clone of the COCO index dicts.
+        vww = VisualWakeWords(annFile)
+        ids = list(sorted(vww.imgs.keys()))
+        paths, targets = [], []
+        for img_id in ids:
+            ann_ids = vww.getAnnIds(imgIds=img_id)
+            targets.append(vww.loadAnns(ann_ids)[0]['category_id'])
+            paths.append(vww.loadImgs(img_id)[0]['file_name'])
+        del vww
+
+        self.ids = np.array(ids, dtype=np.int64)
+        self.paths = np.array(paths, dtype=np.bytes_)
+        self.targets = np.array(targets, dtype=np.int64)
 
     def __getitem__(self, index):
         """
@@ -77,14 +168,13 @@ class VisualWakeWordsClassification(VisionDataset):
         Returns:
             tuple: Tuple (image, target). target is the index of the target class.
         """
-        vww = self.vww
-        img_id = self.ids[index]
-        ann_ids = vww.getAnnIds(imgIds=img_id)
-        target = vww.loadAnns(ann_ids)[0]['category_id']
+        target = int(self.targets[index])
 
-        path = vww.loadImgs(img_id)[0]['file_name']
-
-        img = Image.open(os.path.join(self.root, path)).convert('RGB')
+        if self.shards is not None:
+            img = self.shards[index]
+        else:
+            path = self.paths[index].decode()
+            img = open_image(os.path.join(self.root, path), self.min_side)
 
         if self.transform is not None:
             img = self.transform(img)
@@ -98,6 +188,58 @@ class VisualWakeWordsClassification(VisionDataset):
         return len(self.ids)
 
 
+# Distributed
+def init_distributed(args):
+    """Joins the process group when launched by torchrun with more than one process.
+    Sets args.distributed, args.rank and args.world_size, moves the global device
+    to the GPU of this process and keeps print() to rank 0.
+    """
+    global device
+    args.world_size = int(os.environ.get('WORLD_SIZE', 1))
+    args.rank = int(os.environ.get('RANK', 0))
+    args.distributed = args.world_size > 1
+    if not args.distributed:
+        return
+
+    if args.dist_backend is None:
+        args.dist_backend = 'nccl' if torch.cuda.is_available() else 'gloo'
+    if torch.cuda.is_available():
+        local_rank = int(os.environ.get('LOCAL_RANK', 0))
+        torch.cuda.set_device(local_rank)
+        device = torch.device('cuda', local_rank)
+    dist.init_process_group(backend=args.dist_backend, init_method='env://')
+    setup_for_distributed(args.rank == 0)
+
+
+def setup_for_distributed(is_master):
+    # disables printing when not in the master process, print(..., force=True) still prints
+    import builtins as __builtin__
+    builtin_print = __builtin__.print
+
+    def print(*args, **kwargs):
+        force = kwargs.pop('force', False)
+        if is_master or force:
+            builtin_print(*args, **kwargs)
+
+    __builtin__.print = print
+
+
+def reduce_metrics(*values):
+    # sums the metrics of all processes
+    if not (dist.is_available() and dist.is_initialized()):
+        return values
+    tensor = torch.tensor(values, dtype=torch.float64, device=device)
+    dist.all_reduce(tensor)
+    return tensor.tolist()
+
+
+def unwrap(model):
+    # the model without the DataParallel / DistributedDataParallel wrapper
+    if isinstance(model, (nn.DataParallel, DistributedDataParallel)):
+        return model.module
+    return model
+
+
 def train(epoch, model, trainloader, optimizer, criterion, args):
     # record start time
     start_time = time.time()
@@ -116,9 +258,9 @@ def train(epoch, model, trainloader, optimizer, criterion, args):
         batch_size = inputs.shape[0]
         inputs, targets = inputs.to(device), targets.to(device)
         optimizer.zero_grad()
-        outputs = model(inputs)
-
-        loss = criterion(outputs, targets)
+        with torch.autocast(device.type, dtype=torch.bfloat16, enabled=args.bf16):
+            outputs = model(inputs)
+            loss = criterion(outputs, targets)
         loss.backward()
         optimizer.step()
 
@@ -131,6 +273,7 @@ def train(epoch, model, trainloader, optimizer, criterion, args):
         if batch_idx % args.print_freq == 0:
             print(f'[batch_idx--{batch_idx}] train_loss: {train_loss / total}, acc: {correct / total}, lr: {optimizer.param_groups[0]["lr"]}')
 
+    train_loss, correct, total = reduce_metrics(train_loss, correct, total)
     print(f'total time of one epoch: {time.time() - start_time} s')
     print('train_loss: ',train_loss / total, ' acc: ', correct / total)
     print('->>lr:{:.6f}'.format(optimizer.param_groups[0]['lr']))
@@ -149,25 +292,27 @@ def test(epoch, model, testloader, criterion, args):
         for batch_idx, (inputs, targets) in enumerate(testloader):
             batch_size = inputs.shape[0]
             inputs, targets = inputs.to(device), targets.to(device)
-            outputs = model(inputs)
-
-            loss = criterion(outputs, targets)
+            with torch.autocast(device.type, dtype=torch.bfloat16, enabled=args.bf16):
+                outputs = model(inputs)
+                loss = criterion(outputs, targets)
 
             test_loss += loss.item()
             _, predicted = outputs.max(1)
             total += targets.size(0)
             correct += predicted.eq(targets).sum().item()
 
+    test_loss, correct, total = reduce_metrics(test_loss, correct, total)
     print('test_loss: ', test_loss / total, ' test_acc: ', correct / total)
 
     # save checkpoint
     print('best acc: ', best_acc)
     acc = 100.*correct/total
-    if acc > best_acc:
+    if acc > best_acc and args.rank == 0:
         print('Saving..')
 
+        # saved without the module. prefix of the DataParallel / DDP wrapper
         state = {
-            'model': model.state_dict(),
+            'model': unwrap(model).state_dict(),
             'acc': acc,
             'epoch': epoch,
         }
@@ -177,7 +322,7 @@ def test(epoch, model, testloader, criterion, args):
 
         torch.save(state, os.path.join(args.save_home, 'checkpoints', 'model_mobilenet_rnnpool.pth'))
 
-        best_acc = acc
+    best_acc = max(best_acc, acc)
 
 
 def adjust_learning_rate(optimizer, epoch, iteration, num_iter):
@@ -204,6 +349,12 @@ def adjust_learning_rate(optimizer, epoch, iteration, num_iter):
 
 if __name__ == '__main__':
     args = parser.parse_args()
+    init_distributed(args)
+    if args.distributed:
+        # --batch-size and --num-workers are totals over all processes
+        args.batch_size = max(1, args.batch_size // args.world_size)
+        args.num_workers = args.num_workers // args.world_size
+        print(f'DistributedDataParallel: {args.world_size} processes, {args.dist_backend} backend')
     print(f'Number of dataloader workers: {args.num_workers}')
     print(f'Batch size: {args.batch_size}\n')
 
@@ -228,15 +379,21 @@ if __name__ == '__main__':
     # load train dataset
     trainset = VisualWakeWordsClassification(root=os.path.join(args.data,'all2014'), 
                         annFile=os.path.join(args.ann, 'annotations/instances_train.json'), 
-                        transform=transform_train, split='train')
-    trainloader = torch.utils.data.DataLoader(trainset, batch_size=args.batch_size, shuffle=True, 
-                                              num_workers=args.num_workers)
+                        transform=transform_train, split='train', shards=args.shards,
+                        draft=args.draft)
+    trainsampler = torch.utils.data.DistributedSampler(trainset) if args.distributed else None
+    trainloader = torch.utils.data.DataLoader(trainset, batch_size=args.batch_size, shuffle=(trainsampler is None), 
+                                              sampler=trainsampler, num_workers=args.num_workers)
     print(f'Len of trainloader: {len(trainloader)}\n')
 
     # load test dataset
     testset = VisualWakeWordsClassification(root=os.path.join(args.data,'all2014'), 
                                             annFile=os.path.join(args.ann, 'annotations/instances_val.json'),
-                                            transform=transform_test, split='val')
+                                            transform=transform_test, split='val', shards=args.shards,
+                                            draft=args.draft)
+    if args.distributed:
+        # every process tests a disjoint part, without the padding of DistributedSampler
+        testset = torch.utils.data.Subset(testset, range(args.rank, len(testset), args.world_size))
     testloader = torch.utils.data.DataLoader(testset, batch_size=args.batch_size, shuffle=False, 
                                              num_workers=args.num_workers)
     print(f'Len of testloader: {len(testloader)}\n')
@@ -246,8 +403,10 @@ if __name__ == '__main__':
     model = module.mobilenetv2_rnnpool(num_classes=2, width_mult=0.35, last_channel=320)
     model = model.to(device)
 
-    # check and use DataParallel
-    if torch.cuda.is_available() and torch.cuda.device_count() > 1:
+    # check and use DistributedDataParallel or DataParallel
+    if args.distributed:
+        model = DistributedDataParallel(model, device_ids=[device.index] if device.type == 'cuda' else None)
+    elif torch.cuda.is_available() and torch.cuda.device_count() > 1:
         print(f'use {torch.cuda.device_count()} GPUs!')
         model = torch.nn.DataParallel(model)
         print(f'DataParallel device_ids: {model.device_ids}')
@@ -270,5 +429,10 @@ if __name__ == '__main__':
   
     # begin training and testing
     for epoch in range(start_epoch, start_epoch + args.epochs):
+        if trainsampler is not None:
+            trainsampler.set_epoch(epoch)
         train(epoch, model, trainloader, optimizer, criterion, args)    
         test(epoch, model, testloader, criterion, args)
+
+    if args.distributed:
+        dist.destroy_process_group()
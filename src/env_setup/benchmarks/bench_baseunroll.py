@@ -0,0 +1,85 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT license.
+
+'''
+Compares the BaseRNN unroll against the previous one, which wrote every
+step into a preallocated history and fed the cell a clone of the state:
+output agreement, time per call under torch.no_grad() and time per
+forward + backward with grad enabled.
+
+python benchmarks/bench_baseunroll.py --batch_size 256 --timesteps 8 --repeats 20
+'''
+
+import argparse
+import time
+
+import torch
+
+from edgeml_pytorch.graph.rnn import FastGRNN, GRU, LSTM
+
+
+def legacy_unroll(rnn, input):
+    timeSteps, batchSize = input.shape[0], input.shape[1]
+    num_directions = 2 if rnn._bidirectional else 1
+    shape = [timeSteps, num_directions, batchSize, rnn._hidden_size]
+    hiddenStates = rnn._zeros(input, shape)
+    hidden = rnn._zeros(input, shape[1:])
+    projections = rnn._projections(input)
+    params = rnn._batched_parameters()
+    if rnn._isLSTM:
+        cellStates = rnn._zeros(input, shape)
+        cell = rnn._zeros(input, shape[1:])
+        for i in range(timeSteps):
+            newHidden, newCell = rnn._step_lstm(projections[i], (hidden.clone(), cell.clone()), params)
+            hidden[:] = newHidden
+            cell[:] = newCell
+            hiddenStates[i] = hidden
+            cellStates[i] = cell
+        return rnn._output(hiddenStates), rnn._output(cellStates)
+    for i in range(timeSteps):
+        hidden[:] = rnn._step(projections[i], hidden.clone(), params)
+        hiddenStates[i] = hidden
+    return rnn._output(hiddenStates)
+
+
+def first(outputs):
+    return outputs[0] if isinstance(outputs, tuple) else outputs
+
+
+def timeit(fn, repeats):
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return 1000 * (time.perf_counter() - start) / repeats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='BaseRNN unroll benchmark')
+    parser.add_argument('--batch_size', default=256, type=int)
+    parser.add_argument('--timesteps', default=8, type=int)
+    parser.add_argument('--input_size', default=8, type=int)
+    parser.add_argument('--hidden_size', default=16, type=int)
+    parser.add_argument('--repeats', default=20, type=int)
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    x = torch.randn(args.timesteps, args.batch_size, args.input_size)
+    for rnn_type in [FastGRNN, GRU, LSTM]:
+        for bidirectional in [False, True]:
+            model = rnn_type(args.input_size, args.hidden_size, bidirectional=bidirectional)
+            rnn = model.unrollRNN
+            name = '{}{}'.format(rnn_type.__name__, ' bidir' if bidirectional else '')
+
+            with torch.no_grad():
+                diff = (first(legacy_unroll(rnn, x)) - first(rnn(x))).abs().max().item()
+                legacy_ms = timeit(lambda: legacy_unroll(rnn, x), args.repeats)
+                ms = timeit(lambda: rnn(x), args.repeats)
+            legacy_train_ms = timeit(lambda: first(legacy_unroll(rnn, x)).sum().backward(), args.repeats)
+            train_ms = timeit(lambda: first(rnn(x)).sum().backward(), args.repeats)
+            print('{:>15}: max abs diff {:.3e} | no_grad {:7.2f} -> {:7.2f} ms | '
+                  'train {:7.2f} -> {:7.2f} ms'.format(name, diff, legacy_ms, ms, legacy_train_ms, train_ms))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT license.
+
+'''
+Compares Bonsai.forward against the per-node loop it replaced, for
+training (finite sigmaI, with backward) and for inference (sigmaI = 1e9
+under torch.no_grad()), the latter both with the default soft tree and
+with hardPath: output agreement, prediction agreement and time per call
+as the tree deepens, to see from which depth hardPath pays off.
+
+python benchmarks/bench_bonsai.py --batch_size 1024 --depths 2 4 6 8
+'''
+
+import argparse
+import time
+
+import numpy as np
+import torch
+
+from edgeml_pytorch.graph.bonsai import Bonsai
+
+
+def legacy_forward(bonsai, X, sigmaI):
+    X_ = torch.matmul(bonsai.Z, torch.t(X)) / bonsai.projectionDimension
+    nodeProb = [1]
+    score_ = torch.matmul(bonsai.W[0:bonsai.numClasses], X_) * \
+        torch.tanh(bonsai.sigma * torch.matmul(bonsai.V[0:bonsai.numClasses], X_))
+    for i in range(1, bonsai.totalNodes):
+        W_ = bonsai.W[i * bonsai.numClasses:((i + 1) * bonsai.numClasses)]
+        V_ = bonsai.V[i * bonsai.numClasses:((i + 1) * bonsai.numClasses)]
+        T_ = torch.reshape(bonsai.T[int(np.ceil(i / 2.0) - 1.0)], [-1, bonsai.projectionDimension])
+        prob = (1 + ((-1)**(i + 1)) * torch.tanh(sigmaI * torch.matmul(T_, X_))) / 2.0
+        prob = nodeProb[int(np.ceil(i / 2.0) - 1.0)] * prob
+        nodeProb.append(prob)
+        score_ += prob * (torch.matmul(W_, X_) * torch.tanh(bonsai.sigma * torch.matmul(V_, X_)))
+    return torch.t(score_), X_
+
+
+def timeit(fn, repeats):
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return 1000 * (time.perf_counter() - start) / repeats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Bonsai forward benchmark')
+    parser.add_argument('--batch_size', default=1024, type=int)
+    parser.add_argument('--data_dim', default=64, type=int)
+    parser.add_argument('--proj_dim', default=16, type=int)
+    parser.add_argument('--num_classes', default=10, type=int)
+    parser.add_argument('--depths', default=[2, 4, 6, 8], type=int, nargs='+')
+    parser.add_argument('--repeats', default=20, type=int)
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    X = torch.randn(args.batch_size, args.data_dim)
+    for depth in args.depths:
+        bonsai = Bonsai(args.num_classes, args.data_dim, args.proj_dim, depth, sigma=1.0)
+        legacy_train = timeit(lambda: legacy_forward(bonsai, X, 4.0)[0].sum().backward(), args.repeats)
+        train = timeit(lambda: bonsai(X, 4.0)[0].sum().backward(), args.repeats)
+        with torch.no_grad():
+            soft_diff = (legacy_forward(bonsai, X, 4.0)[0] - bonsai(X, 4.0)[0]).abs().max().item()
+            reference = legacy_forward(bonsai, X, 1e9)[0]
+            legacy_infer = timeit(lambda: legacy_forward(bonsai, X, 1e9), args.repeats)
+            infer = timeit(lambda: bonsai(X, 1e9), args.repeats)
+            bonsai.hardPath = True
+            hard = bonsai(X, 1e9)[0]
+            hard_infer = timeit(lambda: bonsai(X, 1e9), args.repeats)
+            bonsai.hardPath = False
+        print('depth {}: train {:7.2f} -> {:7.2f} ms (max abs diff {:.2e}) | inference {:7.2f} -> {:7.2f} ms, '
+              'hardPath {:7.2f} ms (max abs diff {:.2e}, same argmax {:.2f}%)'.format(
+                  depth, legacy_train, train, soft_diff, legacy_infer, infer, hard_infer,
+                  (reference - hard).abs().max().item(),
+                  100.0 * (reference.argmax(1) == hard.argmax(1)).float().mean().item()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT license.
+
+'''
+Compares utils.hardThresholdInPlace against the NumPy utils.hardThreshold
+that the trainers used before: identical supports over a range of shapes
+and sparsities (including tied magnitudes), the nn.Parameter and its Adam
+state surviving the call, and the time of one IHT step over a FastGRNN
+cell's matrices.
+
+python benchmarks/bench_hardthreshold.py --hidden_size 128 --repeats 20
+'''
+
+import argparse
+import time
+
+import torch
+
+import edgeml_pytorch.utils as utils
+from edgeml_pytorch.graph.rnn import FastGRNNCell
+
+SHAPES = [(1, 1), (7, 3), (32, 32), (100, 17), (256, 512)]
+SPARSITIES = [0.0, 0.05, 0.1, 0.2, 1 / 3, 0.5, 0.9, 0.99, 1.0]
+
+
+def timeit(fn, repeats):
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return 1000 * (time.perf_counter() - start) / repeats
+
+
+def check_parity(device):
+    mismatches = 0
+    for shape in SHAPES:
+        for s in SPARSITIES:
+            for ties in [False, True]:
+                A = torch.randn(shape)
+                if ties:
+                    A = torch.round(A * 4) / 4
+                reference = utils.hardThreshold(A, s).detach()
+                B = A.clone().to(device)
+                utils.hardThresholdInPlace([B], s)
+                mismatches += int(not torch.equal(reference, B.cpu()))
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description='In-place hard thresholding benchmark')
+    parser.add_argument('--input_size', default=32, type=int)
+    parser.add_argument('--hidden_size', default=128, type=int)
+    parser.add_argument('--sparsity', default=0.2, type=float)
+    parser.add_argument('--repeats', default=20, type=int)
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    devices = ['cpu'] + (['cuda'] if torch.cuda.is_available() else [])
+    for device in devices:
+        print('{}: {} mismatches against hardThreshold'.format(device, check_parity(device)))
+
+    for device in devices:
+        cell = FastGRNNCell(args.input_size, args.hidden_size,
+                            wRank=args.hidden_size // 4, uRank=args.hidden_size // 4).to(device)
+        optimizer = torch.optim.Adam(cell.parameters())
+        cell(torch.randn(8, args.input_size, device=device),
+             torch.zeros(8, args.hidden_size, device=device)).sum().backward()
+        optimizer.step()
+        mats = cell.getVars()[:4]
+        identity = [id(m) for m in mats]
+
+        def legacy():
+            for m in mats:
+                m.data = torch.FloatTensor(utils.hardThreshold(m.data.cpu(), args.sparsity)).to(device)
+
+        legacy_ms = timeit(legacy, args.repeats)
+        mats = cell.getVars()[:4]
+        ms = timeit(lambda: utils.hardThresholdInPlace(mats, args.sparsity), args.repeats)
+        kept = all(id(m) == i and m in optimizer.state for m, i in zip(cell.getVars()[:4], identity))
+        print('{}: {:7.3f} ms -> {:7.3f} ms per IHT step, parameters and optimizer state kept: {}'.format(
+            device, legacy_ms, ms, kept))
+
+
+if __name__ == '__main__':
+    main()
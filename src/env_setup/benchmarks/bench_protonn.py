@@ -0,0 +1,109 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT license.
+
+'''
+Compares ProtoNN.forward (chunked ||a||^2 + ||b||^2 - 2ab distances) and
+its topK mode against the explicit [batch, d_cap, m] difference tensor it
+replaced (summed over all prototypes, or over the topK nearest for the
+topK mode), for m = 1k, 10k and 100k prototypes: max abs diff, time per
+call and peak resident memory. Every measurement runs in a fresh process
+so that its peak RSS is its own.
+
+python benchmarks/bench_protonn.py --batch_size 256 --prototypes 1000 10000 100000
+'''
+
+import argparse
+import multiprocessing
+import resource
+import time
+
+import numpy as np
+import torch
+
+from edgeml_pytorch.graph.protoNN import ProtoNN
+
+
+def legacy_forward(protoNN, X, topK=None):
+    W, B, Z, gamma = protoNN.W, protoNN.B, protoNN.Z, protoNN.gamma
+    WX = torch.reshape(torch.matmul(X, W), [-1, W.shape[1], 1])
+    l2sim = torch.sum(torch.pow(torch.reshape(B, [1, B.shape[0], -1]) - WX, 2), dim=1, keepdim=True)
+    M = torch.exp((-1 * gamma * gamma) * l2sim)
+    if topK is not None:
+        # keep the weights of the topK nearest prototypes only
+        nearest = torch.topk(l2sim, min(topK, l2sim.shape[2]), dim=2, largest=False)[1]
+        M = torch.zeros_like(M).scatter_(2, nearest, torch.gather(M, 2, nearest))
+    return torch.sum(torch.reshape(Z, [1] + list(Z.shape)) * M, dim=2)
+
+
+def build(args, m):
+    torch.manual_seed(0)
+    protoNN = ProtoNN(args.input_dim, args.proj_dim, m, args.num_labels, args.gamma,
+                      memoryBudget=int(args.budget_mb * 2 ** 20))
+    X = torch.randn(args.batch_size, args.input_dim)
+    return protoNN, X
+
+
+def measure(args, m, mode, queue):
+    protoNN, X = build(args, m)
+    fns = {'legacy': lambda: legacy_forward(protoNN, X),
+           'legacy_topk': lambda: legacy_forward(protoNN, X, topK=args.topk),
+           'chunked': lambda: protoNN(X),
+           'topk': lambda: protoNN(X, topK=args.topk)}
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    with torch.no_grad():
+        y = fns[mode]()
+        start = time.perf_counter()
+        for _ in range(args.repeats):
+            fns[mode]()
+        ms = 1000 * (time.perf_counter() - start) / args.repeats
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline
+    # a tensor would be shared through a file descriptor that is gone once
+    # this process exits, send a plain array
+    queue.put((ms, peak / 1024.0, y.numpy()))
+
+
+def run(args, m, mode):
+    context = multiprocessing.get_context('spawn')
+    queue = context.Queue()
+    process = context.Process(target=measure, args=(args, m, mode, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ProtoNN distance kernel benchmark')
+    parser.add_argument('--batch_size', default=256, type=int)
+    parser.add_argument('--input_dim', default=64, type=int)
+    parser.add_argument('--proj_dim', default=16, type=int)
+    parser.add_argument('--num_labels', default=10, type=int)
+    parser.add_argument('--gamma', default=0.01, type=float)
+    parser.add_argument('--prototypes', default=[1000, 10000, 100000], type=int, nargs='+')
+    parser.add_argument('--budget_mb', default=64, type=float, help='ProtoNN memoryBudget in MB')
+    parser.add_argument('--topk', default=16, type=int)
+    parser.add_argument('--legacy_max', default=100000, type=int,
+                        help='skip the explicit difference tensor above this many prototypes')
+    parser.add_argument('--repeats', default=5, type=int)
+    args = parser.parse_args()
+
+    for m in args.prototypes:
+        results = {mode: run(args, m, mode) for mode in ['chunked', 'topk']}
+        if m <= args.legacy_max:
+            results['legacy'] = run(args, m, 'legacy')
+            results['legacy_topk'] = run(args, m, 'legacy_topk')
+        print('m = {}:'.format(m))
+        # every mode against the explicit computation of the same quantity
+        references = {'chunked': 'legacy', 'topk': 'legacy_topk'}
+        for mode, (ms, peak_mb, y) in results.items():
+            diff = ''
+            if references.get(mode) in results:
+                reference = results[references[mode]][2]
+                diff = ', max abs diff {:.2e} (max {:.2e}), same argmax {:.2f}%'.format(
+                    np.abs(y - reference).max(), np.abs(reference).max(),
+                    100.0 * (y.argmax(1) == reference.argmax(1)).mean())
+            print('  {:>11}: {:9.2f} ms, peak RSS +{:8.1f} MB{}'.format(mode, ms, peak_mb, diff))
+
+
+if __name__ == '__main__':
+    main()
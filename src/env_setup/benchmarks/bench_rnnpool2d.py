@@ -0,0 +1,137 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT license.
+
+'''
+Compares RNNPool2d against the Unfold/cat/stack/Fold pipeline that
+MobileNetV2.forward used before, on the 112x112 front feature map:
+output agreement, time per call and the number of tensor copies issued.
+With the workspace arena attached the allocations of a call after the
+first are counted from the allocator events of the profiler, only the
+output map should remain. With --tile_mb the tiled mode is checked
+against the untiled output.
+
+python benchmarks/bench_rnnpool2d.py --batch_size 8 --repeats 20 --tile_mb 16
+'''
+
+import argparse
+import time
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from edgeml_pytorch.graph.rnn import Workspace
+from edgeml_pytorch.graph.rnnpool import RNNPool2d
+
+COPY_OPS = ['aten::cat', 'aten::stack', 'aten::im2col', 'aten::col2im',
+            'aten::replication_pad2d', 'aten::copy_', 'aten::clone']
+
+
+def legacy_rnnpool(pool, inputs, batch_size):
+    row_timestack = torch.cat(torch.unbind(inputs, dim=3), dim=0)
+    outputs = pool.cell_rnn(torch.stack(torch.unbind(row_timestack, dim=2)),
+                            torch.zeros(1, batch_size * pool.nRows, pool.nHiddenDims),
+                            torch.zeros(1, batch_size * pool.nRows, pool.nHiddenDims))
+    stateList = torch.split(outputs[-1], split_size_or_sections=batch_size, dim=0)
+    outputs_cols = pool.cell_bidirrnn(torch.stack(stateList),
+                                      torch.zeros(2, batch_size, pool.nHiddenDimsBiDir),
+                                      torch.zeros(2, batch_size, pool.nHiddenDimsBiDir))
+
+    col_timestack = torch.cat(torch.unbind(inputs, dim=2), dim=0)
+    outputs = pool.cell_rnn(torch.stack(torch.unbind(col_timestack, dim=2)),
+                            torch.zeros(1, batch_size * pool.nRows, pool.nHiddenDims),
+                            torch.zeros(1, batch_size * pool.nRows, pool.nHiddenDims))
+    stateList = torch.split(outputs[-1], split_size_or_sections=batch_size, dim=0)
+    outputs_rows = pool.cell_bidirrnn(torch.stack(stateList),
+                                      torch.zeros(2, batch_size, pool.nHiddenDimsBiDir),
+                                      torch.zeros(2, batch_size, pool.nHiddenDimsBiDir))
+    return torch.cat([outputs_rows[-1], outputs_cols[-1]], 1)
+
+
+def legacy_forward(pool, x):
+    batch_size = x.shape[0]
+    unfold = nn.Unfold(kernel_size=pool.kernel_size, stride=pool.stride)
+    output_x = (x.shape[2] - pool.nRows) // pool.stride[0] + 1
+    output_y = (x.shape[3] - pool.nCols) // pool.stride[1] + 1
+    fold = nn.Fold(kernel_size=(1, 1), output_size=(output_x, output_y))
+
+    patches = unfold(x)
+    patches = torch.cat(torch.unbind(patches, dim=2), dim=0)
+    patches = torch.reshape(patches, (-1, pool.inputDims, pool.nRows, pool.nCols))
+    rnnX = legacy_rnnpool(pool, patches, batch_size * output_x * output_y)
+    x = torch.stack(torch.split(rnnX, split_size_or_sections=batch_size, dim=0), dim=2)
+    x = fold(x)
+    return F.pad(x, pool.padding, mode='replicate')
+
+
+def count_copies(fn, x):
+    with torch.autograd.profiler.profile() as prof:
+        fn(x)
+    counts = {}
+    for event in prof.key_averages():
+        if event.key in COPY_OPS:
+            counts[event.key] = event.count
+    return counts
+
+
+def count_allocations(fn, x):
+    # allocator events recorded with profile_memory, frees have nbytes < 0
+    with torch.profiler.profile(activities=[torch.profiler.ProfilerActivity.CPU],
+                                profile_memory=True) as prof:
+        fn(x)
+    return sum(1 for event in prof.profiler.kineto_results.events()
+               if event.name() == '[memory]' and event.nbytes() > 0)
+
+
+def timeit(fn, x, repeats):
+    fn(x)
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn(x)
+    return (time.perf_counter() - start) / repeats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='RNNPool2d copy benchmark')
+    parser.add_argument('--batch_size', default=8, type=int)
+    parser.add_argument('--size', default=112, type=int, help='feature map height and width')
+    parser.add_argument('--channels', default=8, type=int)
+    parser.add_argument('--repeats', default=20, type=int)
+    parser.add_argument('--tile_mb', default=None, type=float,
+                        help='also time the tiled mode with this budget per tile')
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    pool = RNNPool2d(6, 4, 8, 8, args.channels, batchSweeps=True, padding=(0, 1, 0, 1))
+    pool.eval()
+    x = torch.randn(args.batch_size, args.channels, args.size, args.size)
+
+    with torch.no_grad():
+        reference = legacy_forward(pool, x)
+        output = pool(x)
+        print('max abs diff: {:.3e}'.format((reference - output).abs().max().item()))
+
+        for name, fn in [('legacy', lambda t: legacy_forward(pool, t)), ('RNNPool2d', pool)]:
+            print('{:>10}: {:8.2f} ms/call, copies {}'.format(
+                name, 1000 * timeit(fn, x, args.repeats), count_copies(fn, x)))
+
+        workspace = Workspace()
+        pool.set_workspace(workspace)
+        pooled = pool(x)
+        ms = 1000 * timeit(pool, x, args.repeats)
+        print('workspace: max abs diff {:.3e}, {:8.2f} ms/call, {} buffers ({:.1f} MB), '
+              '{} allocations per call after warm-up (1 is the output)'.format(
+                  (pooled - output).abs().max().item(), ms, workspace.allocations,
+                  workspace.nbytes / 2 ** 20, count_allocations(pool, x)))
+        pool.set_workspace(None)
+
+        if args.tile_mb is not None:
+            pool.tileBytes = int(args.tile_mb * 2 ** 20)
+            tiled = pool(x)
+            print('tiled ({} patch rows per tile): max abs diff {:.3e}, {:8.2f} ms/call'.format(
+                pool.tile_rows(x.shape[0], output.shape[2] - 1, output.shape[3] - 1),
+                (tiled - output).abs().max().item(), 1000 * timeit(pool, x, args.repeats)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT license.
+
+'''
+Scripts the unrolled RNNs (every cell type, full and low rank,
+unidirectional, shared and separate bidirectional, with and without
+return_sequence and lengths), RNNPool and RNNPool2d with torch.jit.script
+and compares the scripted modules with eager ones: max abs diff and time
+per call under torch.no_grad(). Exits with an error if any module fails
+to script or differs by more than --tolerance.
+The whole VWW model is checked by Visual_Wakeword/original/eval_script.py.
+
+python benchmarks/bench_script.py --batch_size 32 --timesteps 8
+'''
+
+import argparse
+import time
+
+import torch
+
+from edgeml_pytorch.graph.rnn import FastGRNN, FastRNN, UGRNN, GRU, LSTM
+from edgeml_pytorch.graph.rnnpool import RNNPool, RNNPool2d
+
+
+def max_diff(a, b):
+    if isinstance(a, tuple):
+        return max(max_diff(x, y) for x, y in zip(a, b))
+    return (a - b).abs().max().item()
+
+
+def timeit(fn, repeats):
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return 1000 * (time.perf_counter() - start) / repeats
+
+
+def check(name, module, inputs, args):
+    module.eval()
+    try:
+        scripted = torch.jit.script(module)
+    except Exception as e:
+        print('{:>40}: failed to script: {}'.format(name, str(e).splitlines()[0]))
+        return False
+    with torch.no_grad():
+        diff = max_diff(module(*inputs), scripted(*inputs))
+        eager_ms = timeit(lambda: module(*inputs), args.repeats)
+        script_ms = timeit(lambda: scripted(*inputs), args.repeats)
+    print('{:>40}: max abs diff {:.3e} | eager {:7.2f} ms, scripted {:7.2f} ms'.format(
+        name, diff, eager_ms, script_ms))
+    return diff <= args.tolerance
+
+
+def main():
+    parser = argparse.ArgumentParser(description='torch.jit.script parity check')
+    parser.add_argument('--batch_size', default=32, type=int)
+    parser.add_argument('--timesteps', default=8, type=int)
+    parser.add_argument('--input_size', default=8, type=int)
+    parser.add_argument('--hidden_size', default=16, type=int)
+    parser.add_argument('--rank', default=4, type=int, help='wRank and uRank of the low rank cells')
+    parser.add_argument('--repeats', default=10, type=int)
+    parser.add_argument('--tolerance', default=1e-5, type=float)
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    x = torch.randn(args.timesteps, args.batch_size, args.input_size)
+    lengths = torch.randint(0, args.timesteps + 1, (args.batch_size,))
+    directions = [('uni', dict(bidirectional=False)),
+                  ('shared', dict(bidirectional=True, is_shared_bidirectional=True)),
+                  ('separate', dict(bidirectional=True, is_shared_bidirectional=False))]
+    passed = True
+    for rnn_type in [FastGRNN, FastRNN, UGRNN, GRU, LSTM]:
+        for rank in [None, args.rank]:
+            for direction, kwargs in directions:
+                model = rnn_type(args.input_size, args.hidden_size, wRank=rank, uRank=rank, **kwargs)
+                for return_sequence in [True, False]:
+                    for with_lengths in [False, True]:
+                        name = '{} {} {} {}{}'.format(
+                            rnn_type.__name__, 'full' if rank is None else 'rank %d' % rank, direction,
+                            'sequence' if return_sequence else 'last', ' lengths' if with_lengths else '')
+                        inputs = (x, None, None, return_sequence, lengths if with_lengths else None)
+                        passed = check(name, model, inputs, args) and passed
+
+    patches = torch.randn(args.batch_size, 4, 8, 8)
+    for batchSweeps in [False, True]:
+        pool = RNNPool(8, 8, 8, 8, 4, batchSweeps=batchSweeps)
+        passed = check('RNNPool batchSweeps={}'.format(batchSweeps), pool,
+                       (patches, args.batch_size), args) and passed
+    feature_map = torch.randn(2, 4, 28, 28)
+    for tileBytes in [None, 2 ** 16]:
+        pool = RNNPool2d(6, 4, 8, 8, 4, batchSweeps=True, padding=(0, 1, 0, 1), tileBytes=tileBytes)
+        passed = check('RNNPool2d tileBytes={}'.format(tileBytes), pool, (feature_map,), args) and passed
+
+    if not passed:
+        raise SystemExit('a scripted module failed to compile or differs from eager')
+
+
+if __name__ == '__main__':
+    main()
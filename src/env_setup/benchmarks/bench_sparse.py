@@ -0,0 +1,85 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT license.
+
+'''
+Dense against sparse execution of a FastGRNN unroll in eval mode as the
+density of W and U goes down, to locate the crossover that
+rnn.SPARSE_THRESHOLD should sit at on this machine. W and U are hard
+thresholded like FastTrainer.runHardThrsd does. For every density it also
+reports the bytes the cell holds in eval mode (dense parameters plus the
+sparse copies) against the estimate of utils.estimateNNZ.
+
+python benchmarks/bench_sparse.py --batch_size 128 --timesteps 16 --hidden_size 64 128 256
+'''
+
+import argparse
+import time
+
+import torch
+
+import edgeml_pytorch.utils as utils
+from edgeml_pytorch.graph.rnn import BaseRNN, FastGRNNCell
+
+DENSITIES = [1.0, 0.5, 0.3, 0.2, 0.1, 0.05, 0.02]
+
+
+def timeit(fn, repeats):
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return 1000 * (time.perf_counter() - start) / repeats
+
+
+def estimated_bytes(cell, density):
+    size = 0
+    for name, param in cell.named_parameters():
+        size += utils.estimateNNZ(param, density if name[0] in "WU" else 1.0)[1]
+    return size
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Sparse W/U crossover benchmark')
+    parser.add_argument('--batch_size', default=128, type=int)
+    parser.add_argument('--timesteps', default=16, type=int)
+    parser.add_argument('--input_size', default=32, type=int)
+    parser.add_argument('--hidden_size', default=[64, 128, 256], type=int, nargs='+')
+    parser.add_argument('--repeats', default=20, type=int)
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    x = torch.randn(args.timesteps, args.batch_size, args.input_size)
+    for hidden_size in args.hidden_size:
+        print('hidden {}:'.format(hidden_size))
+        crossover = None
+        for density in DENSITIES:
+            cell = FastGRNNCell(args.input_size, hidden_size, wSparsity=density, uSparsity=density)
+            with torch.no_grad():
+                for param in [cell.W, cell.U]:
+                    param.copy_(utils.hardThreshold(param, density))
+            rnn = BaseRNN(cell)
+            rnn.eval()
+
+            with torch.no_grad():
+                cell.sparse_threshold = 0.0
+                dense = rnn(x)
+                dense_ms = timeit(lambda: rnn(x), args.repeats)
+                cell.sparse_threshold = 1.01
+                sparse = rnn(x)
+                sparse_ms = timeit(lambda: rnn(x), args.repeats)
+            dense_bytes, sparse_bytes = cell.get_memory_size()
+            cell.sparse_threshold = 0.0
+            if crossover is None and sparse_ms < dense_ms:
+                crossover = density
+            print('  density {:4.2f}: dense {:7.2f} ms, sparse {:7.2f} ms, max abs diff {:.2e} | '
+                  'bytes dense {:8d} + sparse copies {:8d}, estimateNNZ {:8d}'.format(
+                      density, dense_ms, sparse_ms, (dense - sparse).abs().max().item(),
+                      dense_bytes, sparse_bytes, int(estimated_bytes(cell, density))))
+        if crossover is None:
+            print('  sparse is never faster, keep sparse_threshold at 0')
+        else:
+            print('  sparse is faster from density {}'.format(crossover))
+
+
+if __name__ == '__main__':
+    main()
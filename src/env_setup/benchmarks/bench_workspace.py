@@ -0,0 +1,74 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT license.
+
+'''
+Checks the Workspace unroll of BaseRNN for every cell type, full and low
+rank, unidirectional, shared and separate bidirectional, with and without
+return_sequence: max abs difference to the unroll without workspace and
+the allocations of a call after warm-up, counted from the allocator
+events of the profiler (the Workspace.allocations counter only sees the
+arena). Every row should report 0 allocations.
+
+python benchmarks/bench_workspace.py --batch_size 64 --timesteps 8
+'''
+
+import argparse
+
+import torch
+
+from edgeml_pytorch.graph.rnn import FastGRNN, FastRNN, UGRNN, GRU, LSTM, Workspace
+
+
+def count_allocations(fn):
+    # allocator events recorded with profile_memory, frees have nbytes < 0
+    with torch.profiler.profile(activities=[torch.profiler.ProfilerActivity.CPU],
+                                profile_memory=True) as prof:
+        fn()
+    return sum(1 for event in prof.profiler.kineto_results.events()
+               if event.name() == '[memory]' and event.nbytes() > 0)
+
+
+def max_diff(a, b):
+    if isinstance(a, tuple):
+        return max(max_diff(x, y) for x, y in zip(a, b))
+    return (a - b).abs().max().item()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='BaseRNN workspace check')
+    parser.add_argument('--batch_size', default=64, type=int)
+    parser.add_argument('--timesteps', default=8, type=int)
+    parser.add_argument('--input_size', default=8, type=int)
+    parser.add_argument('--hidden_size', default=16, type=int)
+    parser.add_argument('--rank', default=4, type=int, help='wRank and uRank of the low rank cells')
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    x = torch.randn(args.timesteps, args.batch_size, args.input_size)
+    directions = [('uni', dict(bidirectional=False)),
+                  ('shared', dict(bidirectional=True, is_shared_bidirectional=True)),
+                  ('separate', dict(bidirectional=True, is_shared_bidirectional=False))]
+    failed = False
+    with torch.no_grad():
+        for rnn_type in [FastGRNN, FastRNN, UGRNN, GRU, LSTM]:
+            for rank in [None, args.rank]:
+                for direction, kwargs in directions:
+                    model = rnn_type(args.input_size, args.hidden_size, wRank=rank, uRank=rank, **kwargs)
+                    rnn = model.unrollRNN
+                    for return_sequence in [True, False]:
+                        rnn.workspace = None
+                        reference = rnn(x, return_sequence=return_sequence)
+                        rnn.workspace = Workspace()
+                        output = rnn(x, return_sequence=return_sequence)
+                        diff = max_diff(reference, output)
+                        allocations = count_allocations(lambda: rnn(x, return_sequence=return_sequence))
+                        failed = failed or diff > 1e-5 or allocations > 0
+                        print('{:>8} {:>9} {:>8} {:>9}: max abs diff {:.3e}, {} allocations'.format(
+                            rnn_type.__name__, 'full' if rank is None else 'rank %d' % rank, direction,
+                            'sequence' if return_sequence else 'last', diff, allocations))
+    if failed:
+        raise SystemExit('workspace unroll differs or allocates')
+
+
+if __name__ == '__main__':
+    main()
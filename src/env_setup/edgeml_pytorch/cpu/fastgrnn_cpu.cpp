@@ -0,0 +1,596 @@
+// Copyright (c) Microsoft Corporation. All rights reserved.
+// Licensed under the MIT license.
+
+// CPU counterpart of fastgrnn_cuda with the same four entry points. The
+// matmuls go through ATen and the element-wise part of every step is one
+// fused loop parallelised with at::parallel_for (OpenMP in the standard
+// PyTorch builds). The unrolled versions compute the input side of all
+// timesteps, and the weight gradients of all timesteps, with one GEMM each.
+
+#include <torch/extension.h>
+#include <ATen/Parallel.h>
+
+#include <cmath>
+#include <vector>
+
+namespace {
+template <typename scalar_t>
+inline scalar_t sigmoid(scalar_t z) {
+  return 1.0 / (1.0 + std::exp(-z));
+}
+
+template <typename scalar_t>
+inline scalar_t relu(scalar_t z) {
+  return z > 0 ? z : 0;
+}
+
+template <typename scalar_t>
+inline scalar_t tanh(scalar_t z) {
+  return std::tanh(z);
+}
+
+template <typename scalar_t>
+inline scalar_t d_sigmoid(scalar_t sig_z) {
+  return (1.0 - sig_z) * sig_z;
+}
+
+template <typename scalar_t>
+inline scalar_t d_relu(scalar_t relu_z) {
+  return (relu_z == 0)? 0: 1;
+}
+
+template <typename scalar_t>
+inline scalar_t d_tanh(scalar_t tan_z) {
+  return 1.0 - (tan_z * tan_z);
+}
+
+// elements of [batch, state] handled by one task
+constexpr int64_t GRAIN_SIZE = 2048;
+
+template <typename scalar_t, scalar_t (*non_linearity) (scalar_t)>
+void fastgrnn_cpu_forward_kernel(
+  scalar_t* new_h,
+  scalar_t* z,
+  scalar_t* h_prime,
+  const scalar_t* pre_comp,
+  const scalar_t* bias_z,
+  const scalar_t* bias_h_prime,
+  const scalar_t nu,
+  const scalar_t zeta,
+  const scalar_t* old_h,
+  const int64_t batch_size,
+  const int64_t state_size) {
+  at::parallel_for(0, batch_size * state_size, GRAIN_SIZE, [&](int64_t begin, int64_t end) {
+    for (int64_t i = begin; i < end; i++) {
+      const int64_t c = i % state_size;
+      z[i] = non_linearity(pre_comp[i] + bias_z[c]);
+      h_prime[i] = std::tanh(pre_comp[i] + bias_h_prime[c]);
+      new_h[i] = (zeta * (1.0 - z[i]) + nu) * h_prime[i] + old_h[i] * z[i];
+    }
+  });
+}
+
+// Gradients of one step given grad_h. The bias, zeta and nu gradients are
+// accumulated per element (so that the unrolled backward can add every
+// step) and reduced over the batch by the caller.
+template <typename scalar_t, scalar_t (*d_non_linearity) (scalar_t)>
+void fastgrnn_cpu_backward_kernel(
+  scalar_t* d_precomp,
+  scalar_t* d_old_h,
+  scalar_t* d_bias_z,
+  scalar_t* d_bias_h_prime,
+  scalar_t* d_nu,
+  scalar_t* d_zeta,
+  const scalar_t* grad_h,
+  const scalar_t* z,
+  const scalar_t* h_prime,
+  const scalar_t zeta,
+  const scalar_t nu,
+  const scalar_t* old_h,
+  const int64_t size) {
+  at::parallel_for(0, size, GRAIN_SIZE, [&](int64_t begin, int64_t end) {
+    for (int64_t i = begin; i < end; i++) {
+      d_old_h[i] = z[i] * grad_h[i];
+      const scalar_t temp_bias_h_prime = (zeta * (1.0 - z[i]) + nu) * d_tanh(h_prime[i]) * grad_h[i];
+      const scalar_t temp_bias_z = (old_h[i] - zeta * h_prime[i]) * d_non_linearity(z[i]) * grad_h[i];
+      d_bias_h_prime[i] += temp_bias_h_prime;
+      d_bias_z[i] += temp_bias_z;
+      d_precomp[i] = temp_bias_z + temp_bias_h_prime;
+      d_zeta[i] += (1.0 - z[i]) * h_prime[i] * grad_h[i];
+      d_nu[i] += h_prime[i] * grad_h[i];
+    }
+  });
+}
+
+template <typename scalar_t>
+void forward_step(
+  int z_non_linearity,
+  torch::Tensor new_h,
+  torch::Tensor z,
+  torch::Tensor h_prime,
+  torch::Tensor pre_comp,
+  torch::Tensor bias_z,
+  torch::Tensor bias_h_prime,
+  scalar_t nu,
+  scalar_t zeta,
+  torch::Tensor old_h) {
+  auto kernel = fastgrnn_cpu_forward_kernel<scalar_t, sigmoid<scalar_t>>;
+  if (z_non_linearity == 1) {
+    kernel = fastgrnn_cpu_forward_kernel<scalar_t, relu<scalar_t>>;
+  } else if (z_non_linearity == 2) {
+    kernel = fastgrnn_cpu_forward_kernel<scalar_t, tanh<scalar_t>>;
+  }
+  kernel(
+    new_h.data_ptr<scalar_t>(),
+    z.data_ptr<scalar_t>(),
+    h_prime.data_ptr<scalar_t>(),
+    pre_comp.data_ptr<scalar_t>(),
+    bias_z.data_ptr<scalar_t>(),
+    bias_h_prime.data_ptr<scalar_t>(),
+    nu,
+    zeta,
+    old_h.data_ptr<scalar_t>(),
+    old_h.size(0),
+    old_h.size(1));
+}
+
+template <typename scalar_t>
+void backward_step(
+  int z_non_linearity,
+  torch::Tensor d_precomp,
+  torch::Tensor d_old_h,
+  torch::Tensor d_bias_z,
+  torch::Tensor d_bias_h_prime,
+  torch::Tensor d_nu,
+  torch::Tensor d_zeta,
+  torch::Tensor grad_h,
+  torch::Tensor z,
+  torch::Tensor h_prime,
+  scalar_t zeta,
+  scalar_t nu,
+  torch::Tensor old_h) {
+  auto kernel = fastgrnn_cpu_backward_kernel<scalar_t, d_sigmoid<scalar_t>>;
+  if (z_non_linearity == 1) {
+    kernel = fastgrnn_cpu_backward_kernel<scalar_t, d_relu<scalar_t>>;
+  } else if (z_non_linearity == 2) {
+    kernel = fastgrnn_cpu_backward_kernel<scalar_t, d_tanh<scalar_t>>;
+  }
+  kernel(
+    d_precomp.data_ptr<scalar_t>(),
+    d_old_h.data_ptr<scalar_t>(),
+    d_bias_z.data_ptr<scalar_t>(),
+    d_bias_h_prime.data_ptr<scalar_t>(),
+    d_nu.data_ptr<scalar_t>(),
+    d_zeta.data_ptr<scalar_t>(),
+    grad_h.data_ptr<scalar_t>(),
+    z.data_ptr<scalar_t>(),
+    h_prime.data_ptr<scalar_t>(),
+    zeta,
+    nu,
+    old_h.data_ptr<scalar_t>(),
+    old_h.numel());
+}
+
+// bias, zeta and nu gradients from their per element accumulators
+void reduce_gradients(
+  torch::Tensor& d_bias_z,
+  torch::Tensor& d_bias_h_prime,
+  torch::Tensor& d_zeta,
+  torch::Tensor& d_nu,
+  torch::Tensor zeta,
+  torch::Tensor nu) {
+  d_bias_z = d_bias_z.sum(0, true);
+  d_bias_h_prime = d_bias_h_prime.sum(0, true);
+  d_zeta = (d_zeta.sum(0, true)).sum(1, true) * (1 - zeta) * zeta;
+  d_nu = (d_nu.sum(0, true)).sum(1, true) * (1 - nu) * nu;
+}
+} // namespace
+
+std::vector<torch::Tensor> fastgrnn_cpu_forward(
+    torch::Tensor input,
+    torch::Tensor w,
+    torch::Tensor u,
+    torch::Tensor bias_z,
+    torch::Tensor bias_h_prime,
+    torch::Tensor zeta,
+    torch::Tensor nu,
+    torch::Tensor old_h,
+    int z_non_linearity,
+    torch::Tensor w1,
+    torch::Tensor w2,
+    torch::Tensor u1,
+    torch::Tensor u2) {
+  bool w_low_rank = w1.size(0) != 0;
+  bool u_low_rank = u1.size(0) != 0;
+  if (w_low_rank){
+    w = torch::mm(w2, w1);
+  }
+  if (u_low_rank){
+    u = torch::mm(u2, u1);
+  }
+
+  auto pre_comp = torch::addmm(torch::mm(input, w.transpose(0, 1)), old_h, u.transpose(0, 1));
+  nu = torch::sigmoid(nu);
+  zeta = torch::sigmoid(zeta);
+  auto new_h = torch::empty_like(old_h);
+  auto z = torch::empty_like(old_h);
+  auto h_prime = torch::empty_like(old_h);
+  AT_DISPATCH_FLOATING_TYPES(pre_comp.scalar_type(), "fastgrnn_forward_cpu", ([&] {
+    forward_step<scalar_t>(z_non_linearity, new_h, z, h_prime, pre_comp, bias_z, bias_h_prime,
+                           nu.item<scalar_t>(), zeta.item<scalar_t>(), old_h);
+  }));
+  return {new_h, z, h_prime};
+}
+
+std::vector<torch::Tensor> fastgrnn_cpu_backward(
+  torch::Tensor grad_h,
+  torch::Tensor input,
+  torch::Tensor old_h,
+  torch::Tensor zeta,
+  torch::Tensor nu,
+  torch::Tensor w,
+  torch::Tensor u,
+  int z_non_linearity,
+  torch::Tensor z,
+  torch::Tensor h_prime,
+  torch::Tensor w1,
+  torch::Tensor w2,
+  torch::Tensor u1,
+  torch::Tensor u2) {
+  auto d_precomp = torch::empty_like(old_h);
+  auto d_old_h = torch::empty_like(old_h);
+  auto d_bias_z = torch::zeros_like(old_h);
+  auto d_bias_h_prime = torch::zeros_like(old_h);
+  auto d_nu = torch::zeros_like(old_h);
+  auto d_zeta = torch::zeros_like(old_h);
+  auto d_w1 = torch::empty(0);
+  auto d_w2 = torch::empty(0);
+  auto d_u1 = torch::empty(0);
+  auto d_u2 = torch::empty(0);
+
+  bool w_low_rank = w1.size(0) != 0;
+  bool u_low_rank = u1.size(0) != 0;
+  if(w_low_rank) {
+    w = torch::mm(w2, w1);
+  }
+  if (u_low_rank) {
+    u = torch::mm(u2, u1);
+  }
+  zeta = torch::sigmoid(zeta);
+  nu = torch::sigmoid(nu);
+
+  AT_DISPATCH_FLOATING_TYPES(old_h.scalar_type(), "fastgrnn_backward_cpu", ([&] {
+    backward_step<scalar_t>(z_non_linearity, d_precomp, d_old_h, d_bias_z, d_bias_h_prime, d_nu, d_zeta,
+                            grad_h, z, h_prime, zeta.item<scalar_t>(), nu.item<scalar_t>(), old_h);
+  }));
+
+  d_old_h = torch::addmm(d_old_h, d_precomp, u);
+  auto d_input = torch::mm(d_precomp, w);
+  auto d_w = torch::mm(d_precomp.transpose(0, 1), input);
+  auto d_u = torch::mm(d_precomp.transpose(0, 1), old_h);
+  reduce_gradients(d_bias_z, d_bias_h_prime, d_zeta, d_nu, zeta, nu);
+  if (w_low_rank) {
+    d_w1 = torch::mm(w2.transpose(0, 1), d_w);
+    d_w2 = torch::mm(d_w, w1.transpose(0, 1));
+    d_w = torch::empty(0);
+  }
+  if(u_low_rank) {
+    d_u1 = torch::mm(u2.transpose(0, 1), d_u);
+    d_u2 = torch::mm(d_u, u1.transpose(0, 1));
+    d_u = torch::empty(0);
+  }
+  return {d_input, d_bias_z, d_bias_h_prime, d_zeta, d_nu, d_old_h, d_w, d_u, d_w1, d_w2, d_u1, d_u2};
+}
+
+std::vector<torch::Tensor> fastgrnn_unroll_cpu_forward(
+  torch::Tensor input,
+  torch::Tensor w,
+  torch::Tensor u,
+  torch::Tensor bias_z,
+  torch::Tensor bias_h_prime,
+  torch::Tensor zeta,
+  torch::Tensor nu,
+  torch::Tensor initial_h,
+  int z_non_linearity,
+  torch::Tensor w1,
+  torch::Tensor w2,
+  torch::Tensor u1,
+  torch::Tensor u2) {
+  const auto timesteps = input.size(0);
+  const auto batch_size = initial_h.size(0);
+  const auto state_size = initial_h.size(1);
+
+  bool w_low_rank = w1.size(0) != 0;
+  bool u_low_rank = u1.size(0) != 0;
+  if (w_low_rank){
+    w = torch::mm(w2, w1);
+  }
+  if (u_low_rank){
+    u = torch::mm(u2, u1);
+  }
+  auto u_t = u.transpose(0, 1);
+
+  // input side of every timestep in a single GEMM
+  auto pre_w = torch::mm(input.reshape({timesteps * batch_size, input.size(2)}), w.transpose(0, 1))
+                 .view({timesteps, batch_size, state_size});
+
+  auto hidden_states = torch::empty({timesteps, batch_size, state_size}, initial_h.options());
+  auto z_s = torch::empty_like(hidden_states);
+  auto h_prime_s = torch::empty_like(hidden_states);
+  auto pre_comp = torch::empty_like(initial_h);
+  auto prev_h = initial_h;
+
+  zeta = torch::sigmoid(zeta);
+  nu = torch::sigmoid(nu);
+
+  AT_DISPATCH_FLOATING_TYPES(initial_h.scalar_type(), "fastgrnn_unroll_forward_cpu", ([&] {
+    const scalar_t nu_ = nu.item<scalar_t>();
+    const scalar_t zeta_ = zeta.item<scalar_t>();
+    for (int64_t t = 0; t < timesteps; t++) {
+      torch::addmm_out(pre_comp, pre_w[t], prev_h, u_t);
+      auto new_h = hidden_states[t];
+      forward_step<scalar_t>(z_non_linearity, new_h, z_s[t], h_prime_s[t], pre_comp,
+                             bias_z, bias_h_prime, nu_, zeta_, prev_h);
+      prev_h = new_h;
+    }
+  }));
+  return {hidden_states, z_s, h_prime_s};
+}
+
+std::vector<torch::Tensor> fastgrnn_unroll_cpu_backward(
+  torch::Tensor grad_h,
+  torch::Tensor input,
+  torch::Tensor hidden_states,
+  torch::Tensor zeta,
+  torch::Tensor nu,
+  torch::Tensor w,
+  torch::Tensor u,
+  torch::Tensor z,
+  torch::Tensor h_prime,
+  torch::Tensor initial_h,
+  int z_non_linearity,
+  torch::Tensor w1,
+  torch::Tensor w2,
+  torch::Tensor u1,
+  torch::Tensor u2) {
+  const auto timesteps = hidden_states.size(0);
+  const auto batch_size = hidden_states.size(1);
+  const auto state_size = hidden_states.size(2);
+
+  auto d_bias_z = torch::zeros_like(initial_h);
+  auto d_bias_h_prime = torch::zeros_like(initial_h);
+  auto d_nu = torch::zeros_like(initial_h);
+  auto d_zeta = torch::zeros_like(initial_h);
+  auto d_w1 = torch::empty(0);
+  auto d_w2 = torch::empty(0);
+  auto d_u1 = torch::empty(0);
+  auto d_u2 = torch::empty(0);
+
+  bool w_low_rank = w1.size(0) != 0;
+  bool u_low_rank = u1.size(0) != 0;
+  if(w_low_rank) {
+    w = torch::mm(w2, w1);
+  }
+  if (u_low_rank) {
+    u = torch::mm(u2, u1);
+  }
+  zeta = torch::sigmoid(zeta);
+  nu = torch::sigmoid(nu);
+
+  // d_precomp of every step is kept so that the weight and input gradients
+  // are one GEMM each after the loop
+  auto d_precomp = torch::empty_like(hidden_states);
+  auto grad_curr_h = torch::empty_like(initial_h);
+  auto d_z_h = torch::empty_like(initial_h);
+  auto d_old_h = torch::zeros_like(initial_h);
+
+  AT_DISPATCH_FLOATING_TYPES(initial_h.scalar_type(), "fastgrnn_unroll_backward_cpu", ([&] {
+    const scalar_t nu_ = nu.item<scalar_t>();
+    const scalar_t zeta_ = zeta.item<scalar_t>();
+    for (int64_t t = timesteps - 1; t >= 0; t--) {
+      torch::add_out(grad_curr_h, grad_h[t], d_old_h);
+      auto prev_h = (t == 0) ? initial_h : hidden_states[t - 1];
+      auto d_precomp_t = d_precomp[t];
+      backward_step<scalar_t>(z_non_linearity, d_precomp_t, d_z_h, d_bias_z, d_bias_h_prime, d_nu, d_zeta,
+                              grad_curr_h, z[t], h_prime[t], zeta_, nu_, prev_h);
+      torch::addmm_out(d_old_h, d_z_h, d_precomp_t, u);
+    }
+  }));
+
+  auto d_precomp_2d = d_precomp.view({timesteps * batch_size, state_size});
+  auto prev_hs = torch::cat({initial_h.unsqueeze(0), hidden_states.narrow(0, 0, timesteps - 1)}, 0)
+                   .view({timesteps * batch_size, state_size});
+  auto d_input = torch::mm(d_precomp_2d, w).view_as(input);
+  auto d_w = torch::mm(d_precomp_2d.transpose(0, 1), input.reshape({timesteps * batch_size, input.size(2)}));
+  auto d_u = torch::mm(d_precomp_2d.transpose(0, 1), prev_hs);
+  reduce_gradients(d_bias_z, d_bias_h_prime, d_zeta, d_nu, zeta, nu);
+  if (w_low_rank) {
+    d_w1 = torch::mm(w2.transpose(0, 1), d_w);
+    d_w2 = torch::mm(d_w, w1.transpose(0, 1));
+    d_w = torch::empty(0);
+  }
+  if(u_low_rank) {
+    d_u1 = torch::mm(u2.transpose(0, 1), d_u);
+    d_u2 = torch::mm(d_u, u1.transpose(0, 1));
+    d_u = torch::empty(0);
+  }
+  return {d_input, d_bias_z, d_bias_h_prime, d_zeta, d_nu, d_old_h, d_w, d_u, d_w1, d_w2, d_u1, d_u2};
+}
+
+#define CHECK_CPU(x) TORCH_CHECK(!x.is_cuda(), #x " must be a CPU tensor")
+#define CHECK_CONTIGUOUS(x) TORCH_CHECK(x.is_contiguous(), #x " must be contiguous")
+#define CHECK_INPUT(x) CHECK_CPU(x); CHECK_CONTIGUOUS(x)
+#define CHECK_NON_LINEARITY(x) TORCH_CHECK(x >= 0 && x <= 2, "unknown gate non-linearity ", x)
+
+std::vector<torch::Tensor> fastgrnn_forward(
+  torch::Tensor input,
+  torch::Tensor w,
+  torch::Tensor u,
+  torch::Tensor bias_gate,
+  torch::Tensor bias_update,
+  torch::Tensor zeta,
+  torch::Tensor nu,
+  torch::Tensor old_h,
+  int z_non_linearity,
+  torch::Tensor w1,
+  torch::Tensor w2,
+  torch::Tensor u1,
+  torch::Tensor u2) {
+  CHECK_INPUT(input);
+  if(w1.size(0) == 0) {
+    CHECK_INPUT(w);
+  } else {
+    CHECK_INPUT(w1);
+    CHECK_INPUT(w2);
+  }
+  if (u1.size(0) == 0) {
+    CHECK_INPUT(u);
+  } else {
+    CHECK_INPUT(u1);
+    CHECK_INPUT(u2);
+  }
+  CHECK_INPUT(bias_gate);
+  CHECK_INPUT(bias_update);
+  CHECK_INPUT(zeta);
+  CHECK_INPUT(nu);
+  CHECK_INPUT(old_h);
+  CHECK_NON_LINEARITY(z_non_linearity);
+
+  return fastgrnn_cpu_forward(input, w, u, bias_gate, bias_update, zeta, nu, old_h, z_non_linearity, w1, w2, u1, u2);
+}
+
+std::vector<torch::Tensor> fastgrnn_backward(
+  torch::Tensor grad_h,
+  torch::Tensor input,
+  torch::Tensor old_h,
+  torch::Tensor zeta,
+  torch::Tensor nu,
+  torch::Tensor w,
+  torch::Tensor u,
+  torch::Tensor z,
+  torch::Tensor h_prime,
+  torch::Tensor w1,
+  torch::Tensor w2,
+  torch::Tensor u1,
+  torch::Tensor u2,
+  int z_non_linearity) {
+  CHECK_INPUT(grad_h);
+  CHECK_INPUT(input);
+  CHECK_INPUT(old_h);
+  CHECK_INPUT(zeta);
+  CHECK_INPUT(nu);
+  CHECK_INPUT(z);
+  CHECK_INPUT(h_prime);
+  if(w1.size(0) == 0) {
+    CHECK_INPUT(w);
+  } else {
+    CHECK_INPUT(w1);
+    CHECK_INPUT(w2);
+  }
+  if (u1.size(0) == 0) {
+    CHECK_INPUT(u);
+  } else {
+    CHECK_INPUT(u1);
+    CHECK_INPUT(u2);
+  }
+  CHECK_NON_LINEARITY(z_non_linearity);
+
+  return fastgrnn_cpu_backward(grad_h, input, old_h, zeta, nu, w, u, z_non_linearity, z, h_prime, w1, w2, u1, u2);
+}
+
+std::vector<torch::Tensor> fastgrnn_unroll_forward(
+  torch::Tensor input,
+  torch::Tensor w,
+  torch::Tensor u,
+  torch::Tensor bias_z,
+  torch::Tensor bias_h_prime,
+  torch::Tensor zeta,
+  torch::Tensor nu,
+  torch::Tensor initial_h,
+  int z_non_linearity,
+  torch::Tensor w1,
+  torch::Tensor w2,
+  torch::Tensor u1,
+  torch::Tensor u2) {
+  CHECK_INPUT(input);
+  if(w1.size(0) == 0) {
+    CHECK_INPUT(w);
+  } else {
+    CHECK_INPUT(w1);
+    CHECK_INPUT(w2);
+  }
+  if (u1.size(0) == 0) {
+    CHECK_INPUT(u);
+  } else {
+    CHECK_INPUT(u1);
+    CHECK_INPUT(u2);
+  }
+  CHECK_INPUT(bias_z);
+  CHECK_INPUT(bias_h_prime);
+  CHECK_INPUT(initial_h);
+  CHECK_INPUT(zeta);
+  CHECK_INPUT(nu);
+  CHECK_NON_LINEARITY(z_non_linearity);
+  return fastgrnn_unroll_cpu_forward(input, w, u, bias_z, bias_h_prime, zeta, nu, initial_h, z_non_linearity, w1, w2, u1, u2);
+}
+
+std::vector<torch::Tensor> fastgrnn_unroll_backward(
+  torch::Tensor grad_h,
+  torch::Tensor input,
+  torch::Tensor hidden_states,
+  torch::Tensor zeta,
+  torch::Tensor nu,
+  torch::Tensor w,
+  torch::Tensor u,
+  torch::Tensor z,
+  torch::Tensor h_prime,
+  torch::Tensor initial_h,
+  torch::Tensor w1,
+  torch::Tensor w2,
+  torch::Tensor u1,
+  torch::Tensor u2,
+  int z_non_linearity) {
+  CHECK_INPUT(grad_h);
+  CHECK_INPUT(input);
+  CHECK_INPUT(hidden_states);
+  CHECK_INPUT(z);
+  CHECK_INPUT(h_prime);
+  if(w1.size(0) == 0) {
+    CHECK_INPUT(w);
+  } else {
+    CHECK_INPUT(w1);
+    CHECK_INPUT(w2);
+  }
+  if (u1.size(0) == 0) {
+    CHECK_INPUT(u);
+  } else {
+    CHECK_INPUT(u1);
+    CHECK_INPUT(u2);
+  }
+  CHECK_INPUT(zeta);
+  CHECK_INPUT(nu);
+  CHECK_INPUT(initial_h);
+  CHECK_NON_LINEARITY(z_non_linearity);
+
+  return fastgrnn_unroll_cpu_backward(
+    grad_h,
+    input,
+    hidden_states,
+    zeta,
+    nu,
+    w,
+    u,
+    z,
+    h_prime,
+    initial_h,
+    z_non_linearity,
+    w1, w2, u1, u2);
+}
+
+
+PYBIND11_MODULE(TORCH_EXTENSION_NAME, m) {
+  m.def("forward", &fastgrnn_forward, "FastGRNN forward (CPU)");
+  m.def("backward", &fastgrnn_backward, "FastGRNN backward (CPU)");
+  m.def("forward_unroll", &fastgrnn_unroll_forward, "FastGRNN Unrolled forward (CPU)");
+  m.def("backward_unroll", &fastgrnn_unroll_backward, "FastGRNN Unrolled backward (CPU)");
+}
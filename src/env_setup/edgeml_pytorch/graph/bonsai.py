@@ -5,11 +5,14 @@ import torch
 import torch.nn as nn
 import numpy as np
 
+# sigmaI from which the node indicators are treated as exact 0/1 steps
+HARD_PATH_SIGMAI = 1e9
+
 
 class Bonsai(nn.Module):
 
     def __init__(self, numClasses, dataDimension, projectionDimension,
-                 treeDepth, sigma, W=None, T=None, V=None, Z=None):
+                 treeDepth, sigma, W=None, T=None, V=None, Z=None, hardPath=False):
         super(Bonsai, self).__init__()
         '''
         Expected Dimensions:
@@ -28,6 +31,11 @@ class Bonsai(nn.Module):
         sigmaI - has to be set to infinity(1e9 for practice)
         while doing testing/inference
         numClasses will be reset to 1 in binary case
+
+        hardPath - evaluate only the active root-to-leaf path at inference,
+        see hardPathScore. Off by default: it only beats the vectorized
+        soft tree on deep trees (from about treeDepth 6 on CPU), see
+        benchmarks/bench_bonsai.py
         '''
 
         self.dataDimension = dataDimension
@@ -40,6 +48,7 @@ class Bonsai(nn.Module):
 
         self.treeDepth = treeDepth
         self.sigma = sigma
+        self.hardPath = hardPath
 
         self.internalNodes = 2**self.treeDepth - 1
         self.totalNodes = 2 * self.internalNodes + 1
@@ -89,39 +98,73 @@ class Bonsai(nn.Module):
             T = nn.Parameter(T)
         return T
 
+    def nodeScores(self, X_):
+        '''
+        W_i X_ * tanh(sigma * V_i X_) of every node i as
+        [totalNodes, numClasses, batchSize], with W and V in one matmul
+        '''
+        WVX = torch.matmul(torch.cat([self.W, self.V]), X_)
+        WX, VX = torch.split(WVX, self.W.shape[0])
+        return torch.reshape(WX * torch.tanh(self.sigma * VX),
+                             [self.totalNodes, self.numClasses, -1])
+
+    def nodeProbabilities(self, X_, sigmaI):
+        '''
+        Probability of reaching every node as [totalNodes, batchSize],
+        computed a level at a time. The children of node i are 2i + 1
+        (taken with (1 + tanh(sigmaI T_i X_)) / 2) and 2i + 2.
+        '''
+        TX = torch.tanh(sigmaI * torch.matmul(self.T, X_))
+        prob = torch.ones_like(X_[0:1])
+        levels = [prob]
+        for depth in range(self.treeDepth):
+            t = TX[2**depth - 1:2**(depth + 1) - 1]
+            prob = torch.stack([prob * (1 + t) / 2.0, prob * (1 - t) / 2.0], 1)
+            prob = torch.reshape(prob, [-1, X_.shape[1]])
+            levels.append(prob)
+        return torch.cat(levels)
+
+    def hardPathScore(self, X_):
+        '''
+        Score when sigmaI is infinite: the node probabilities are then 0 or
+        1, so only the root-to-leaf path of every sample is evaluated, in
+        O(treeDepth) instead of O(totalNodes). A sample exactly on a
+        branching hyperplane (T_i X_ == 0) goes right, where the soft tree
+        would split it evenly between both children.
+        '''
+        Xt = torch.t(X_)
+        node = torch.zeros([Xt.shape[0]], dtype=torch.long, device=Xt.device)
+        path = [node]
+        for _ in range(self.treeDepth):
+            goRight = (torch.sum(self.T[node] * Xt, 1) <= 0).long()
+            node = 2 * node + 1 + goRight
+            path.append(node)
+        path = torch.stack(path, 1)
+
+        # [batchSize, treeDepth + 1, numClasses, projectionDimension]
+        W_ = torch.reshape(self.W, [self.totalNodes, self.numClasses, -1])[path]
+        V_ = torch.reshape(self.V, [self.totalNodes, self.numClasses, -1])[path]
+        Xt = Xt[:, None, :, None]
+        score = torch.matmul(W_, Xt) * torch.tanh(self.sigma * torch.matmul(V_, Xt))
+        return torch.t(torch.sum(score, [1, 3]))
+
     def forward(self, X, sigmaI):
         '''
         Function to build/exxecute the Bonsai Tree graph
         Expected Dimensions
 
         X is [batchSize, self.dataDimension]
-        sigmaI is constant
+        sigmaI is constant. With hardPath set, under torch.no_grad() a
+        sigmaI of at least HARD_PATH_SIGMAI (the 1e9 used for inference)
+        follows only the active path of every sample, see hardPathScore.
         '''
         X_ = torch.matmul(self.Z, torch.t(X)) / self.projectionDimension
-        W_ = self.W[0:(self.numClasses)]
-        V_ = self.V[0:(self.numClasses)]
-        self.__nodeProb = []
-        self.__nodeProb.append(1)
-        score_ = self.__nodeProb[0] * (torch.matmul(W_, X_) *
-                                       torch.tanh(self.sigma *
-                                                  torch.matmul(V_, X_)))
-        for i in range(1, self.totalNodes):
-            W_ = self.W[i * self.numClasses:((i + 1) * self.numClasses)]
-            V_ = self.V[i * self.numClasses:((i + 1) * self.numClasses)]
-
-            T_ = torch.reshape(self.T[int(np.ceil(i / 2.0) - 1.0)],
-                               [-1, self.projectionDimension])
-            prob = (1 + ((-1)**(i + 1)) *
-                    torch.tanh(sigmaI * torch.matmul(T_, X_)))
-
-            prob = prob / 2.0
-            prob = self.__nodeProb[int(np.ceil(i / 2.0) - 1.0)] * prob
-            self.__nodeProb.append(prob)
-            score_ += self.__nodeProb[i] * (torch.matmul(W_, X_) *
-                                            torch.tanh(self.sigma *
-                                                       torch.matmul(V_, X_)))
-
-        self.score = score_
+        if self.hardPath and not torch.is_grad_enabled() and sigmaI >= HARD_PATH_SIGMAI:
+            self.score = self.hardPathScore(X_)
+        else:
+            nodeProb = self.nodeProbabilities(X_, sigmaI)
+            self.score = torch.sum(nodeProb.unsqueeze(1) * self.nodeScores(X_), 0)
+
         self.X_ = X_
         return torch.t(self.score), self.X_
 
@@ -0,0 +1,251 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT license.
+
+'''
+NumPy-only fixed-point runtime for FastGRNN and RNNPool, for models
+exported with edgeml_pytorch.graph.quantize. Nothing here imports torch,
+so a saved model runs wherever NumPy does.
+
+Number formats:
+    hidden states and nonlinearity outputs: int16 with Q = 14 fractional bits
+    cell inputs: int16 at a per-tensor scale (2 ** -Q for the second stage
+    of RNNPool, whose inputs are first stage states)
+    W, U: int8 (or int16) at per-tensor scales
+    pre-activations: int16 at a per-cell scale, biases int32 at that scale
+Matmul accumulators are 64 bit and are brought to the pre-activation scale
+with an integer multiplier and a rounding right shift. Nonlinearities are
+lookup tables indexed by the top bits of the int16 pre-activation.
+'''
+
+import math
+
+import numpy as np
+
+Q = 14
+ONE = 1 << Q
+# one table entry per 2 ** LUT_SHIFT consecutive int16 pre-activations
+LUT_SHIFT = 4
+LUT_SIZE = 1 << (16 - LUT_SHIFT)
+INT16_MIN, INT16_MAX = -32768, 32767
+
+
+def fixed_multiplier(real):
+    '''
+    (multiplier, shift) with real ~= multiplier / 2 ** shift and a 15 bit
+    multiplier, for rescale
+    '''
+    mantissa, exponent = math.frexp(real)
+    multiplier = int(round(mantissa * (1 << 15)))
+    return multiplier, 15 - exponent
+
+
+def rescale(acc, multiplier, shift):
+    '''
+    round(acc * multiplier / 2 ** shift) in integer arithmetic
+    '''
+    if shift <= 0:
+        return acc * (multiplier << -shift)
+    return (acc * multiplier + (1 << (shift - 1))) >> shift
+
+
+def saturate16(a):
+    return np.clip(a, INT16_MIN, INT16_MAX)
+
+
+def int_matmul(a, b):
+    '''
+    Exact integer a @ b as int64. Products of 16 bit by 16 bit integers
+    summed over fewer than 2 ** 22 terms stay below 2 ** 53, where float64
+    is exact, so BLAS computes it much faster than NumPy's integer matmul.
+    '''
+    return np.rint(np.matmul(a.astype(np.float64), b.astype(np.float64))).astype(np.int64)
+
+
+def lut_inputs(pre_scale):
+    '''
+    Real pre-activation at the centre of every lookup table entry
+    '''
+    index = np.arange(LUT_SIZE, dtype=np.int64)
+    return ((index << LUT_SHIFT) + INT16_MIN + (1 << (LUT_SHIFT - 1))) * pre_scale
+
+
+def lookup(table, pre):
+    '''
+    Nonlinearity of int16 pre-activations through table, as int64
+    '''
+    return table[(pre - INT16_MIN) >> LUT_SHIFT].astype(np.int64)
+
+
+class FixedPointFastGRNN(object):
+    '''
+    Integer FastGRNN cell
+
+    pre = rescale(x W) + rescale(h U)
+    z = gate_lut[pre + bias_gate]
+    c = update_lut[pre + bias_update]
+    h = z * h + (sigmoid(zeta) * (1 - z) + sigmoid(nu)) * c
+
+    with x at input_scale, pre at pre_scale and h, z, c, sigmoid(zeta) and
+    sigmoid(nu) in Q14.
+    '''
+    ARRAYS = ['W', 'U', 'bias_gate', 'bias_update', 'gate_lut', 'update_lut']
+    SCALARS = ['input_scale', 'pre_scale', 'w_multiplier', 'w_shift',
+               'u_multiplier', 'u_shift', 'zeta', 'nu']
+
+    def __init__(self, W, U, bias_gate, bias_update, gate_lut, update_lut,
+                 input_scale, pre_scale, w_multiplier, w_shift,
+                 u_multiplier, u_shift, zeta, nu):
+        self.W = W
+        self.U = U
+        self.bias_gate = bias_gate
+        self.bias_update = bias_update
+        self.gate_lut = gate_lut
+        self.update_lut = update_lut
+        self.input_scale = float(input_scale)
+        self.pre_scale = float(pre_scale)
+        self.w_multiplier = int(w_multiplier)
+        self.w_shift = int(w_shift)
+        self.u_multiplier = int(u_multiplier)
+        self.u_shift = int(u_shift)
+        self.zeta = int(zeta)
+        self.nu = int(nu)
+
+    @property
+    def input_size(self):
+        return self.W.shape[0]
+
+    @property
+    def hidden_size(self):
+        return self.W.shape[1]
+
+    def project(self, x):
+        '''
+        Input side of every step, x: int16 [..., input_size]
+        '''
+        rows = x.reshape(-1, x.shape[-1])
+        wComp = rescale(int_matmul(rows, self.W), self.w_multiplier, self.w_shift)
+        return wComp.reshape(x.shape[:-1] + (self.hidden_size,))
+
+    def step(self, wComp, h):
+        '''
+        One step from the projected input and the int16 Q14 state
+        '''
+        pre = wComp + rescale(int_matmul(h, self.U), self.u_multiplier, self.u_shift)
+        z = lookup(self.gate_lut, saturate16(pre + self.bias_gate))
+        c = lookup(self.update_lut, saturate16(pre + self.bias_update))
+        coef = ((self.zeta * (ONE - z) + (1 << (Q - 1))) >> Q) + self.nu
+        new_h = (z * h + coef * c + (1 << (Q - 1))) >> Q
+        return saturate16(new_h).astype(np.int16)
+
+    def run(self, x, h=None):
+        '''
+        Final state after the time-major int16 sequence x [T, batch, input_size]
+        '''
+        if h is None:
+            h = np.zeros((x.shape[1], self.hidden_size), dtype=np.int16)
+        wComp = self.project(x)
+        for t in range(x.shape[0]):
+            h = self.step(wComp[t], h)
+        return h
+
+    def to_arrays(self, prefix=''):
+        arrays = {prefix + k: getattr(self, k) for k in self.ARRAYS}
+        arrays.update({prefix + k: np.array(getattr(self, k)) for k in self.SCALARS})
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays, prefix=''):
+        kwargs = {k: arrays[prefix + k] for k in cls.ARRAYS}
+        kwargs.update({k: arrays[prefix + k].item() for k in cls.SCALARS})
+        return cls(**kwargs)
+
+
+class FixedPointRNNPool(object):
+    '''
+    Integer RNNPool: rnn1 sweeps the rows and the columns of every patch and
+    rnn2 runs in both directions over the resulting states, as in
+    edgeml_pytorch.graph.rnnpool.RNNPool. With kernel_size set it slides over
+    a feature map like RNNPool2d (stride, replicate padding given as
+    (left, right, top, bottom)).
+
+    Call it on float NumPy inputs to get float outputs, or use pool and
+    pool2d on int16 inputs quantized with quantize_input.
+    '''
+    def __init__(self, nRows, nCols, rnn1, rnn2, kernel_size=None, stride=None,
+                 padding=(0, 0, 0, 0)):
+        self.nRows = int(nRows)
+        self.nCols = int(nCols)
+        self.rnn1 = rnn1
+        self.rnn2 = rnn2
+        self.kernel_size = None if kernel_size is None else tuple(int(k) for k in kernel_size)
+        self.stride = None if stride is None else tuple(int(s) for s in stride)
+        self.padding = tuple(int(p) for p in padding)
+
+    def quantize_input(self, x):
+        return saturate16(np.rint(x / self.rnn1.input_scale)).astype(np.int16)
+
+    def _bidirectional(self, states):
+        '''
+        [forward final, reverse final] of rnn2 over [T, batch, hidden] states,
+        both directions as one batch
+        '''
+        batch = states.shape[1]
+        both = self.rnn2.run(np.concatenate([states, states[::-1]], 1))
+        return np.concatenate([both[:batch], both[batch:]], 1)
+
+    def pool(self, patches):
+        '''
+        patches: int16 [P, inputDims, nRows, nCols]
+        Returns int16 Q14 [P, 4 * nHiddenDimsBiDir], the sweep across
+        columns first as in RNNPool.forward
+        '''
+        num_patches, channels = patches.shape[:2]
+        # time over rows with one sequence per column, and the other way round
+        rows = patches.transpose(2, 0, 3, 1).reshape(self.nRows, num_patches * self.nCols, channels)
+        cols = patches.transpose(3, 0, 2, 1).reshape(self.nCols, num_patches * self.nRows, channels)
+        row_states = self.rnn1.run(rows).reshape(num_patches, self.nCols, -1).transpose(1, 0, 2)
+        col_states = self.rnn1.run(cols).reshape(num_patches, self.nRows, -1).transpose(1, 0, 2)
+        return np.concatenate([self._bidirectional(col_states),
+                               self._bidirectional(row_states)], 1)
+
+    def pool2d(self, x):
+        '''
+        x: int16 [N, inputDims, H, W], returns int16 Q14
+        [N, 4 * nHiddenDimsBiDir, top + H_out + bottom, left + W_out + right]
+        '''
+        n, c, height, width = x.shape
+        output_x = (height - self.nRows) // self.stride[0] + 1
+        output_y = (width - self.nCols) // self.stride[1] + 1
+        sn, sc, sh, sw = x.strides
+        patches = np.lib.stride_tricks.as_strided(
+            x, (n, output_x, output_y, c, self.nRows, self.nCols),
+            (sn, sh * self.stride[0], sw * self.stride[1], sc, sh, sw), writeable=False)
+        pooled = self.pool(patches.reshape(-1, c, self.nRows, self.nCols))
+        pooled = pooled.reshape(n, output_x, output_y, -1).transpose(0, 3, 1, 2)
+        left, right, top, bottom = self.padding
+        return np.pad(pooled, ((0, 0), (0, 0), (top, bottom), (left, right)), mode='edge')
+
+    def __call__(self, x):
+        x = self.quantize_input(np.asarray(x))
+        pooled = self.pool(x) if self.kernel_size is None else self.pool2d(x)
+        return pooled.astype(np.float32) / ONE
+
+    def save(self, path):
+        arrays = dict(self.rnn1.to_arrays('rnn1/'), **self.rnn2.to_arrays('rnn2/'))
+        arrays['shape'] = np.array([self.nRows, self.nCols])
+        arrays['padding'] = np.array(self.padding)
+        if self.kernel_size is not None:
+            arrays['kernel_size'] = np.array(self.kernel_size)
+            arrays['stride'] = np.array(self.stride)
+        np.savez(path, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        arrays = np.load(path)
+        nRows, nCols = arrays['shape'].tolist()
+        kernel_size = tuple(arrays['kernel_size'].tolist()) if 'kernel_size' in arrays else None
+        stride = tuple(arrays['stride'].tolist()) if 'stride' in arrays else None
+        return cls(nRows, nCols,
+                   FixedPointFastGRNN.from_arrays(arrays, 'rnn1/'),
+                   FixedPointFastGRNN.from_arrays(arrays, 'rnn2/'),
+                   kernel_size, stride, tuple(arrays['padding'].tolist()))
@@ -8,7 +8,8 @@ import numpy as np
 
 class ProtoNN(nn.Module):
     def __init__(self, inputDimension, projectionDimension, numPrototypes,
-                 numOutputLabels, gamma, W=None, B=None, Z=None):
+                 numOutputLabels, gamma, W=None, B=None, Z=None,
+                 memoryBudget=2**26):
         '''
         Forward computation graph for ProtoNN.
 
@@ -23,6 +24,8 @@ class ProtoNN(nn.Module):
                 W   inputDimension (d) x projectionDimension (d_cap)
                 B   projectionDimension (d_cap) x numPrototypes (m)
                 Z   numOutputLabels (L) x numPrototypes (m)
+        memoryBudget: Approximate bytes for the [batch, prototypes]
+            intermediates of one chunk of the forward pass
         '''
         super(ProtoNN, self).__init__()
         self.__d = inputDimension
@@ -32,6 +35,7 @@ class ProtoNN(nn.Module):
 
         self.W, self.B, self.Z = None, None, None
         self.gamma = gamma
+        self.memoryBudget = memoryBudget
 
         self.__validInit = False
         self.__initWBZ(W, B, Z)
@@ -93,12 +97,34 @@ class ProtoNN(nn.Module):
         '''
         return self.W, self.B, self.Z, self.gamma
 
-    def forward(self, X):
+    def prototypeChunk(self, batchSize, elementSize=4):
+        '''
+        Number of prototypes handled at once so that the three
+        [batchSize, chunk] intermediates fit in memoryBudget
+        '''
+        chunk = self.memoryBudget // max(1, 3 * batchSize * elementSize)
+        return int(max(1, min(self.__m, chunk)))
+
+    def distances(self, WX, B, WXnorm):
+        '''
+        Squared l2 distances [batch, chunk] between the projected inputs
+        and the prototypes B, as ||WX||^2 + ||B||^2 - 2 WX B
+        '''
+        l2sim = torch.addmm(WXnorm + torch.sum(B * B, dim=0, keepdim=True),
+                            WX, B, alpha=-2)
+        return torch.clamp(l2sim, min=0)
+
+    def forward(self, X, topK=None):
         '''
         This method is responsible for construction of the forward computation
         graph. The end point of the computation graph, or in other words the
         output operator for the forward computation is returned.
 
+        The prototypes are processed in chunks of prototypeChunk, so the
+        [batch, projectionDimension, numPrototypes] difference tensor is
+        never built. topK (inference) keeps only the topK nearest
+        prototypes of every input in the sum.
+
         X: Input of shape [-1, inputDimension]
         returns: The forward computation outputs, self.protoNNOut
         '''
@@ -106,20 +132,34 @@ class ProtoNN(nn.Module):
 
         W, B, Z, gamma = self.W, self.B, self.Z, self.gamma
         WX = torch.matmul(X, W)
-        dim = [-1, WX.shape[1], 1]
-        WX = torch.reshape(WX, dim)
-        dim = [1, B.shape[0], -1]
-        B_ = torch.reshape(B, dim)
-        l2sim = B_ - WX
-        l2sim = torch.pow(l2sim, 2)
-        l2sim = torch.sum(l2sim, dim=1, keepdim=True)
-        self.l2sim = l2sim
-        gammal2sim = (-1 * gamma * gamma) * l2sim
-        M = torch.exp(gammal2sim)
-        dim = [1] + list(Z.shape)
-        Z_ = torch.reshape(Z, dim)
-        y = Z_ * M
-        y = torch.sum(y, dim=2)
+        WXnorm = torch.sum(WX * WX, dim=1, keepdim=True)
+        chunk = self.prototypeChunk(WX.shape[0], WX.element_size())
+        if topK is not None:
+            return self.__topKForward(WX, WXnorm, chunk, topK)
+
+        y = None
+        for start in range(0, self.__m, chunk):
+            l2sim = self.distances(WX, B[:, start:start + chunk], WXnorm)
+            M = torch.exp((-1 * gamma * gamma) * l2sim)
+            y_ = torch.matmul(M, torch.t(Z[:, start:start + chunk]))
+            y = y_ if y is None else y + y_
         return y
 
-
+    def __topKForward(self, WX, WXnorm, chunk, topK):
+        B, Z, gamma = self.B, self.Z, self.gamma
+        topK = min(topK, self.__m)
+        best, bestIndex = None, None
+        for start in range(0, self.__m, chunk):
+            l2sim = self.distances(WX, B[:, start:start + chunk], WXnorm)
+            index = torch.arange(start, start + l2sim.shape[1], device=WX.device)
+            index = index.expand(l2sim.shape[0], -1)
+            if best is not None:
+                l2sim = torch.cat([best, l2sim], dim=1)
+                index = torch.cat([bestIndex, index], dim=1)
+            best, position = torch.topk(l2sim, min(topK, l2sim.shape[1]),
+                                        dim=1, largest=False)
+            bestIndex = torch.gather(index, 1, position)
+        M = torch.exp((-1 * gamma * gamma) * best)
+        # [batch, topK, L] labels of the nearest prototypes
+        Z_ = torch.t(Z)[bestIndex]
+        return torch.sum(M.unsqueeze(2) * Z_, dim=1)
@@ -0,0 +1,117 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT license.
+
+'''
+Export of trained FastGRNN cells and RNNPool layers to the integer runtime
+in edgeml_pytorch.graph.fixedpoint.
+
+W and U (W1 W2 and U1 U2 multiplied out when low rank) are quantized
+symmetrically with one scale per tensor, biases at the pre-activation
+scale, sigmoid(zeta) and sigmoid(nu) to Q14, and the gate and update
+nonlinearities are tabulated from the cell's own activation functions.
+'''
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+from edgeml_pytorch.graph.fixedpoint import (
+    FixedPointFastGRNN, FixedPointRNNPool, INT16_MAX, ONE, Q, fixed_multiplier, lut_inputs)
+from edgeml_pytorch.graph.rnn import FastGRNNCell
+from edgeml_pytorch.graph.rnnpool import RNNPool2d
+
+
+def _numpy(tensor):
+    return tensor.detach().double().cpu().numpy()
+
+
+def quantize_tensor(x, bits):
+    '''
+    Symmetric per-tensor quantization, returns (integers, scale)
+    '''
+    qmax = 2 ** (bits - 1) - 1
+    scale = max(float(np.abs(x).max()), 1e-12) / qmax
+    dtype = np.int8 if bits <= 8 else np.int16
+    return np.clip(np.rint(x / scale), -qmax, qmax).astype(dtype), scale
+
+
+def activation_lut(activation, pre_scale):
+    '''
+    Q14 table of activation over the int16 pre-activation range
+    '''
+    inputs = torch.from_numpy(lut_inputs(pre_scale))
+    with torch.no_grad():
+        values = _numpy(activation(inputs))
+    return np.clip(np.rint(values * ONE), -INT16_MAX, INT16_MAX).astype(np.int16)
+
+
+def quantize_fastgrnn_cell(cell, input_scale, weight_bits=8, pre_range=8.0):
+    '''
+    FixedPointFastGRNN for a FastGRNNCell
+
+    input_scale = real value of one step of the int16 cell input
+    weight_bits = 8 or 16, the storage of W and U
+    pre_range = pre-activations saturate beyond +-pre_range; sigmoid and
+    tanh are flat there anyway
+    '''
+    if not isinstance(cell, FastGRNNCell):
+        raise ValueError("Only FastGRNNCell can be quantized, got {}".format(type(cell).__name__))
+    if weight_bits not in (8, 16):
+        raise ValueError("weight_bits should be 8 or 16, got {}".format(weight_bits))
+
+    with torch.no_grad():
+        W = cell.W if cell._wRank is None else torch.matmul(cell.W1, cell.W2)
+        U = cell.U if cell._uRank is None else torch.matmul(cell.U1, cell.U2)
+        W, w_scale = quantize_tensor(_numpy(W), weight_bits)
+        U, u_scale = quantize_tensor(_numpy(U), weight_bits)
+        zeta = float(torch.sigmoid(cell.zeta).item())
+        nu = float(torch.sigmoid(cell.nu).item())
+
+    pre_scale = pre_range / INT16_MAX
+    w_multiplier, w_shift = fixed_multiplier(input_scale * w_scale / pre_scale)
+    u_multiplier, u_shift = fixed_multiplier(2.0 ** -Q * u_scale / pre_scale)
+    return FixedPointFastGRNN(
+        W, U,
+        np.rint(_numpy(cell.bias_gate).reshape(-1) / pre_scale).astype(np.int32),
+        np.rint(_numpy(cell.bias_update).reshape(-1) / pre_scale).astype(np.int32),
+        activation_lut(cell.gate_activation, pre_scale),
+        activation_lut(cell.update_activation, pre_scale),
+        input_scale, pre_scale, w_multiplier, w_shift, u_multiplier, u_shift,
+        int(round(zeta * ONE)), int(round(nu * ONE)))
+
+
+def quantize_rnnpool(pool, calibration, weight_bits=8):
+    '''
+    FixedPointRNNPool for an RNNPool or RNNPool2d with FastGRNN cells
+
+    calibration = representative inputs of the layer (a tensor, or a list
+    of tensors); the int16 input scale covers their largest magnitude
+    '''
+    if isinstance(calibration, torch.Tensor):
+        calibration = [calibration]
+    input_max = max(float(x.detach().abs().max()) for x in calibration)
+    input_scale = max(input_max, 1e-12) / INT16_MAX
+
+    rnn1 = quantize_fastgrnn_cell(pool.cell_rnn.cell, input_scale, weight_bits)
+    # the second stage reads first stage states, which are already Q14
+    rnn2 = quantize_fastgrnn_cell(pool.cell_bidirrnn.cell, 2.0 ** -Q, weight_bits)
+    if isinstance(pool, RNNPool2d):
+        return FixedPointRNNPool(pool.nRows, pool.nCols, rnn1, rnn2,
+                                 pool.kernel_size, pool.stride, pool.padding)
+    return FixedPointRNNPool(pool.nRows, pool.nCols, rnn1, rnn2)
+
+
+class QuantizedRNNPool(nn.Module):
+    '''
+    Drop-in replacement for an RNNPool or RNNPool2d layer of a float model
+    that runs the integer runtime on the CPU, e.g.
+        model.rnn_model = QuantizedRNNPool(quantize_rnnpool(model.rnn_model, x))
+    Inference only, no gradients flow through it.
+    '''
+    def __init__(self, runtime):
+        super(QuantizedRNNPool, self).__init__()
+        self.runtime = runtime
+
+    def forward(self, x, batch_size=None):
+        output = self.runtime(x.detach().cpu().numpy())
+        return torch.from_numpy(output).to(device=x.device, dtype=x.dtype)
@@ -2,6 +2,8 @@
 # Licensed under the MIT license.
 
 import os
+from typing import Dict, List, Optional, Tuple
+
 import torch
 import torch.nn as nn
 from torch.autograd import Function
@@ -9,6 +11,7 @@ import numpy as np
 
 import edgeml_pytorch.utils as utils
 
+fastgrnn_cuda = None
 try:
     if utils.findCUDA() is not None:
         import fastgrnn_cuda
@@ -16,6 +19,33 @@ except:
     print("Running without FastGRNN CUDA")
     pass
 
+try:
+    import fastgrnn_cpu
+except ImportError:
+    # built by setup.py when a C++ compiler is available
+    fastgrnn_cpu = None
+
+
+def fastgrnn_device():
+    '''
+    Device the FastGRNNCUDA parameters live on: the GPU when CUDA is
+    available, else the CPU if the fastgrnn_cpu extension was built
+    '''
+    if utils.findCUDA() is not None:
+        return torch.device("cuda")
+    if fastgrnn_cpu is not None:
+        return torch.device("cpu")
+    raise Exception('FastGRNNCUDA needs a GPU or the fastgrnn_cpu extension, '
+                    'reinstall edgeml_pytorch with a C++ compiler available.')
+
+
+def fastgrnn_kernels(input):
+    '''fastgrnn_cuda for CUDA tensors and fastgrnn_cpu for CPU tensors'''
+    kernels = fastgrnn_cuda if input.is_cuda else fastgrnn_cpu
+    if kernels is None:
+        raise Exception('No FastGRNN kernels built for ' + str(input.device))
+    return kernels
+
 
 # All the matrix vector computations of the form Wx are done 
 # in the form of xW (with appropriate changes in shapes) to 
@@ -73,7 +103,192 @@ def gen_nonlinearity(A, nonlinearity):
         return nonlinearity(A)
 
 
+def gen_nonlinearity_(A, nonlinearity):
+    '''
+    In-place version of gen_nonlinearity, overwrites and returns A
+    '''
+    if nonlinearity == "tanh":
+        return A.tanh_()
+    elif nonlinearity == "sigmoid":
+        return A.sigmoid_()
+    elif nonlinearity == "relu":
+        return A.relu_()
+    elif nonlinearity == "quantTanh":
+        return A.clamp_(-1.0, 1.0)
+    elif nonlinearity == "quantSigm":
+        return A.add_(1.0).div_(2.0).clamp_(0.0, 1.0)
+    elif nonlinearity == "quantSigm4":
+        return A.add_(2.0).div_(4.0).clamp_(0.0, 1.0)
+    else:
+        return A.copy_(gen_nonlinearity(A, nonlinearity))
+
+
+class QuantSigm(nn.Module):
+    '''
+    clamp((A + shift) / scale, 0, 1): quantSigm is shift 1, scale 2 and
+    quantSigm4 is shift 2, scale 4
+    '''
+    __constants__ = ['shift', 'scale']
+
+    def __init__(self, shift=1.0, scale=2.0):
+        super(QuantSigm, self).__init__()
+        self.shift = shift
+        self.scale = scale
+
+    def forward(self, A):
+        return torch.clamp((A + self.shift) / self.scale, 0.0, 1.0)
+
+
+class _Callable(nn.Module):
+    def __init__(self, fn):
+        super(_Callable, self).__init__()
+        self.fn = fn
+
+    def forward(self, A):
+        return self.fn(A)
+
+
+def get_nonlinearity(nonlinearity):
+    '''
+    Module computing the same activation as gen_nonlinearity, so that cells
+    resolve their nonlinearity once at construction instead of comparing
+    strings on every step (and stay scriptable with torch.jit.script).
+
+    nonlinearity is either a callable or a value in
+        ['tanh', 'sigmoid', 'relu', 'quantTanh', 'quantSigm', 'quantSigm4']
+    A callable is used as is if it is an nn.Module and wrapped otherwise;
+    only nn.Modules (or scriptable functions) can be scripted.
+    '''
+    if nonlinearity == "tanh":
+        return nn.Tanh()
+    elif nonlinearity == "sigmoid":
+        return nn.Sigmoid()
+    elif nonlinearity == "relu":
+        return nn.ReLU()
+    elif nonlinearity == "quantTanh":
+        return nn.Hardtanh(-1.0, 1.0)
+    elif nonlinearity == "quantSigm":
+        return QuantSigm(1.0, 2.0)
+    elif nonlinearity == "quantSigm4":
+        return QuantSigm(2.0, 4.0)
+    elif isinstance(nonlinearity, nn.Module):
+        return nonlinearity
+    elif callable(nonlinearity):
+        return _Callable(nonlinearity)
+    raise ValueError("nonlinearity is either a callable or a value " +
+                     "['tanh', 'sigmoid', 'relu', 'quantTanh', " +
+                     "'quantSigm', 'quantSigm4']")
+
+
+class Workspace(object):
+    '''
+    Arena of reusable tensors for allocation-free inference.
+
+    Buffers are keyed by (owner, name, shape, dtype, device). A request that
+    misses allocates a new buffer and increments `allocations`, so once every
+    shape has been seen, repeated calls with the same shapes leave the
+    counter unchanged. The counter only sees the arena: what a call
+    allocates outside of it is what the allocator reports, see
+    benchmarks/bench_workspace.py.
+
+    All the cells but FastGRNNCUDACell keep their step temporaries here
+    (RNNCell.input_projection_into and step_into). Steps still allocate
+    when a W or U runs as a sparse matrix (the sparse product has no out=
+    form), when a nonlinearity is a user callable, or with quantSigm and
+    quantSigm4, whose in-place form adds and divides by Python scalars.
+
+    Attach it with RNNPool.set_workspace or by setting BaseRNN.workspace.
+    It is only used when grad is disabled, since buffers are overwritten in
+    place, and outputs of a BaseRNN stay valid only until its next call.
+    It is not thread-safe: give every model replica its own workspace.
+    '''
+    def __init__(self):
+        self._buffers = {}
+        self.allocations = 0
+        self.requests = 0
+
+    def empty(self, owner, name, shape, dtype, device):
+        key = (id(owner), name, tuple(shape), dtype, torch.device(device))
+        self.requests += 1
+        buffer = self._buffers.get(key)
+        if buffer is None:
+            buffer = torch.empty(tuple(shape), dtype=dtype, device=device)
+            self._buffers[key] = buffer
+            self.allocations += 1
+        return buffer
+
+    def zeros(self, owner, name, shape, dtype, device):
+        return self.empty(owner, name, shape, dtype, device).zero_()
+
+    def clear(self):
+        self._buffers.clear()
+
+    @property
+    def nbytes(self):
+        return sum(b.numel() * b.element_size() for b in self._buffers.values())
+
+
+# Default density below which cells in eval mode run W and U as sparse
+# matrices. 0 keeps it opt-in: on the CPUs measured so far dense BLAS beat
+# CSR at every density and hidden size, so set cell.sparse_threshold only
+# where benchmarks/bench_sparse.py finds a crossover.
+SPARSE_THRESHOLD = 0.0
+
+
+def sparse_weight(mat, threshold):
+    '''
+    mat^T as a sparse [out, in] matrix if the density of mat is below
+    threshold, else None. CSR is used when this build can multiply it,
+    COO otherwise.
+    '''
+    if mat.numel() == 0 or \
+            torch.count_nonzero(mat).item() >= threshold * mat.numel():
+        return None
+    weight = mat.detach().t().contiguous()
+    try:
+        sparse = weight.to_sparse_csr()
+        torch.mm(sparse, weight.new_zeros([weight.shape[1], 1]))
+    except (AttributeError, RuntimeError):
+        sparse = weight.to_sparse().coalesce()
+    return sparse
+
+
+def sparse_mm(input, sparse):
+    '''
+    input @ mat for the sparse matrix returned by sparse_weight(mat)
+    '''
+    rows = input.reshape(-1, input.shape[-1])
+    output = torch.mm(sparse, rows.t()).t()
+    return output.reshape(tuple(input.shape[:-1]) + (sparse.shape[0],))
+
+
+def autocast_enabled():
+    '''
+    True inside torch.autocast, on CPU or CUDA
+    '''
+    return torch.is_autocast_enabled() or torch.is_autocast_cpu_enabled()
+
+
+def state_dtype(dtype):
+    '''
+    dtype of a recurrent state running next to activations of the given
+    dtype. Inside torch.autocast reduced precision activations get a
+    float32 state, so that autocast only lowers the matmuls and the state
+    is not rounded to bfloat16 / float16 at every step.
+    '''
+    if (dtype == torch.bfloat16 or dtype == torch.float16) and autocast_enabled():
+        return torch.float32
+    return dtype
+
+
 class RNNCell(nn.Module):
+    # plain Python metadata, not needed by the scripted step
+    __jit_unused_properties__ = ['state_size', 'input_size', 'output_size',
+                                 'gate_nonlinearity', 'update_nonlinearity',
+                                 'wRank', 'uRank', 'num_W_matrices',
+                                 'num_U_matrices', 'num_weight_matrices',
+                                 'name', 'cellType']
+
     def __init__(self, input_size, hidden_size,
                  gate_nonlinearity, update_nonlinearity,
                  num_W_matrices, num_U_matrices, num_biases,
@@ -84,6 +299,11 @@ class RNNCell(nn.Module):
         self._hidden_size = hidden_size
         self._gate_nonlinearity = gate_nonlinearity
         self._update_nonlinearity = update_nonlinearity
+        # resolved once here, the steps call these modules
+        self.gate_activation = None if gate_nonlinearity is None \
+            else get_nonlinearity(gate_nonlinearity)
+        self.update_activation = None if update_nonlinearity is None \
+            else get_nonlinearity(update_nonlinearity)
         self._num_W_matrices = num_W_matrices
         self._num_U_matrices = num_U_matrices
         self._num_biases = num_biases
@@ -93,7 +313,13 @@ class RNNCell(nn.Module):
         self._uRank = uRank
         self._wSparsity = wSparsity
         self._uSparsity = uSparsity
-        self.oldmats = []
+        # support of W and U kept by sparsifyWithSupport
+        self.supportMask = None
+        self._packed_cache = {}
+        # W and U sparser than this run as sparse matrices in eval mode,
+        # 0 keeps everything dense
+        self.sparse_threshold = SPARSE_THRESHOLD
+        self._sparse_cache = {}
 
 
     @property
@@ -143,6 +369,122 @@ class RNNCell(nn.Module):
     def forward(self, input, state):
         raise NotImplementedError()
 
+    def input_projection(self, input):
+        '''
+        Part of a step that depends only on the input. BaseRNN applies it
+        to the whole [timeSteps, batchSize, inputDims] sequence at once and
+        feeds one timestep of the result to recurrent_step, so cells that
+        split their step this way do a single large GEMM for the input side.
+        The default is the identity, leaving all the work to forward.
+        '''
+        return input
+
+    def recurrent_step(self, projection, state):
+        '''
+        Rest of a step given one timestep of input_projection
+        '''
+        return self.forward(projection, state)
+
+    def input_projection_into(self, input, workspace):
+        '''
+        input_projection with the result kept in workspace
+        '''
+        return self.input_projection(input)
+
+    def step_into(self, projection, state, out, workspace):
+        '''
+        recurrent_step written into out, used by BaseRNN when running
+        under a Workspace. Cells override it to keep their temporaries in
+        the workspace; the default copies the result of recurrent_step.
+        For LSTMs state and out are (h, c) pairs.
+        '''
+        return out.copy_(self.recurrent_step(projection, state))
+
+    def _mm_into(self, input, name: str, mat, out, bias=None):
+        '''
+        input @ mat, plus bias if given, written into out. Goes through the
+        sparse copy of mat like _mm, in which case the product itself is
+        still allocated.
+        '''
+        sparse = self._sparse(name, mat)
+        if sparse is not None:
+            out.copy_(sparse_mm(input, sparse))
+            return out if bias is None else out.add_(bias)
+        if bias is None:
+            return torch.mm(input, mat, out=out)
+        return torch.addmm(bias, input, mat, out=out)
+
+    def _matmul_into(self, input, factors, out, workspace, bias=None):
+        '''
+        _mm_into for a weight given as factors, [(name, mat)] or the low
+        rank pair [(name1, mat1), (name2, mat2)] with the names used by _mm.
+        The rank sized intermediate is kept in workspace.
+        '''
+        if len(factors) == 2:
+            name, mat = factors[0]
+            low = workspace.empty(self, name + "_low", (input.shape[0], mat.shape[1]),
+                                  out.dtype, out.device)
+            input = self._mm_into(input, name, mat, low)
+        name, mat = factors[-1]
+        return self._mm_into(input, name, mat, out, bias)
+
+    def _projection_into(self, input, factors, workspace):
+        '''
+        input_projection_into for cells whose projection is input @ W with
+        W given as factors (see _matmul_into), for input of any leading shape
+        '''
+        rows = input.reshape(-1, input.shape[-1])
+        width = factors[-1][1].shape[1]
+        wComp = workspace.empty(self, "wComp", (rows.shape[0], width), input.dtype, input.device)
+        self._matmul_into(rows, factors, wComp, workspace)
+        return wComp.view(tuple(input.shape[:-1]) + (width,))
+
+    def _packed(self, name: str, mats: List[torch.Tensor]):
+        '''
+        mats concatenated along the last dim, so that one matmul computes
+        all the gates. Without grad the result is cached and rebuilt only
+        when one of mats is replaced or updated in place.
+        '''
+        if not torch.jit.is_scripting():
+            if not torch.is_grad_enabled():
+                key = [(m.data_ptr(), m._version) for m in mats]
+                cached = self._packed_cache.get(name)
+                # the cache holds on to mats, so their storage cannot be
+                # reused by other tensors while the entry is alive
+                if cached is None or cached[1] != key or \
+                        any(a is not b for a, b in zip(cached[0], mats)):
+                    cached = (list(mats), key, torch.cat(mats, -1))
+                    self._packed_cache[name] = cached
+                return cached[2]
+        return torch.cat(mats, -1)
+
+    def _sparse(self, name: str, mat):
+        '''
+        Cached sparse_weight(mat) when the cell is in eval mode and no
+        gradient is needed for mat, else None. Like _packed it is rebuilt
+        when mat is replaced or updated in place, e.g. by sparsify.
+        '''
+        if self.training or mat.dim() != 2 or self.sparse_threshold <= 0 or \
+                (torch.is_grad_enabled() and mat.requires_grad):
+            return None
+        key = (mat.data_ptr(), mat._version, self.sparse_threshold)
+        cached = self._sparse_cache.get(name)
+        if cached is None or cached[1] != key or cached[0] is not mat:
+            cached = (mat, key, sparse_weight(mat, self.sparse_threshold))
+            self._sparse_cache[name] = cached
+        return cached[2]
+
+    def _mm(self, input, name: str, mat):
+        '''
+        input @ mat, through the sparse copy of mat when _sparse has one
+        (not under autocast, which has no sparse kernels)
+        '''
+        if not torch.jit.is_scripting():
+            sparse = None if autocast_enabled() else self._sparse(name, mat)
+            if sparse is not None:
+                return sparse_mm(input, sparse)
+        return torch.matmul(input, mat)
+
     def getVars(self):
         raise NotImplementedError()
 
@@ -169,32 +511,39 @@ class RNNCell(nn.Module):
             mats[i].to(device)
         return totalnnz * 4
 
+    def get_memory_size(self):
+        '''
+        Bytes the cell holds in eval mode as (dense, sparse): the dense
+        parameters, which stay resident, and the sparse copies of the W and
+        U matrices below sparse_threshold, cached on top of them. The
+        footprint is their sum. Compare with get_model_size.
+        '''
+        dense, sparse = 0, 0
+        for name, param in self.named_parameters():
+            dense += utils.tensorBytes(param)
+            if name[0] in "WU":
+                copy = sparse_weight(param, self.sparse_threshold)
+                if copy is not None:
+                    sparse += utils.tensorBytes(copy)
+        return dense, sparse
+
     def copy_previous_UW(self):
         mats = self.getVars()
         num_mats = self._num_W_matrices + self._num_U_matrices
-        if len(self.oldmats) != num_mats:
-            for i in range(num_mats):
-                self.oldmats.append(torch.FloatTensor())
-        for i in range(num_mats):
-            self.oldmats[i] = torch.FloatTensor(mats[i].detach().clone().to(mats[i].device))
+        self.supportMask = utils.SparsityMask(mats[:num_mats])
 
     def sparsify(self):
         mats = self.getVars()
         endW = self._num_W_matrices
         endU = endW + self._num_U_matrices
-        for i in range(0, endW):
-            mats[i] = utils.hardThreshold(mats[i], self._wSparsity)
-        for i in range(endW, endU):
-            mats[i] = utils.hardThreshold(mats[i], self._uSparsity)
-        self.W.data.copy_(mats[0])
-        self.U.data.copy_(mats[1])
-        # self.copy_previous_UW()
+        utils.hardThresholdInPlace(mats[:endU], [self._wSparsity] * endW +
+                                   [self._uSparsity] * (endU - endW))
+        self.copy_previous_UW()
 
     def sparsifyWithSupport(self):
-        mats = self.getVars()
-        endU = self._num_W_matrices + self._num_U_matrices
-        for i in range(0, endU):
-            mats[i] = utils.supportBasedThreshold(mats[i], self.oldmats[i])
+        if self.supportMask is None:
+            self.copy_previous_UW()
+        self.supportMask.apply()
 
 class FastGRNNCell(RNNCell):
     '''
@@ -230,6 +579,11 @@ class FastGRNNCell(RNNCell):
 
     W and U can further parameterised into low rank version by
     W = matmul(W_1, W_2) and U = matmul(U_1, U_2)
+
+    Under torch.autocast only the matmuls run in reduced precision: the
+    step casts Wx_t + Uh_{t-1} to the dtype of the state, which BaseRNN
+    keeps in float32 (see state_dtype), so the gates, sigmoid(zeta),
+    sigmoid(nu) and the update of h_t stay in float32.
     '''
 
     def __init__(self, input_size, hidden_size, gate_nonlinearity="sigmoid",
@@ -278,28 +632,57 @@ class FastGRNNCell(RNNCell):
         return "FastGRNN"
 
     def forward(self, input, state):
+        return self.recurrent_step(self.input_projection(input), state)
+
+    def input_projection(self, input):
         if self._wRank is None:
-            wComp = torch.matmul(input, self.W)
+            return self._mm(input, "W", self.W)
         else:
-            wComp = torch.matmul(
-                torch.matmul(input, self.W1), self.W2)
+            return self._mm(self._mm(input, "W1", self.W1), "W2", self.W2)
 
+    def recurrent_step(self, wComp, state):
         if self._uRank is None:
-            uComp = torch.matmul(state, self.U)
+            uComp = self._mm(state, "U", self.U)
         else:
-            uComp = torch.matmul(
-                torch.matmul(state, self.U1), self.U2)
+            uComp = self._mm(self._mm(state, "U1", self.U1), "U2", self.U2)
 
-        pre_comp = wComp + uComp
-        z = gen_nonlinearity(pre_comp + self.bias_gate,
-                              self._gate_nonlinearity)
-        c = gen_nonlinearity(pre_comp + self.bias_update,
-                              self._update_nonlinearity)
+        pre_comp = wComp.to(state.dtype) + uComp.to(state.dtype)
+        z = self.gate_activation(pre_comp + self.bias_gate)
+        c = self.update_activation(pre_comp + self.bias_update)
         new_h = z * state + (torch.sigmoid(self.zeta) *
                              (1.0 - z) + torch.sigmoid(self.nu)) * c
 
         return new_h
 
+    def input_projection_into(self, input, workspace):
+        if self._wRank is None:
+            return self._projection_into(input, [("W", self.W)], workspace)
+        return self._projection_into(input, [("W1", self.W1), ("W2", self.W2)], workspace)
+
+    def step_into(self, wComp, state, out, workspace):
+        batch_size = state.shape[0]
+        dtype, device = state.dtype, state.device
+        pre_comp = workspace.empty(self, "pre_comp", (batch_size, self._hidden_size), dtype, device)
+        if self._uRank is None:
+            self._matmul_into(state, [("U", self.U)], pre_comp, workspace, wComp)
+        else:
+            self._matmul_into(state, [("U1", self.U1), ("U2", self.U2)], pre_comp, workspace, wComp)
+
+        z = workspace.empty(self, "z", (batch_size, self._hidden_size), dtype, device)
+        z = gen_nonlinearity_(torch.add(pre_comp, self.bias_gate, out=z),
+                              self._gate_nonlinearity)
+        c = gen_nonlinearity_(pre_comp.add_(self.bias_update),
+                              self._update_nonlinearity)
+
+        # coef[0] = sigmoid(zeta), coef[1] = sigmoid(zeta) + sigmoid(nu)
+        coef = workspace.empty(self, "coef", (2, 1), dtype, device)
+        torch.sigmoid(self.zeta, out=coef[0:1])
+        torch.sigmoid(self.nu, out=coef[1:2]).add_(coef[0:1])
+
+        torch.mul(z, state, out=out)
+        z.mul_(coef[0:1]).neg_().add_(coef[1:2])
+        return out.addcmul_(z, c)
+
     def getVars(self):
         Vars = []
         if self._num_W_matrices == 1:
@@ -319,6 +702,7 @@ class FastGRNNCell(RNNCell):
 class FastGRNNCUDACell(RNNCell):
     '''
     A CUDA implementation of FastGRNN Cell with Full Rank Support
+    Runs on the CPU through the fastgrnn_cpu extension when no GPU is found
     hidden_size = # hidden units
 
     zetaInit = init for zeta, the scale param
@@ -338,15 +722,13 @@ class FastGRNNCUDACell(RNNCell):
     update_nonlinearity="tanh", wRank=None, uRank=None, zetaInit=1.0, nuInit=-4.0, wSparsity=1.0, uSparsity=1.0, name="FastGRNNCUDACell"):
         super(FastGRNNCUDACell, self).__init__(input_size, hidden_size, gate_nonlinearity, update_nonlinearity, 
                                                 1, 1, 2, wRank, uRank, wSparsity, uSparsity)
-        if utils.findCUDA() is None:
-            raise Exception('FastGRNNCUDA is supported only on GPU devices.')
         NON_LINEARITY = {"sigmoid": 0, "relu": 1, "tanh": 2}
         self._input_size = input_size
         self._hidden_size = hidden_size
         self._zetaInit = zetaInit
         self._nuInit = nuInit
         self._name = name
-        self.device = torch.device("cuda")
+        self.device = fastgrnn_device()
 
         if wRank is not None:
             self._num_W_matrices += 1
@@ -390,11 +772,10 @@ class FastGRNNCUDACell(RNNCell):
         return "FastGRNNCUDACell"
 
     def forward(self, input, state):
-        # Calls the custom autograd function while invokes the CUDA implementation
-        if not input.is_cuda:
-            input.to(self.device)
-        if not state.is_cuda:
-            state.to(self.device)
+        # Calls the custom autograd function which invokes the CUDA or CPU
+        # implementation, whichever matches the device of the parameters
+        input = input.to(self.bias_gate.device)
+        state = state.to(self.bias_gate.device)
         return FastGRNNFunction.apply(input, self.bias_gate, self.bias_update, self.zeta, self.nu, state,
             self.W, self.U, self.W1, self.W2, self.U1, self.U2, self._gate_non_linearity)
 
@@ -491,27 +872,52 @@ class FastRNNCell(RNNCell):
         return "FastRNN"
 
     def forward(self, input, state):
+        return self.recurrent_step(self.input_projection(input), state)
+
+    def input_projection(self, input):
         if self._wRank is None:
-            wComp = torch.matmul(input, self.W)
+            return self._mm(input, "W", self.W)
         else:
-            wComp = torch.matmul(
-                torch.matmul(input, self.W1), self.W2)
+            return self._mm(self._mm(input, "W1", self.W1), "W2", self.W2)
 
+    def recurrent_step(self, wComp, state):
         if self._uRank is None:
-            uComp = torch.matmul(state, self.U)
+            uComp = self._mm(state, "U", self.U)
         else:
-            uComp = torch.matmul(
-                torch.matmul(state, self.U1), self.U2)
+            uComp = self._mm(self._mm(state, "U1", self.U1), "U2", self.U2)
 
         pre_comp = wComp + uComp
 
-        c = gen_nonlinearity(pre_comp + self.bias_update,
-                              self._update_nonlinearity)
+        c = self.update_activation(pre_comp + self.bias_update)
         new_h = torch.sigmoid(self.beta) * state + \
             torch.sigmoid(self.alpha) * c
 
         return new_h
 
+    def input_projection_into(self, input, workspace):
+        if self._wRank is None:
+            return self._projection_into(input, [("W", self.W)], workspace)
+        return self._projection_into(input, [("W1", self.W1), ("W2", self.W2)], workspace)
+
+    def step_into(self, wComp, state, out, workspace):
+        batch_size = state.shape[0]
+        dtype, device = state.dtype, state.device
+        pre_comp = workspace.empty(self, "pre_comp", (batch_size, self._hidden_size), dtype, device)
+        if self._uRank is None:
+            self._matmul_into(state, [("U", self.U)], pre_comp, workspace, wComp)
+        else:
+            self._matmul_into(state, [("U1", self.U1), ("U2", self.U2)], pre_comp, workspace, wComp)
+        c = gen_nonlinearity_(pre_comp.add_(self.bias_update),
+                              self._update_nonlinearity)
+
+        # coef[0] = sigmoid(beta), coef[1] = sigmoid(alpha)
+        coef = workspace.empty(self, "coef", (2, 1), dtype, device)
+        torch.sigmoid(self.beta, out=coef[0:1])
+        torch.sigmoid(self.alpha, out=coef[1:2])
+
+        torch.mul(state, coef[0:1], out=out)
+        return out.addcmul_(c, coef[1:2])
+
     def getVars(self):
         Vars = []
         if self._num_W_matrices == 1:
@@ -628,57 +1034,67 @@ class LSTMLRCell(RNNCell):
     def cellType(self):
         return "LSTMLR"
 
-    def forward(self, input, hiddenStates):
-        (h, c) = hiddenStates
+    def forward(self, input, hiddenStates: Tuple[torch.Tensor, torch.Tensor]):
+        return self.recurrent_step(self.input_projection(input), hiddenStates)
 
+    def input_projection(self, input):
+        # the four gates side by side, [..., 4 * hidden_size]
+        W = self._packed("W", [self.W1, self.W2, self.W3, self.W4])
         if self._wRank is None:
-            wComp1 = torch.matmul(input, self.W1)
-            wComp2 = torch.matmul(input, self.W2)
-            wComp3 = torch.matmul(input, self.W3)
-            wComp4 = torch.matmul(input, self.W4)
-        else:
-            wComp1 = torch.matmul(
-                torch.matmul(input, self.W), self.W1)
-            wComp2 = torch.matmul(
-                torch.matmul(input, self.W), self.W2)
-            wComp3 = torch.matmul(
-                torch.matmul(input, self.W), self.W3)
-            wComp4 = torch.matmul(
-                torch.matmul(input, self.W), self.W4)
+            return self._mm(input, "W", W)
+        else:
+            return self._mm(self._mm(input, "W", self.W), "Wpacked", W)
+
+    def recurrent_step(self, wComp, hiddenStates: Tuple[torch.Tensor, torch.Tensor]):
+        (h, c) = hiddenStates
+        U = self._packed("U", [self.U1, self.U2, self.U3, self.U4])
 
         if self._uRank is None:
-            uComp1 = torch.matmul(h, self.U1)
-            uComp2 = torch.matmul(h, self.U2)
-            uComp3 = torch.matmul(h, self.U3)
-            uComp4 = torch.matmul(h, self.U4)
-        else:
-            uComp1 = torch.matmul(
-                torch.matmul(h, self.U), self.U1)
-            uComp2 = torch.matmul(
-                torch.matmul(h, self.U), self.U2)
-            uComp3 = torch.matmul(
-                torch.matmul(h, self.U), self.U3)
-            uComp4 = torch.matmul(
-                torch.matmul(h, self.U), self.U4)
-        pre_comp1 = wComp1 + uComp1
-        pre_comp2 = wComp2 + uComp2
-        pre_comp3 = wComp3 + uComp3
-        pre_comp4 = wComp4 + uComp4
-
-        i = gen_nonlinearity(pre_comp1 + self.bias_i,
-                              self._gate_nonlinearity)
-        f = gen_nonlinearity(pre_comp2 + self.bias_f,
-                              self._gate_nonlinearity)
-        o = gen_nonlinearity(pre_comp4 + self.bias_o,
-                              self._gate_nonlinearity)
+            uComp = self._mm(h, "U", U)
+        else:
+            uComp = self._mm(self._mm(h, "U", self.U), "Upacked", U)
+        pre_comp1, pre_comp2, pre_comp3, pre_comp4 = torch.split(
+            wComp + uComp, self._hidden_size, -1)
+
+        i = self.gate_activation(pre_comp1 + self.bias_i)
+        f = self.gate_activation(pre_comp2 + self.bias_f)
+        o = self.gate_activation(pre_comp4 + self.bias_o)
 
-        c_ = gen_nonlinearity(pre_comp3 + self.bias_c,
-                               self._update_nonlinearity)
+        c_ = self.update_activation(pre_comp3 + self.bias_c)
 
         new_c = f * c + i * c_
-        new_h = o * gen_nonlinearity(new_c, self._update_nonlinearity)
+        new_h = o * self.update_activation(new_c)
         return new_h, new_c
 
+    def input_projection_into(self, input, workspace):
+        W = self._packed("W", [self.W1, self.W2, self.W3, self.W4])
+        if self._wRank is None:
+            return self._projection_into(input, [("W", W)], workspace)
+        return self._projection_into(input, [("W", self.W), ("Wpacked", W)], workspace)
+
+    def step_into(self, wComp, hiddenStates: Tuple[torch.Tensor, torch.Tensor],
+                  out: Tuple[torch.Tensor, torch.Tensor], workspace):
+        # out = (h, c) buffers, the c buffer may be the c of hiddenStates
+        (h, c), (h_out, c_out) = hiddenStates, out
+        H = self._hidden_size
+        U = self._packed("U", [self.U1, self.U2, self.U3, self.U4])
+        pre_comp = workspace.empty(self, "pre_comp", (h.shape[0], 4 * H), h.dtype, h.device)
+        if self._uRank is None:
+            self._matmul_into(h, [("U", U)], pre_comp, workspace, wComp)
+        else:
+            self._matmul_into(h, [("U", self.U), ("Upacked", U)], pre_comp, workspace, wComp)
+
+        i = gen_nonlinearity_(pre_comp[:, :H].add_(self.bias_i), self._gate_nonlinearity)
+        f = gen_nonlinearity_(pre_comp[:, H:2 * H].add_(self.bias_f), self._gate_nonlinearity)
+        c_ = gen_nonlinearity_(pre_comp[:, 2 * H:3 * H].add_(self.bias_c), self._update_nonlinearity)
+        o = gen_nonlinearity_(pre_comp[:, 3 * H:].add_(self.bias_o), self._gate_nonlinearity)
+
+        torch.mul(f, c, out=c_out).addcmul_(i, c_)
+        # c_ is free again, it holds update_nl(new_c)
+        c_ = gen_nonlinearity_(c_.copy_(c_out), self._update_nonlinearity)
+        torch.mul(o, c_, out=h_out)
+        return h_out, c_out
+
     def getVars(self):
         Vars = []
         if self._num_W_matrices == 4:
@@ -782,47 +1198,74 @@ class GRULRCell(RNNCell):
         return "GRULR"
 
     def forward(self, input, state):
+        return self.recurrent_step(self.input_projection(input), state)
+
+    def input_projection(self, input):
+        # the three gates side by side, [..., 3 * hidden_size]
+        W = self._packed("W", [self.W1, self.W2, self.W3])
         if self._wRank is None:
-            wComp1 = torch.matmul(input, self.W1)
-            wComp2 = torch.matmul(input, self.W2)
-            wComp3 = torch.matmul(input, self.W3)
+            return self._mm(input, "W", W)
         else:
-            wComp1 = torch.matmul(
-                torch.matmul(input, self.W), self.W1)
-            wComp2 = torch.matmul(
-                torch.matmul(input, self.W), self.W2)
-            wComp3 = torch.matmul(
-                torch.matmul(input, self.W), self.W3)
+            return self._mm(self._mm(input, "W", self.W), "Wpacked", W)
+
+    def recurrent_step(self, wComp, state):
+        wComp12, wComp3 = torch.split(wComp, [2 * self._hidden_size, self._hidden_size], -1)
+        # U3 acts on r * state, only the r and z gates share a GEMM
+        U = self._packed("U", [self.U1, self.U2])
 
         if self._uRank is None:
-            uComp1 = torch.matmul(state, self.U1)
-            uComp2 = torch.matmul(state, self.U2)
+            uComp = self._mm(state, "U", U)
         else:
-            uComp1 = torch.matmul(
-                torch.matmul(state, self.U), self.U1)
-            uComp2 = torch.matmul(
-                torch.matmul(state, self.U), self.U2)
+            uComp = self._mm(self._mm(state, "U", self.U), "Upacked", U)
+        pre_comp1, pre_comp2 = torch.split(wComp12 + uComp, self._hidden_size, -1)
 
-        pre_comp1 = wComp1 + uComp1
-        pre_comp2 = wComp2 + uComp2
-
-        r = gen_nonlinearity(pre_comp1 + self.bias_r,
-                              self._gate_nonlinearity)
-        z = gen_nonlinearity(pre_comp2 + self.bias_gate,
-                              self._gate_nonlinearity)
+        r = self.gate_activation(pre_comp1 + self.bias_r)
+        z = self.gate_activation(pre_comp2 + self.bias_gate)
 
         if self._uRank is None:
-            pre_comp3 = wComp3 + torch.matmul(r * state, self.U3)
+            pre_comp3 = wComp3 + self._mm(r * state, "U3", self.U3)
         else:
             pre_comp3 = wComp3 + \
-                torch.matmul(torch.matmul(r * state, self.U), self.U3)
+                self._mm(self._mm(r * state, "U", self.U), "U3", self.U3)
 
-        c = gen_nonlinearity(pre_comp3 + self.bias_update,
-                              self._update_nonlinearity)
+        c = self.update_activation(pre_comp3 + self.bias_update)
 
         new_h = z * state + (1.0 - z) * c
         return new_h
 
+    def input_projection_into(self, input, workspace):
+        W = self._packed("W", [self.W1, self.W2, self.W3])
+        if self._wRank is None:
+            return self._projection_into(input, [("W", W)], workspace)
+        return self._projection_into(input, [("W", self.W), ("Wpacked", W)], workspace)
+
+    def step_into(self, wComp, state, out, workspace):
+        H = self._hidden_size
+        batch_size = state.shape[0]
+        dtype, device = state.dtype, state.device
+        U = self._packed("U", [self.U1, self.U2])
+        pre_comp = workspace.empty(self, "pre_comp", (batch_size, 2 * H), dtype, device)
+        if self._uRank is None:
+            self._matmul_into(state, [("U", U)], pre_comp, workspace, wComp[:, :2 * H])
+        else:
+            self._matmul_into(state, [("U", self.U), ("Upacked", U)], pre_comp, workspace,
+                              wComp[:, :2 * H])
+        r = gen_nonlinearity_(pre_comp[:, :H].add_(self.bias_r), self._gate_nonlinearity)
+        z = gen_nonlinearity_(pre_comp[:, H:].add_(self.bias_gate), self._gate_nonlinearity)
+
+        # r becomes r * state, the input of U3
+        r.mul_(state)
+        c = workspace.empty(self, "c", (batch_size, H), dtype, device)
+        if self._uRank is None:
+            self._matmul_into(r, [("U3", self.U3)], c, workspace, wComp[:, 2 * H:])
+        else:
+            self._matmul_into(r, [("U", self.U), ("U3", self.U3)], c, workspace, wComp[:, 2 * H:])
+        c = gen_nonlinearity_(c.add_(self.bias_update), self._update_nonlinearity)
+
+        # z * state + (1 - z) * c, without a Python scalar in-place op
+        # (those allocate a wrapped scalar tensor every call)
+        return torch.sub(state, c, out=out).mul_(z).add_(c)
+
     def getVars(self):
         Vars = []
         if self._num_W_matrices == 3:
@@ -917,35 +1360,52 @@ class UGRNNLRCell(RNNCell):
         return "UGRNNLR"
 
     def forward(self, input, state):
+        return self.recurrent_step(self.input_projection(input), state)
+
+    def input_projection(self, input):
+        # both gates side by side, [..., 2 * hidden_size]
+        W = self._packed("W", [self.W1, self.W2])
         if self._wRank is None:
-            wComp1 = torch.matmul(input, self.W1)
-            wComp2 = torch.matmul(input, self.W2)
+            return self._mm(input, "W", W)
         else:
-            wComp1 = torch.matmul(
-                torch.matmul(input, self.W), self.W1)
-            wComp2 = torch.matmul(
-                torch.matmul(input, self.W), self.W2)
+            return self._mm(self._mm(input, "W", self.W), "Wpacked", W)
+
+    def recurrent_step(self, wComp, state):
+        U = self._packed("U", [self.U1, self.U2])
 
         if self._uRank is None:
-            uComp1 = torch.matmul(state, self.U1)
-            uComp2 = torch.matmul(state, self.U2)
+            uComp = self._mm(state, "U", U)
         else:
-            uComp1 = torch.matmul(
-                torch.matmul(state, self.U), self.U1)
-            uComp2 = torch.matmul(
-                torch.matmul(state, self.U), self.U2)
-
-        pre_comp1 = wComp1 + uComp1
-        pre_comp2 = wComp2 + uComp2
+            uComp = self._mm(self._mm(state, "U", self.U), "Upacked", U)
+        pre_comp1, pre_comp2 = torch.split(wComp + uComp, self._hidden_size, -1)
 
-        z = gen_nonlinearity(pre_comp1 + self.bias_gate,
-                              self._gate_nonlinearity)
-        c = gen_nonlinearity(pre_comp2 + self.bias_update,
-                              self._update_nonlinearity)
+        z = self.gate_activation(pre_comp1 + self.bias_gate)
+        c = self.update_activation(pre_comp2 + self.bias_update)
 
         new_h = z * state + (1.0 - z) * c
         return new_h
 
+    def input_projection_into(self, input, workspace):
+        W = self._packed("W", [self.W1, self.W2])
+        if self._wRank is None:
+            return self._projection_into(input, [("W", W)], workspace)
+        return self._projection_into(input, [("W", self.W), ("Wpacked", W)], workspace)
+
+    def step_into(self, wComp, state, out, workspace):
+        H = self._hidden_size
+        U = self._packed("U", [self.U1, self.U2])
+        pre_comp = workspace.empty(self, "pre_comp", (state.shape[0], 2 * H), state.dtype, state.device)
+        if self._uRank is None:
+            self._matmul_into(state, [("U", U)], pre_comp, workspace, wComp)
+        else:
+            self._matmul_into(state, [("U", self.U), ("Upacked", U)], pre_comp, workspace, wComp)
+        z = gen_nonlinearity_(pre_comp[:, :H].add_(self.bias_gate), self._gate_nonlinearity)
+        c = gen_nonlinearity_(pre_comp[:, H:].add_(self.bias_update), self._update_nonlinearity)
+
+        # z * state + (1 - z) * c, without a Python scalar in-place op
+        # (those allocate a wrapped scalar tensor every call)
+        return torch.sub(state, c, out=out).mul_(z).add_(c)
+
     def getVars(self):
         Vars = []
         if self._num_W_matrices == 2:
@@ -963,6 +1423,50 @@ class UGRNNLRCell(RNNCell):
         return Vars
 
 
+def _step_attributes(cell):
+    '''
+    Everything but the parameters that decides what a step of cell
+    computes: its plain attributes (nonlinearities, ranks, sizes, ...)
+    and the types of its activation modules
+    '''
+    plain = (str, int, float, bool, list, tuple, type(None))
+    attributes = {k: v for k, v in vars(cell).items()
+                  if isinstance(v, plain) or (callable(v) and not isinstance(v, nn.Module))}
+    attributes['gate_activation'] = type(cell.gate_activation)
+    attributes['update_activation'] = type(cell.update_activation)
+    return attributes
+
+
+class _StackedCell(object):
+    '''
+    Stands in for a cell whose parameters are those of two cells of the
+    same type stacked as [2, ...], so that calling the cell's own methods
+    on it turns every matmul into a batched matmul over both cells.
+    Only valid for cells with equal _step_attributes.
+
+    packed_cache holds the _packed results of the stacked tensors, apart
+    from the cache of the cell itself. BaseRNN owns it next to the stacked
+    parameters it caches, so both live across calls.
+    '''
+    def __init__(self, cell, params, packed_cache):
+        self._cell = cell
+        self._params = params
+        self._packed_cache = packed_cache
+
+    def __getattr__(self, name):
+        params = self.__dict__['_params']
+        if name in params:
+            return params[name]
+        return getattr(self.__dict__['_cell'], name)
+
+    def _packed(self, name, mats):
+        return RNNCell._packed(self, name, mats)
+
+    def _mm(self, input, name, mat):
+        # stacked weights are never run as sparse matrices
+        return torch.matmul(input, mat)
+
+
 class BaseRNN(nn.Module):
     '''
     Generic equivalent of static_rnn in tf
@@ -971,7 +1475,22 @@ class BaseRNN(nn.Module):
     (following the convention in pytorch) ie.,
     [timeSteps, batchSize, inputDims] else
     [batchSize, timeSteps, inputDims]
+
+    The input side of every step (RNNCell.input_projection) is computed for
+    the whole sequence before the loop, so each step only does the
+    recurrent matmuls. Bidirectional unrolls advance both directions
+    together with a single cell call per step: with a shared cell (no
+    cell_reverse) the two directions are stacked along the batch, with a
+    separate reverse cell of the same type the weights of both cells are
+    stacked and every matmul becomes a batched matmul.
+
+    BaseRNN and the cells above (except FastGRNNCUDACell) can be compiled
+    with torch.jit.script. The cell type and directions are constants, so
+    the scripted unroll has no per-step dispatch; a scripted module ignores
+    the workspace and runs separate reverse cells one after the other.
+    benchmarks/bench_script.py checks scripted against eager modules.
     '''
+    __constants__ = ['_batch_first', '_bidirectional', '_shared', '_isLSTM']
 
     def __init__(self, cell: RNNCell, batch_first=False, cell_reverse: RNNCell=None, bidirectional=False):
         super(BaseRNN, self).__init__()
@@ -982,106 +1501,509 @@ class BaseRNN(nn.Module):
             self.RNNCell_reverse = cell_reverse
         elif self._bidirectional:
             self.RNNCell_reverse = cell
+        self._shared = bidirectional and self.RNNCell_reverse is cell
+        self._isLSTM = cell.cellType == "LSTMLR"
+        self._hidden_size = cell.output_size
+        # optional Workspace reused across calls when grad is disabled
+        self.workspace = None
+        # stacked parameters of a separate reverse cell, reused while grad
+        # is disabled and no parameter changes, and their _packed results
+        self._stacked_cache = None
+        self._stacked_packed_cache = {}
 
     def getVars(self):
         return self.RNNCell.getVars()
 
-    def forward(self, input, hiddenState=None,
-                cellState=None):
-        self.device = input.device
-        self.num_directions = 2 if self._bidirectional else 1
-        # hidden
-        # for i in range(num_directions):
-        hiddenStates = torch.zeros(
-                [input.shape[0], input.shape[1],
-                 self.RNNCell.output_size]).to(self.device)
+    def _stacked_parameters(self):
+        '''
+        Parameters of both cells stacked as [2, ...] for a single batched
+        call of a separate reverse cell, None when it cannot be batched:
+        the cells need the same type, parameter shapes and
+        _step_attributes. Without grad the stacked tensors are cached and
+        rebuilt only when a parameter is replaced or updated in place.
+        '''
+        cell, cell_reverse = self.RNNCell, self.RNNCell_reverse
+        if type(cell) is not type(cell_reverse) or \
+                cell.cellType == "FastGRNNCUDACell":
+            return None
+        params = dict(cell.named_parameters())
+        params_reverse = dict(cell_reverse.named_parameters())
+        if params.keys() != params_reverse.keys() or \
+                any(params[k].shape != params_reverse[k].shape for k in params) or \
+                _step_attributes(cell) != _step_attributes(cell_reverse):
+            return None
+        if torch.is_grad_enabled():
+            return {k: torch.stack([params[k], params_reverse[k]]) for k in params}
+
+        mats = [m for k in params for m in (params[k], params_reverse[k])]
+        key = [(m.data_ptr(), m._version) for m in mats]
+        cached = self._stacked_cache
+        if cached is None or cached[1] != key or \
+                any(a is not b for a, b in zip(cached[0], mats)):
+            stacked = {k: torch.stack([params[k], params_reverse[k]]) for k in params}
+            cached = (mats, key, stacked)
+            self._stacked_cache = cached
+        return cached[2]
+
+    def _projections(self, input):
+        '''
+        input_projection of the sequence for every direction, stacked as
+        [timeSteps, num_directions, batchSize, *] with the reverse direction
+        already in reversed time order
+        '''
+        projection = self.RNNCell.input_projection(input)
+        if self._bidirectional:
+            if self._shared:
+                # the reversed sequence projects to the reversed projection
+                reverse = torch.flip(projection, [0])
+            else:
+                reverse = torch.flip(self.RNNCell_reverse.input_projection(input), [0])
+            return torch.stack([projection, reverse], dim=1)
+        else:
+            return projection.unsqueeze(1)
 
+    def _bidirectional_step(self, projection, state,
+                            params: Optional[Dict[str, torch.Tensor]]):
+        '''
+        One recurrent step of both directions. projection is
+        [2, batch, *] and the state [2, batch, hidden] with the forward
+        direction first.
+        '''
+        if self._shared:
+            batchSize = projection.shape[1]
+            output = self.RNNCell.recurrent_step(projection.reshape(2 * batchSize, -1),
+                                                 state.reshape(2 * batchSize, -1))
+            return output.view(2, batchSize, -1)
+        else:
+            if not torch.jit.is_scripting():
+                if params is not None:
+                    return type(self.RNNCell).recurrent_step(
+                        _StackedCell(self.RNNCell, params, self._stacked_packed_cache), projection, state)
+            return torch.stack([self.RNNCell.recurrent_step(projection[0], state[0]),
+                                self.RNNCell_reverse.recurrent_step(projection[1], state[1])])
+
+    def _bidirectional_step_lstm(self, projection, state: Tuple[torch.Tensor, torch.Tensor],
+                                 params: Optional[Dict[str, torch.Tensor]]):
+        '''
+        _bidirectional_step for cells whose state is (hidden, cell)
+        '''
+        h, c = state
+        if self._shared:
+            batchSize = projection.shape[1]
+            newH, newC = self.RNNCell.recurrent_step(projection.reshape(2 * batchSize, -1),
+                                                     (h.reshape(2 * batchSize, -1),
+                                                      c.reshape(2 * batchSize, -1)))
+            return newH.view(2, batchSize, -1), newC.view(2, batchSize, -1)
+        else:
+            if not torch.jit.is_scripting():
+                if params is not None:
+                    return type(self.RNNCell).recurrent_step(
+                        _StackedCell(self.RNNCell, params, self._stacked_packed_cache), projection, (h, c))
+            forward = self.RNNCell.recurrent_step(projection[0], (h[0], c[0]))
+            reverse = self.RNNCell_reverse.recurrent_step(projection[1], (h[1], c[1]))
+            return torch.stack([forward[0], reverse[0]]), torch.stack([forward[1], reverse[1]])
+
+    def _batched_parameters(self) -> Optional[Dict[str, torch.Tensor]]:
+        params: Optional[Dict[str, torch.Tensor]] = None
+        if not torch.jit.is_scripting():
+            if self._bidirectional and not self._shared:
+                params = self._stacked_parameters()
+        return params
+
+    def _state_dtype(self, input) -> torch.dtype:
+        if not torch.jit.is_scripting():
+            return state_dtype(input.dtype)
+        return input.dtype
+
+    def _zeros(self, input, shape: List[int]):
+        return torch.zeros(shape, dtype=self._state_dtype(input), device=input.device)
+
+    def _empty(self, input, shape: List[int]):
+        return torch.empty(shape, dtype=self._state_dtype(input), device=input.device)
+
+    def _step(self, projection, hidden, params: Optional[Dict[str, torch.Tensor]]):
+        '''
+        One step of every direction, [num_directions, batch, *] in and out
+        '''
         if self._bidirectional:
-                hiddenStates_reverse = torch.zeros(
-                    [input.shape[0], input.shape[1],
-                     self.RNNCell_reverse.output_size]).to(self.device)
+            return self._bidirectional_step(projection, hidden, params)
+        else:
+            return self.RNNCell.recurrent_step(projection[0], hidden[0]).unsqueeze(0)
 
+    def _step_lstm(self, projection, state: Tuple[torch.Tensor, torch.Tensor],
+                   params: Optional[Dict[str, torch.Tensor]]):
+        if self._bidirectional:
+            return self._bidirectional_step_lstm(projection, state, params)
+        else:
+            newHidden, newCell = self.RNNCell.recurrent_step(projection[0], (state[0][0], state[1][0]))
+            return newHidden.unsqueeze(0), newCell.unsqueeze(0)
+
+    def _unroll(self, input, hiddenState: Optional[torch.Tensor]):
+        '''
+        With grad enabled every step output is kept as its own tensor and
+        the history is stacked once at the end, so autograd never sees an
+        in-place write. Without grad nothing is saved for backward and each
+        step is written straight into the history, which is then read back
+        as the next state, without any clone.
+        '''
+        timeSteps, batchSize = input.shape[0], input.shape[1]
+        num_directions = 2 if self._bidirectional else 1
         if hiddenState is None:
-                hiddenState = torch.zeros(
-                    [self.num_directions, input.shape[0] if self._batch_first else input.shape[1],
-                    self.RNNCell.output_size]).to(self.device)
-
-        if self._batch_first is True:
-            if self.RNNCell.cellType == "LSTMLR":
-                cellStates = torch.zeros(
-                    [input.shape[0], input.shape[1],
-                     self.RNNCell.output_size]).to(self.device)
-                if self._bidirectional:
-                    cellStates_reverse = torch.zeros(
-                    [input.shape[0], input.shape[1],
-                     self.RNNCell_reverse.output_size]).to(self.device)
+            hidden = self._zeros(input, [num_directions, batchSize, self._hidden_size])
+        else:
+            hidden = hiddenState
+
+        projections = self._projections(input)
+        params = self._batched_parameters()
+        if torch.is_grad_enabled():
+            outputs: List[torch.Tensor] = []
+            for i in range(timeSteps):
+                hidden = self._step(projections[i], hidden, params)
+                outputs.append(hidden)
+            return torch.stack(outputs)
+        else:
+            hiddenStates = self._empty(input, [timeSteps, num_directions, batchSize, self._hidden_size])
+            for i in range(timeSteps):
+                hiddenStates[i] = self._step(projections[i], hidden, params)
+                hidden = hiddenStates[i]
+            return hiddenStates
+
+    def _unroll_lstm(self, input, hiddenState: Optional[torch.Tensor],
+                     cellState: Optional[torch.Tensor]):
+        timeSteps, batchSize = input.shape[0], input.shape[1]
+        num_directions = 2 if self._bidirectional else 1
+        shape = [timeSteps, num_directions, batchSize, self._hidden_size]
+        if hiddenState is None:
+            hidden = self._zeros(input, shape[1:])
+        else:
+            hidden = hiddenState
+        if cellState is None:
+            cell = self._zeros(input, shape[1:])
+        else:
+            cell = cellState
+
+        projections = self._projections(input)
+        params = self._batched_parameters()
+        if torch.is_grad_enabled():
+            hiddenOutputs: List[torch.Tensor] = []
+            cellOutputs: List[torch.Tensor] = []
+            for i in range(timeSteps):
+                hidden, cell = self._step_lstm(projections[i], (hidden, cell), params)
+                hiddenOutputs.append(hidden)
+                cellOutputs.append(cell)
+            return torch.stack(hiddenOutputs), torch.stack(cellOutputs)
+        else:
+            hiddenStates = self._empty(input, shape)
+            cellStates = self._empty(input, shape)
+            for i in range(timeSteps):
+                newHidden, newCell = self._step_lstm(projections[i], (hidden, cell), params)
+                hiddenStates[i] = newHidden
+                cellStates[i] = newCell
+                hidden, cell = hiddenStates[i], cellStates[i]
+            return hiddenStates, cellStates
+
+    def _final_state(self, input, hiddenState: Optional[torch.Tensor]):
+        '''
+        _unroll that keeps only the running state and returns the last one,
+        [num_directions, batchSize, hidden]
+        '''
+        batchSize = input.shape[1]
+        num_directions = 2 if self._bidirectional else 1
+        if hiddenState is None:
+            hidden = self._zeros(input, [num_directions, batchSize, self._hidden_size])
+        else:
+            hidden = hiddenState
+
+        projections = self._projections(input)
+        params = self._batched_parameters()
+        for i in range(input.shape[0]):
+            hidden = self._step(projections[i], hidden, params)
+        return hidden
+
+    def _final_state_lstm(self, input, hiddenState: Optional[torch.Tensor],
+                          cellState: Optional[torch.Tensor]):
+        batchSize = input.shape[1]
+        num_directions = 2 if self._bidirectional else 1
+        if hiddenState is None:
+            hidden = self._zeros(input, [num_directions, batchSize, self._hidden_size])
+        else:
+            hidden = hiddenState
+        if cellState is None:
+            cell = self._zeros(input, [num_directions, batchSize, self._hidden_size])
+        else:
+            cell = cellState
+
+        projections = self._projections(input)
+        params = self._batched_parameters()
+        for i in range(input.shape[0]):
+            hidden, cell = self._step_lstm(projections[i], (hidden, cell), params)
+        return hidden, cell
+
+    def _step_states(self, projection, states: List[torch.Tensor],
+                     params: Optional[Dict[str, torch.Tensor]]) -> List[torch.Tensor]:
+        '''
+        _step or _step_lstm on the state as a list, [hidden] or [hidden, cell]
+        '''
+        if self._isLSTM:
+            newHidden, newCell = self._step_lstm(projection, (states[0], states[1]), params)
+            return [newHidden, newCell]
+        else:
+            return [self._step(projection, states[0], params)]
+
+    def _projections_lengths(self, input, lengths: List[int]):
+        '''
+        _projections of sequences with the given lengths: the reverse
+        direction of every sequence starts from its own last step
+        '''
+        projection = self.RNNCell.input_projection(input)
+        if self._bidirectional:
+            if self._shared:
+                reverse = projection
+            else:
+                reverse = self.RNNCell_reverse.input_projection(input)
+            # step i of the reverse direction reads timestep length - 1 - i,
+            # clamped for the steps past the end that are never computed
+            steps = torch.arange(input.shape[0], device=input.device).unsqueeze(1)
+            index = (torch.tensor(lengths, device=input.device).unsqueeze(0) - 1 - steps).clamp(min=0)
+            reverse = torch.gather(reverse, 0, index.unsqueeze(-1).expand_as(reverse))
+            return torch.stack([projection, reverse], dim=1)
+        else:
+            return projection.unsqueeze(1)
+
+    def _unroll_lengths(self, input, states: List[torch.Tensor], lengths,
+                        return_sequence: bool) -> List[torch.Tensor]:
+        '''
+        Unroll of a padded [timeSteps, batchSize, *] input whose sequences
+        have the given lengths. The batch is sorted by decreasing length and
+        a sequence leaves the active batch once it has ended, so every step
+        only computes the sequences still running and each sequence gets
+        exactly the result of running it alone.
+
+        Returns the state histories ([timeSteps, num_directions, batchSize,
+        hidden], zero past the end of each sequence), or with
+        return_sequence=False the last state of every sequence.
+        Raises ValueError unless lengths has one entry per sequence, each
+        in [0, timeSteps].
+        '''
+        timeSteps, batchSize = input.shape[0], input.shape[1]
+        if lengths.dim() != 1 or lengths.shape[0] != batchSize:
+            raise ValueError("lengths should have one entry per sequence, got " +
+                             str(lengths.numel()) + " for a batch of " + str(batchSize))
+        sortedLengths, order = torch.sort(lengths.to(torch.long).cpu(), descending=True)
+        lengthList: List[int] = sortedLengths.tolist()
+        if batchSize > 0 and (lengthList[0] > timeSteps or lengthList[-1] < 0):
+            raise ValueError("lengths should be in [0, " + str(timeSteps) + "] for " +
+                             str(timeSteps) + " timesteps, got values from " +
+                             str(lengthList[-1]) + " to " + str(lengthList[0]))
+        order = order.to(input.device)
+        input = input.index_select(1, order)
+        states = [state.index_select(1, order) for state in states]
+
+        projections = self._projections_lengths(input, lengthList)
+        params = self._batched_parameters()
+        active = batchSize
+        # the states of the sequences that ended, in decreasing row order
+        finished: List[List[torch.Tensor]] = []
+        histories: List[List[torch.Tensor]] = [[] for _ in states]
+        maxLength = lengthList[0] if batchSize > 0 else 0
+        for i in range(maxLength):
+            running = active
+            while lengthList[running - 1] <= i:
+                running -= 1
+            if running < active:
+                finished.append([state[:, running:] for state in states])
+                states = [state[:, :running] for state in states]
+                active = running
+            states = self._step_states(projections[i, :, :active], states, params)
+            if return_sequence:
+                for history, state in zip(histories, states):
+                    history.append(torch.nn.functional.pad(state, [0, 0, 0, batchSize - active]))
+        finished.append(states)
+
+        inverse = torch.argsort(order)
+        results: List[torch.Tensor] = []
+        for j in range(len(states)):
+            if return_sequence:
+                if maxLength > 0:
+                    history = torch.stack(histories[j])
+                    if maxLength < timeSteps:
+                        history = torch.nn.functional.pad(history, [0, 0, 0, 0, 0, 0, 0, timeSteps - maxLength])
+                else:
+                    history = self._zeros(input, [timeSteps, states[j].shape[0], batchSize, self._hidden_size])
+                results.append(history.index_select(2, inverse))
+            else:
+                final = torch.cat([chunk[j] for chunk in finished[::-1]], 1)
+                results.append(final.index_select(1, inverse))
+        return results
+
+    def _final(self, state):
+        '''
+        [num_directions, batchSize, hidden] state to [batchSize, num_directions * hidden],
+        equal to the last timestep of the full output
+        '''
+        if self._bidirectional:
+            return torch.cat([state[0], state[1]], -1)
+        else:
+            return state[0]
+
+    def _output(self, states):
+        '''
+        [timeSteps, num_directions, batchSize, hidden] state history to the
+        output layout, directions concatenated along the features
+        '''
+        if self._bidirectional:
+            states = torch.cat([states[:, 0], states[:, 1]], -1)
+        else:
+            states = states[:, 0]
+        if self._batch_first:
+            states = states.transpose(0, 1)
+        return states
+
+    def forward(self, input, hiddenState: Optional[torch.Tensor]=None,
+                cellState: Optional[torch.Tensor]=None, return_sequence: bool=True,
+                lengths: Optional[torch.Tensor]=None):
+        '''
+        Returns the hidden states of every timestep ([timeSteps, batchSize,
+        num_directions * hidden], batch first if batch_first), and the cell
+        states too for LSTMs.
+
+        return_sequence=False keeps only the running state and returns the
+        last hidden state, [batchSize, num_directions * hidden], which is the
+        last timestep of the full output: the forward direction after the
+        last input concatenated with the reverse direction after the first.
+
+        lengths ([batchSize], on any device) gives the number of valid
+        timesteps of every sequence in a padded input, see _unroll_lengths.
+        The reverse direction of a sequence then starts at its last valid
+        timestep, and return_sequence=False returns the state each sequence
+        ended with. The workspace is not used for such inputs. lengths must
+        have batchSize entries in [0, timeSteps], else ValueError is raised.
+        '''
+        if not torch.jit.is_scripting():
+            if lengths is not None:
+                lengths = torch.as_tensor(lengths)
+            elif self.workspace is not None and not torch.is_grad_enabled() \
+                    and not autocast_enabled():
+                return self._forward_workspace(input, hiddenState, cellState, return_sequence)
+        if self._batch_first:
+            input = input.transpose(0, 1)
+        if lengths is not None:
+            shape = [2 if self._bidirectional else 1, input.shape[1], self._hidden_size]
+            if hiddenState is None:
+                states = [self._zeros(input, shape)]
+            else:
+                states = [hiddenState]
+            if self._isLSTM:
                 if cellState is None:
-                    cellState = torch.zeros(
-                        [self.num_directions, input.shape[0], self.RNNCell.output_size]).to(self.device)
-                for i in range(0, input.shape[1]):
-                    hiddenState[0], cellState[0] = self.RNNCell(
-                        input[:, i, :], (hiddenState[0].clone(), cellState[0].clone()))
-                    hiddenStates[:, i, :] = hiddenState[0]
-                    cellStates[:, i, :] = cellState[0]
-                    if self._bidirectional:
-                        hiddenState[1], cellState[1] = self.RNNCell_reverse(
-                            input[:, input.shape[1]-i-1, :], (hiddenState[1].clone(), cellState[1].clone()))
-                        hiddenStates_reverse[:, i, :] = hiddenState[1]
-                        cellStates_reverse[:, i, :] = cellState[1]
-                if not self._bidirectional:
-                    return hiddenStates, cellStates
+                    states.append(self._zeros(input, shape))
                 else:
-                    return torch.cat([hiddenStates,hiddenStates_reverse],-1), torch.cat([cellStates,cellStates_reverse],-1)  
+                    states.append(cellState)
+            results = self._unroll_lengths(input, states, lengths, return_sequence)
+            if return_sequence:
+                results = [self._output(result) for result in results]
             else:
-                for i in range(0, input.shape[1]):
-                    hiddenState[0] = self.RNNCell(input[:, i, :], hiddenState[0].clone())
-                    hiddenStates[:, i, :] = hiddenState[0]
-                    if self._bidirectional:
-                        hiddenState[1] = self.RNNCell_reverse(
-                            input[:, input.shape[1]-i-1, :], hiddenState[1].clone())
-                        hiddenStates_reverse[:, i, :] = hiddenState[1]
-                if not self._bidirectional:
-                    return hiddenStates
+                results = [self._final(result) for result in results]
+            if self._isLSTM:
+                return results[0], results[1]
+            else:
+                return results[0]
+        if self._isLSTM:
+            if return_sequence:
+                hiddenStates, cellStates = self._unroll_lstm(input, hiddenState, cellState)
+                return self._output(hiddenStates), self._output(cellStates)
+            else:
+                hidden, cell = self._final_state_lstm(input, hiddenState, cellState)
+                return self._final(hidden), self._final(cell)
+        else:
+            if return_sequence:
+                return self._output(self._unroll(input, hiddenState))
+            else:
+                return self._final(self._final_state(input, hiddenState))
+
+    def _forward_workspace(self, input, hiddenState=None, cellState=None, return_sequence=True):
+        '''
+        Inference unroll that takes every buffer from self.workspace and
+        writes each step straight into the state history, so a call with
+        already seen shapes allocates nothing. Without return_sequence the
+        history is two slots used in turn. hiddenState and cellState are
+        only read, like in the other unrolls.
+        '''
+        workspace = self.workspace
+        if self._batch_first:
+            input = input.transpose(0, 1)
+        timeSteps, batchSize = input.shape[0], input.shape[1]
+        dtype, device = input.dtype, input.device
+        num_directions = 2 if self._bidirectional else 1
+        isLSTM = self.RNNCell.cellType == "LSTMLR"
+        hidden_size = self.RNNCell.output_size
+        slots = timeSteps if return_sequence else 2
+        shape = (slots, num_directions, batchSize, hidden_size)
+        last = (timeSteps - 1) % slots
+
+        hiddenStates = workspace.empty(self, "hiddenStates", shape, dtype, device)
+        if hiddenState is None:
+            hiddenState = workspace.zeros(self, "hiddenState", shape[1:], dtype, device)
+        if isLSTM:
+            cellStates = workspace.empty(self, "cellStates", shape, dtype, device)
+            if cellState is None:
+                cellState = workspace.zeros(self, "cellState", shape[1:], dtype, device)
+
+        if self._shared:
+            # both directions as one batch of 2 * batchSize
+            projection = self.RNNCell.input_projection_into(input, workspace)
+            stacked = workspace.empty(self, "projection", (timeSteps, 2) + tuple(projection.shape[1:]),
+                                      dtype, device)
+            stacked[:, 0].copy_(projection)
+            for i in range(timeSteps):
+                stacked[i, 1].copy_(projection[timeSteps - i - 1])
+            stacked = stacked.view(timeSteps, 2 * batchSize, -1)
+            hiddenStates = hiddenStates.view(slots, 2 * batchSize, hidden_size)
+            h = hiddenState.reshape(2 * batchSize, hidden_size)
+            if isLSTM:
+                cellStates = cellStates.view(slots, 2 * batchSize, hidden_size)
+                c = cellState.reshape(2 * batchSize, hidden_size)
+            for i in range(timeSteps):
+                if isLSTM:
+                    h, c = self.RNNCell.step_into(stacked[i], (h, c),
+                                                  (hiddenStates[i % slots], cellStates[i % slots]), workspace)
                 else:
-                    return torch.cat([hiddenStates,hiddenStates_reverse],-1)
+                    h = self.RNNCell.step_into(stacked[i], h, hiddenStates[i % slots], workspace)
+            hiddenStates = hiddenStates.view(shape)
+            if isLSTM:
+                cellStates = cellStates.view(shape)
         else:
-            if self.RNNCell.cellType == "LSTMLR":
-                cellStates = torch.zeros(
-                    [input.shape[0], input.shape[1],
-                     self.RNNCell.output_size]).to(self.device)
+            cells = [self.RNNCell, self.RNNCell_reverse] if self._bidirectional else [self.RNNCell]
+            for d, cell in enumerate(cells):
+                projection = cell.input_projection_into(input, workspace)
+                h = hiddenState[d]
+                c = cellState[d] if isLSTM else None
+                for i in range(timeSteps):
+                    x = projection[i] if d == 0 else projection[timeSteps - i - 1]
+                    if isLSTM:
+                        h, c = cell.step_into(x, (h, c), (hiddenStates[i % slots, d], cellStates[i % slots, d]),
+                                              workspace)
+                    else:
+                        h = cell.step_into(x, h, hiddenStates[i % slots, d], workspace)
+
+        outputs = [hiddenStates, cellStates] if isLSTM else [hiddenStates]
+        for j, states in enumerate(outputs):
+            if not return_sequence:
+                # [batchSize, num_directions * hidden], no time axis to transpose
+                states = states[last]
                 if self._bidirectional:
-                    cellStates_reverse = torch.zeros(
-                    [input.shape[0], input.shape[1],
-                     self.RNNCell_reverse.output_size]).to(self.device)
-                if cellState is None:
-                    cellState = torch.zeros(
-                        [self.num_directions, input.shape[1], self.RNNCell.output_size]).to(self.device)
-                for i in range(0, input.shape[0]):
-                    hiddenState[0], cellState[0] = self.RNNCell(
-                        input[i, :, :], (hiddenState[0].clone(), cellState[0].clone()))
-                    hiddenStates[i, :, :] = hiddenState[0]
-                    cellStates[i, :, :] = cellState[0]
-                    if self._bidirectional:
-                        hiddenState[1], cellState[1] = self.RNNCell_reverse(
-                            input[input.shape[0]-i-1, :, :], (hiddenState[1].clone(), cellState[1].clone()))
-                        hiddenStates_reverse[i, :, :] = hiddenState[1]
-                        cellStates_reverse[i, :, :] = cellState[1]
-                if not self._bidirectional:
-                    return hiddenStates, cellStates
+                    outputs[j] = torch.cat([states[0], states[1]], -1, out=workspace.empty(
+                        self, "final%d" % j, (batchSize, 2 * hidden_size), dtype, device))
                 else:
-                    return torch.cat([hiddenStates,hiddenStates_reverse],-1), torch.cat([cellStates,cellStates_reverse],-1)
+                    outputs[j] = states[0]
+                continue
+            if self._bidirectional:
+                states = torch.cat([states[:, 0], states[:, 1]], -1,
+                                   out=workspace.empty(self, "output%d" % j, shape[:1] + shape[2:3] + (2 * hidden_size,),
+                                                       dtype, device))
             else:
-                for i in range(0, input.shape[0]):
-                    hiddenState[0] = self.RNNCell(input[i, :, :], hiddenState[0].clone())
-                    hiddenStates[i, :, :] = hiddenState[0]
-                    if self._bidirectional:
-                        hiddenState[1] = self.RNNCell_reverse(
-                            input[input.shape[0]-i-1, :, :], hiddenState[1].clone())
-                        hiddenStates_reverse[i, :, :] = hiddenState[1]
-                if not self._bidirectional:
-                    return hiddenStates
-                else:
-                    return torch.cat([hiddenStates,hiddenStates_reverse],-1)
+                states = states[:, 0]
+            outputs[j] = states.transpose(0, 1) if self._batch_first else states
+        return tuple(outputs) if isLSTM else outputs[0]
 
 
 class LSTM(nn.Module):
@@ -1108,10 +2030,12 @@ class LSTM(nn.Module):
                                update_nonlinearity=update_nonlinearity,
                                wRank=wRank, uRank=uRank,
                                wSparsity=wSparsity, uSparsity=uSparsity)
-            self.unrollRNN = BaseRNN(self.cell, self.cell_reverse, batch_first=self._batch_first, bidirectional=self._bidirectional)
+            self.unrollRNN = BaseRNN(self.cell, batch_first=self._batch_first, cell_reverse=self.cell_reverse, bidirectional=self._bidirectional)
 
-    def forward(self, input, hiddenState=None, cellState=None):
-        return self.unrollRNN(input, hiddenState, cellState)
+    def forward(self, input, hiddenState: Optional[torch.Tensor]=None,
+                cellState: Optional[torch.Tensor]=None, return_sequence: bool=True,
+                lengths: Optional[torch.Tensor]=None):
+        return self.unrollRNN(input, hiddenState, cellState, return_sequence, lengths)
 
 
 class GRU(nn.Module):
@@ -1138,10 +2062,12 @@ class GRU(nn.Module):
                               update_nonlinearity=update_nonlinearity,
                               wRank=wRank, uRank=uRank,
                               wSparsity=wSparsity, uSparsity=uSparsity)
-            self.unrollRNN = BaseRNN(self.cell, self.cell_reverse, batch_first=self._batch_first, bidirectional=self._bidirectional)
+            self.unrollRNN = BaseRNN(self.cell, batch_first=self._batch_first, cell_reverse=self.cell_reverse, bidirectional=self._bidirectional)
 
-    def forward(self, input, hiddenState=None, cellState=None):
-        return self.unrollRNN(input, hiddenState, cellState)
+    def forward(self, input, hiddenState: Optional[torch.Tensor]=None,
+                cellState: Optional[torch.Tensor]=None, return_sequence: bool=True,
+                lengths: Optional[torch.Tensor]=None):
+        return self.unrollRNN(input, hiddenState, cellState, return_sequence, lengths)
 
 
 class UGRNN(nn.Module):
@@ -1168,10 +2094,12 @@ class UGRNN(nn.Module):
                                 update_nonlinearity=update_nonlinearity,
                                 wRank=wRank, uRank=uRank,
                                 wSparsity=wSparsity, uSparsity=uSparsity)
-            self.unrollRNN = BaseRNN(self.cell, self.cell_reverse, batch_first=self._batch_first, bidirectional=self._bidirectional)
+            self.unrollRNN = BaseRNN(self.cell, batch_first=self._batch_first, cell_reverse=self.cell_reverse, bidirectional=self._bidirectional)
 
-    def forward(self, input, hiddenState=None, cellState=None):
-        return self.unrollRNN(input, hiddenState, cellState)
+    def forward(self, input, hiddenState: Optional[torch.Tensor]=None,
+                cellState: Optional[torch.Tensor]=None, return_sequence: bool=True,
+                lengths: Optional[torch.Tensor]=None):
+        return self.unrollRNN(input, hiddenState, cellState, return_sequence, lengths)
 
 
 class FastRNN(nn.Module):
@@ -1186,7 +2114,6 @@ class FastRNN(nn.Module):
         self._batch_first = batch_first
         self._is_shared_bidirectional = is_shared_bidirectional
         self.cell = FastRNNCell(input_size, hidden_size,
-                                gate_nonlinearity=gate_nonlinearity,
                                 update_nonlinearity=update_nonlinearity,
                                 wRank=wRank, uRank=uRank,
                                 wSparsity=wSparsity, uSparsity=uSparsity,
@@ -1195,15 +2122,16 @@ class FastRNN(nn.Module):
 
         if self._bidirectional is True and self._is_shared_bidirectional is False:
             self.cell_reverse = FastRNNCell(input_size, hidden_size,
-                                gate_nonlinearity=gate_nonlinearity,
                                 update_nonlinearity=update_nonlinearity,
                                 wRank=wRank, uRank=uRank,
                                 wSparsity=wSparsity, uSparsity=uSparsity,
                                 alphaInit=alphaInit, betaInit=betaInit)
-            self.unrollRNN = BaseRNN(self.cell, self.cell_reverse, batch_first=self._batch_first, bidirectional=self._bidirectional)
+            self.unrollRNN = BaseRNN(self.cell, batch_first=self._batch_first, cell_reverse=self.cell_reverse, bidirectional=self._bidirectional)
 
-    def forward(self, input, hiddenState=None, cellState=None):
-        return self.unrollRNN(input, hiddenState, cellState)
+    def forward(self, input, hiddenState: Optional[torch.Tensor]=None,
+                cellState: Optional[torch.Tensor]=None, return_sequence: bool=True,
+                lengths: Optional[torch.Tensor]=None):
+        return self.unrollRNN(input, hiddenState, cellState, return_sequence, lengths)
 
 
 class FastGRNN(nn.Module):
@@ -1232,27 +2160,28 @@ class FastGRNN(nn.Module):
                                  wRank=wRank, uRank=uRank,
                                  wSparsity=wSparsity, uSparsity=uSparsity,
                                  zetaInit=zetaInit, nuInit=nuInit)
-            self.unrollRNN = BaseRNN(self.cell, self.cell_reverse, batch_first=self._batch_first, bidirectional=self._bidirectional)
+            self.unrollRNN = BaseRNN(self.cell, batch_first=self._batch_first, cell_reverse=self.cell_reverse, bidirectional=self._bidirectional)
 
     def getVars(self):
         return self.unrollRNN.getVars()
 
-    def forward(self, input, hiddenState=None, cellState=None):
-        return self.unrollRNN(input, hiddenState, cellState)
+    def forward(self, input, hiddenState: Optional[torch.Tensor]=None,
+                cellState: Optional[torch.Tensor]=None, return_sequence: bool=True,
+                lengths: Optional[torch.Tensor]=None):
+        return self.unrollRNN(input, hiddenState, cellState, return_sequence, lengths)
 
 class FastGRNNCUDA(nn.Module):
     """
         Unrolled implementation of the FastGRNNCUDACell
         Note: update_nonlinearity is fixed to tanh, only gate_nonlinearity
         is configurable.
+        Without a GPU the fastgrnn_cpu extension is used, see setup.py.
     """
     def __init__(self, input_size, hidden_size, gate_nonlinearity="sigmoid",
                  update_nonlinearity="tanh", wRank=None, uRank=None, 
                  wSparsity=1.0, uSparsity=1.0, zetaInit=1.0, nuInit=-4.0,
                  batch_first=False, name="FastGRNNCUDA"):
         super(FastGRNNCUDA, self).__init__()
-        if utils.findCUDA() is None:
-            raise Exception('FastGRNNCUDA is supported only on GPU devices.')
         NON_LINEARITY = {"sigmoid": 0, "relu": 1, "tanh": 2}
         self._input_size = input_size
         self._hidden_size = hidden_size
@@ -1267,8 +2196,9 @@ class FastGRNNCUDA(nn.Module):
         self._uRank = uRank
         self._wSparsity = wSparsity
         self._uSparsity = uSparsity
-        self.oldmats = []
-        self.device = torch.device("cuda")
+        # support of W and U kept by sparsifyWithSupport
+        self.supportMask = None
+        self.device = fastgrnn_device()
         self.batch_first = batch_first
         if wRank is not None:
             self._num_W_matrices += 1
@@ -1310,13 +2240,10 @@ class FastGRNNCUDA(nn.Module):
         '''
         if self.batch_first is True:
             input = input.transpose(0, 1).contiguous()
-        if not input.is_cuda:
-            input = input.to(self.device)
+        input = input.to(self.bias_gate.device)
         if hiddenState is None:
-            hiddenState = torch.zeros(
-                [input.shape[1], self._hidden_size]).to(self.device)
-        if not hiddenState.is_cuda:
-            hiddenState = hiddenState.to(self.device)
+            hiddenState = input.new_zeros([input.shape[1], self._hidden_size])
+        hiddenState = hiddenState.to(input.device)
         result = FastGRNNUnrollFunction.apply(input, self.bias_gate, self.bias_update, self.zeta, self.nu, hiddenState,
             self.W, self.U, self.W1, self.W2, self.U1, self.U2, self._gate_non_linearity)
         if self.batch_first is True:
@@ -1365,27 +2292,20 @@ class FastGRNNCUDA(nn.Module):
     def copy_previous_UW(self):
         mats = self.getVars()
         num_mats = self._num_W_matrices + self._num_U_matrices
-        if len(self.oldmats) != num_mats:
-            for i in range(num_mats):
-                self.oldmats.append(torch.FloatTensor())
-        for i in range(num_mats):
-            self.oldmats[i] = torch.FloatTensor(mats[i].detach().clone().to(mats[i].device))
+        self.supportMask = utils.SparsityMask(mats[:num_mats])
 
     def sparsify(self):
         mats = self.getVars()
         endW = self._num_W_matrices
         endU = endW + self._num_U_matrices
-        for i in range(0, endW):
-            mats[i] = utils.hardThreshold(mats[i], self._wSparsity)
-        for i in range(endW, endU):
-            mats[i] = utils.hardThreshold(mats[i], self._uSparsity)
+        utils.hardThresholdInPlace(mats[:endU], [self._wSparsity] * endW +
+                                   [self._uSparsity] * (endU - endW))
         self.copy_previous_UW()
 
     def sparsifyWithSupport(self):
-        mats = self.getVars()
-        endU = self._num_W_matrices + self._num_U_matrices
-        for i in range(0, endU):
-            mats[i] = utils.supportBasedThreshold(mats[i], self.oldmats[i])
+        if self.supportMask is None:
+            self.copy_previous_UW()
+        self.supportMask.apply()
 
 class SRNN2(nn.Module):
 
@@ -1509,7 +2429,8 @@ class SRNN2(nn.Module):
 class FastGRNNFunction(Function):
     @staticmethod
     def forward(ctx, input, bias_gate, bias_update, zeta, nu, old_h, w, u, w1, w2, u1, u2, gate_non_linearity):
-        outputs = fastgrnn_cuda.forward(input.contiguous(), w, u, bias_gate, bias_update, zeta, nu, old_h, gate_non_linearity, w1, w2, u1, u2)
+        ctx.kernels = fastgrnn_kernels(input)
+        outputs = ctx.kernels.forward(input.contiguous(), w, u, bias_gate, bias_update, zeta, nu, old_h, gate_non_linearity, w1, w2, u1, u2)
         new_h = outputs[0]
         variables = [input, old_h, zeta, nu, w, u] + outputs[1:] + [w1, w2, u1, u2]
         ctx.save_for_backward(*variables)
@@ -1518,14 +2439,15 @@ class FastGRNNFunction(Function):
 
     @staticmethod
     def backward(ctx, grad_h):
-        outputs = fastgrnn_cuda.backward(
+        outputs = ctx.kernels.backward(
             grad_h.contiguous(), *ctx.saved_variables, ctx.non_linearity)
         return tuple(outputs + [None])
 
 class FastGRNNUnrollFunction(Function):
     @staticmethod
     def forward(ctx, input, bias_gate, bias_update, zeta, nu, old_h, w, u, w1, w2, u1, u2, gate_non_linearity):
-        outputs = fastgrnn_cuda.forward_unroll(input.contiguous(), w, u, bias_gate, bias_update, zeta, nu, old_h, gate_non_linearity, w1, w2, u1, u2)
+        ctx.kernels = fastgrnn_kernels(input)
+        outputs = ctx.kernels.forward_unroll(input.contiguous(), w, u, bias_gate, bias_update, zeta, nu, old_h, gate_non_linearity, w1, w2, u1, u2)
         hidden_states = outputs[0]
         variables = [input, hidden_states, zeta, nu, w, u] + outputs[1:] + [old_h, w1, w2, u1, u2]
         ctx.save_for_backward(*variables)
@@ -1534,6 +2456,6 @@ class FastGRNNUnrollFunction(Function):
 
     @staticmethod
     def backward(ctx, grad_h):
-        outputs = fastgrnn_cuda.backward_unroll(
+        outputs = ctx.kernels.backward_unroll(
             grad_h.contiguous(), *ctx.saved_variables, ctx.gate_non_linearity)
         return tuple(outputs + [None])
@@ -1,6 +1,8 @@
 # Copyright (c) Microsoft Corporation. All rights reserved.
 # Licensed under the MIT license.
 
+from typing import List, Tuple
+
 import torch
 import torch.nn as nn
 import numpy as np
@@ -9,8 +11,16 @@ from edgeml_pytorch.graph.rnn import *
 class RNNPool(nn.Module):
     def __init__(self, nRows, nCols, nHiddenDims,
                      nHiddenDimsBiDir, inputDims, 
-                     w1Sparsity=1.0, u1Sparsity=1.0, w2Sparsity=1.0, u2Sparsity=1.0):
+                     w1Sparsity=1.0, u1Sparsity=1.0, w2Sparsity=1.0, u2Sparsity=1.0,
+                     batchSweeps=False):
+        '''
+        batchSweeps = run the row and column sweeps as a single recurrent
+        pass by concatenating them along the batch axis (needs nRows == nCols)
+        '''
         super(RNNPool, self).__init__()
+        if batchSweeps and nRows != nCols:
+            raise ValueError("batchSweeps requires nRows == nCols, got "
+                             "{} and {}".format(nRows, nCols))
         self.nRows = nRows
         self.nCols = nCols
         self.inputDims = inputDims
@@ -20,6 +30,8 @@ class RNNPool(nn.Module):
         self.u1Sparsity = u1Sparsity
         self.w2Sparsity = w2Sparsity
         self.u2Sparsity = u2Sparsity
+        self.batchSweeps = batchSweeps
+        self.workspace = None
 
         self._build()
 
@@ -36,38 +48,244 @@ class RNNPool(nn.Module):
                                 wSparsity=self.w2Sparsity, uSparsity=self.u2Sparsity)
 
 
-    def static_single(self,inputs, hidden, batch_size):
+    def static_single(self, inputs, hidden: Tuple[torch.Tensor, torch.Tensor], batch_size: int):
+        '''
+        Runs the first stage over time-major inputs and returns the final
+        hidden states as [-1, batch_size, nHiddenDims], which is directly the
+        time-major input of the bidirectional stage.
+        '''
+        outputs = self.cell_rnn(inputs, hidden[0], hidden[1], return_sequence=False)
+        return outputs.view(-1, batch_size, self.nHiddenDims)
 
-        outputs = self.cell_rnn(inputs, hidden[0], hidden[1])
-        return torch.split(outputs[-1], split_size_or_sections=batch_size, dim=0)
+    def bidir_single(self, inputs, hidden: Tuple[torch.Tensor, torch.Tensor]):
+        return self.cell_bidirrnn(inputs, hidden[0], hidden[1], return_sequence=False)
 
-    def forward(self,inputs,batch_size):
-        ## across rows
+    def set_workspace(self, workspace):
+        '''
+        Attaches a Workspace (or None to detach) that this layer and its
+        unrolled RNNs reuse across calls while grad is disabled, so that
+        steady-state inference allocates nothing but the output (see
+        Workspace for the cases that still allocate).
+        '''
+        self.workspace = workspace
+        self.cell_rnn.unrollRNN.workspace = workspace
+        self.cell_bidirrnn.unrollRNN.workspace = workspace
+        return self
+
+    # The workspace is eager only: the helpers below check
+    # torch.jit.is_scripting() first so that a scripted RNNPool compiles
+    # just the plain allocations.
+    def _use_workspace(self):
+        return self.workspace is not None and not torch.is_grad_enabled() \
+            and not autocast_enabled()
+
+    def _empty(self, name: str, shape: List[int], like):
+        if not torch.jit.is_scripting():
+            if self._use_workspace():
+                return self.workspace.empty(self, name, shape, like.dtype, like.device)
+        return torch.empty(shape, dtype=like.dtype, device=like.device)
+
+    def _zeros(self, name: str, num_directions: int, batch_size: int, hidden_size: int, like):
+        # initial states, float32 under autocast like the states of BaseRNN
+        if not torch.jit.is_scripting():
+            if self._use_workspace():
+                return self.workspace.zeros(self, name, (num_directions, batch_size, hidden_size),
+                                            like.dtype, like.device)
+            return torch.zeros([num_directions, batch_size, hidden_size],
+                               dtype=state_dtype(like.dtype), device=like.device)
+        return torch.zeros([num_directions, batch_size, hidden_size],
+                           dtype=like.dtype, device=like.device)
+
+    def _time_major(self, view, shape: List[int]):
+        if not torch.jit.is_scripting():
+            if self._use_workspace():
+                return self._empty("sequence", list(view.shape), view).copy_(view).view(shape)
+        return view.reshape(shape)
 
-        row_timestack = torch.cat(torch.unbind(inputs, dim=3),dim=0) 
+    def _stack_sweeps(self, cols, rows):
+        if not torch.jit.is_scripting():
+            if self._use_workspace():
+                return torch.stack([cols, rows], dim=2, out=self._empty(
+                    "sequence", list(rows.shape[:2]) + [2] + list(rows.shape[2:]), rows))
+        return torch.stack([cols, rows], dim=2)
 
-        stateList = self.static_single(torch.stack(torch.unbind(row_timestack,dim=2)),
-                        (torch.zeros(1, batch_size * self.nRows, self.nHiddenDims).to(inputs.device),
-                        torch.zeros(1, batch_size * self.nRows, self.nHiddenDims).to(inputs.device)),batch_size)       
+    def _pool(self, patches):
+        '''
+        patches: [*, inputDims, nRows, nCols], any strided view is accepted.
+        Returns [2, P, 2 * nHiddenDimsBiDir] where P is the number of patches,
+        the first entry is the pass across rows and the second across columns.
 
-        outputs_cols = self.cell_bidirrnn(torch.stack(stateList),
-                        torch.zeros(2, batch_size, self.nHiddenDimsBiDir).to(inputs.device),
-                        torch.zeros(2, batch_size, self.nHiddenDimsBiDir).to(inputs.device))
+        The time-major sequences are built with permuted views, so the only
+        copy of the input is the one the recurrence needs to consume it.
+        '''
+        nd = patches.dim()
+        lead: List[int] = []
+        num_patches = 1
+        for i in range(nd - 3):
+            lead.append(i)
+            num_patches *= patches.shape[i]
 
+        # time over rows (one sequence per column) and time over columns
+        rows = patches.permute([nd - 2, nd - 1] + lead + [nd - 3])
+        cols = patches.permute([nd - 1, nd - 2] + lead + [nd - 3])
+
+        if self.batchSweeps:
+            batch_size = 2 * num_patches
+            stacked = self._stack_sweeps(cols, rows)
+            states = self.static_single(stacked.view(self.nRows, self.nCols * batch_size, self.inputDims),
+                        (self._zeros("h1", 1, self.nCols * batch_size, self.nHiddenDims, patches),
+                        self._zeros("c1", 1, self.nCols * batch_size, self.nHiddenDims, patches)), batch_size)
+            outputs = self.bidir_single(states,
+                        (self._zeros("h2", 2, batch_size, self.nHiddenDimsBiDir, patches),
+                        self._zeros("c2", 2, batch_size, self.nHiddenDimsBiDir, patches)))
+            return outputs.view(2, num_patches, 2 * self.nHiddenDimsBiDir)
+
+        # filled in place: under a workspace both sweeps reuse the same buffers
+        pooled = self._empty("pooled", [2, num_patches, 2 * self.nHiddenDimsBiDir], patches)
+
+        ## across rows
+        states = self.static_single(self._time_major(rows, [self.nRows, self.nCols * num_patches, self.inputDims]),
+                        (self._zeros("h1", 1, self.nCols * num_patches, self.nHiddenDims, patches),
+                        self._zeros("c1", 1, self.nCols * num_patches, self.nHiddenDims, patches)), num_patches)
+        pooled[1].copy_(self.bidir_single(states,
+                        (self._zeros("h2", 2, num_patches, self.nHiddenDimsBiDir, patches),
+                        self._zeros("c2", 2, num_patches, self.nHiddenDimsBiDir, patches))))
 
         ## across columns
-        col_timestack = torch.cat(torch.unbind(inputs, dim=2),dim=0)
+        states = self.static_single(self._time_major(cols, [self.nCols, self.nRows * num_patches, self.inputDims]),
+                        (self._zeros("h1", 1, self.nRows * num_patches, self.nHiddenDims, patches),
+                        self._zeros("c1", 1, self.nRows * num_patches, self.nHiddenDims, patches)), num_patches)
+        pooled[0].copy_(self.bidir_single(states,
+                        (self._zeros("h2", 2, num_patches, self.nHiddenDimsBiDir, patches),
+                        self._zeros("c2", 2, num_patches, self.nHiddenDimsBiDir, patches))))
+
+        return pooled
 
-        stateList = self.static_single(torch.stack(torch.unbind(col_timestack,dim=2)),
-                        (torch.zeros(1, batch_size * self.nRows, self.nHiddenDims).to(inputs.device),
-                        torch.zeros(1, batch_size * self.nRows, self.nHiddenDims).to(inputs.device)),batch_size)
+    def forward(self, inputs, batch_size: int):
+        '''
+        inputs: [batch_size, inputDims, nRows, nCols]
+        Returns [batch_size, 4 * nHiddenDimsBiDir]
+        '''
+        pooled = self._pool(inputs)
+        return torch.cat([pooled[0], pooled[1]], 1)
 
-        outputs_rows = self.cell_bidirrnn(torch.stack(stateList),
-                        torch.zeros(2, batch_size, self.nHiddenDimsBiDir).to(inputs.device),
-                        torch.zeros(2, batch_size, self.nHiddenDimsBiDir).to(inputs.device))
 
+class RNNPool2d(RNNPool):
+    '''
+    RNNPool slid over an NCHW feature map, the RNNPool counterpart of
+    nn.MaxPool2d. Patches are strided views of the input and the pooled
+    vectors are written straight into the NCHW output, so no Unfold/Fold or
+    cat/stack copies of the feature map are made.
 
+    kernel_size = patch size (int or (nRows, nCols))
+    stride = patch stride (int or tuple)
+    padding = (left, right, top, bottom) replicate padding of the output,
+    in the order used by F.pad
+    tileBytes = approximate budget (in bytes) for the RNNPool activations of
+    one tile. The output is then computed a few patch rows at a time and
+    streamed into the output map, so peak activation memory follows the tile
+    size instead of the image size (under torch.no_grad(); autograd keeps
+    every tile alive for backward). None pools the whole map at once.
 
-        output = torch.cat([outputs_rows[-1],outputs_cols[-1]],1)
+    Input is [N, inputDims, H, W], output is
+    [N, 4 * nHiddenDimsBiDir, top + H_out + bottom, left + W_out + right]
+    with H_out = (H - nRows) // stride + 1 (likewise for W_out).
 
+    Subclasses of RNNPool that swap the cells can be combined with it via
+    class ModifiedRNNPool2d(RNNPool2d, ModifiedRNNPool).
+    '''
+    def __init__(self, kernel_size, stride, nHiddenDims,
+                     nHiddenDimsBiDir, inputDims,
+                     w1Sparsity=1.0, u1Sparsity=1.0, w2Sparsity=1.0, u2Sparsity=1.0,
+                     batchSweeps=False, padding=(0, 0, 0, 0), tileBytes=None):
+        if len(padding) != 4:
+            raise ValueError("padding should be (left, right, top, bottom), "
+                             "got {}".format(padding))
+        kernel_size = _pair(kernel_size)
+        super(RNNPool2d, self).__init__(kernel_size[0], kernel_size[1],
+                                        nHiddenDims, nHiddenDimsBiDir, inputDims,
+                                        w1Sparsity, u1Sparsity, w2Sparsity, u2Sparsity,
+                                        batchSweeps)
+        self.kernel_size = kernel_size
+        self.stride = _pair(stride)
+        self.padding = tuple(int(p) for p in padding)
+        self.tileBytes = tileBytes
+
+    def patch_bytes(self, element_size: int=4):
+        '''
+        Rough estimate of the live activations per patch: the time-major
+        copy of the patch, the first stage hidden state history and
+        temporaries of both sweeps, and the (small) bidirectional stage.
+        '''
+        sweep = self.nRows * self.nCols
+        elements = 2 * sweep * (self.inputDims + 4 * self.nHiddenDims) + \
+            8 * (self.nRows + self.nCols) * self.nHiddenDimsBiDir
+        return elements * element_size
+
+    def tile_rows(self, batch_size: int, output_x: int, output_y: int, element_size: int=4):
+        '''
+        Number of patch rows pooled per tile under tileBytes
+        '''
+        if self.tileBytes is None:
+            return output_x
+        else:
+            row_bytes = batch_size * output_y * self.patch_bytes(element_size)
+            return int(max(1, min(output_x, self.tileBytes // row_bytes)))
+
+    def forward(self, x):
+        batch_size = x.shape[0]
+        output_x = (x.shape[2] - self.nRows) // self.stride[0] + 1
+        output_y = (x.shape[3] - self.nCols) // self.stride[1] + 1
+
+        left, right, top, bottom = self.padding
+        output = x.new_empty([batch_size, 4 * self.nHiddenDimsBiDir,
+                              top + output_x + bottom, left + output_y + right])
+        output_view = output.view(batch_size, 2, 2 * self.nHiddenDimsBiDir,
+                                  output.shape[2], output.shape[3])
+
+        tile_rows = self.tile_rows(batch_size, output_x, output_y, x.element_size())
+        for start in range(0, output_x, tile_rows):
+            stop = min(start + tile_rows, output_x)
+            tile = x[:, :, start * self.stride[0]:(stop - 1) * self.stride[0] + self.nRows]
+            patches = tile.unfold(2, self.nRows, self.stride[0]).unfold(3, self.nCols, self.stride[1])
+
+            # [N, C, rows, W_out, nRows, nCols] -> [N, rows, W_out, C, nRows, nCols]
+            pooled = self._pool(patches.permute(0, 2, 3, 1, 4, 5))
+
+            # [2, N*rows*W_out, 2*hidden] -> [N, 2, 2*hidden, rows, W_out]
+            pooled = pooled.view(2, batch_size, stop - start, output_y,
+                                 2 * self.nHiddenDimsBiDir).permute(1, 0, 4, 2, 3)
+            _copy_replicate(output_view, pooled, self.padding, top + start,
+                            start == 0, stop == output_x)
         return output
+
+
+def _pair(x):
+    if isinstance(x, (tuple, list)):
+        return tuple(x)
+    return (x, x)
+
+
+def _copy_replicate(dst, src, padding: Tuple[int, int, int, int], row_offset: int,
+                    first: bool, last: bool):
+    '''
+    Writes the tile src into dst starting at row row_offset and fills the
+    border next to it by replicating the edge values of src, so writing
+    every tile in turn gives F.pad(map, padding, mode='replicate').
+    The top (bottom) border is only written for the first (last) tile.
+    '''
+    left, right, top, bottom = padding
+    height, width = src.shape[-2], src.shape[-1]
+    rows = dst.narrow(-2, row_offset, height)
+    rows.narrow(-1, left, width).copy_(src)
+    # copy_ broadcasts the edge column over the border
+    if left > 0:
+        rows.narrow(-1, 0, left).copy_(src.narrow(-1, 0, 1))
+    if right > 0:
+        rows.narrow(-1, left + width, right).copy_(src.narrow(-1, width - 1, 1))
+    # then the edge rows, borders included, over the top and bottom
+    if first and top > 0:
+        dst.narrow(-2, 0, top).copy_(dst.narrow(-2, row_offset, 1))
+    if last and bottom > 0:
+        dst.narrow(-2, row_offset + height, bottom).copy_(
+            dst.narrow(-2, row_offset + height - 1, 1))
@@ -106,52 +106,16 @@ class BonsaiTrainer:
         '''
         Function to run the IHT routine on Bonsai Obj
         '''
-        currW = self.bonsaiObj.W.data
-        currV = self.bonsaiObj.V.data
-        currZ = self.bonsaiObj.Z.data
-        currT = self.bonsaiObj.T.data
-
-        __thrsdW = utils.hardThreshold(currW.cpu(), self.sW)
-        __thrsdV = utils.hardThreshold(currV.cpu(), self.sV)
-        __thrsdZ = utils.hardThreshold(currZ.cpu(), self.sZ)
-        __thrsdT = utils.hardThreshold(currT.cpu(), self.sT)
-
-        self.bonsaiObj.W.data = torch.FloatTensor(
-            __thrsdW).to(self.device)
-        self.bonsaiObj.V.data = torch.FloatTensor(
-            __thrsdV).to(self.device)
-        self.bonsaiObj.Z.data = torch.FloatTensor(
-            __thrsdZ).to(self.device)
-        self.bonsaiObj.T.data = torch.FloatTensor(
-            __thrsdT).to(self.device)
-
-        self.__thrsdW = torch.FloatTensor(
-            __thrsdW.detach().clone()).to(self.device)
-        self.__thrsdV = torch.FloatTensor(
-            __thrsdV.detach().clone()).to(self.device)
-        self.__thrsdZ = torch.FloatTensor(
-            __thrsdZ.detach().clone()).to(self.device)
-        self.__thrsdT = torch.FloatTensor(
-            __thrsdT.detach().clone()).to(self.device)
+        bonsai = self.bonsaiObj
+        utils.hardThresholdInPlace([bonsai.W, bonsai.V, bonsai.Z, bonsai.T],
+                                   [self.sW, self.sV, self.sZ, self.sT])
+        self.sparsityMask = utils.SparsityMask([bonsai.W, bonsai.V, bonsai.Z, bonsai.T])
 
     def runSparseTraining(self):
         '''
         Function to run the Sparse Retraining routine on Bonsai Obj
         '''
-        currW = self.bonsaiObj.W.data
-        currV = self.bonsaiObj.V.data
-        currZ = self.bonsaiObj.Z.data
-        currT = self.bonsaiObj.T.data
-
-        newW = utils.copySupport(self.__thrsdW, currW)
-        newV = utils.copySupport(self.__thrsdV, currV)
-        newZ = utils.copySupport(self.__thrsdZ, currZ)
-        newT = utils.copySupport(self.__thrsdT, currT)
-
-        self.bonsaiObj.W.data = newW
-        self.bonsaiObj.V.data = newV
-        self.bonsaiObj.Z.data = newZ
-        self.bonsaiObj.T.data = newT
+        self.sparsityMask.apply()
 
     def assertInit(self):
         err = "sparsity must be between 0 and 1"
@@ -360,10 +324,11 @@ class BonsaiTrainer:
 
             oldSigmaI = self.sigmaI
             self.sigmaI = 1e9
-            logits, _ = self.bonsaiObj(Xtest.to(self.device), self.sigmaI)
-            testLoss, marginLoss, regLoss = self.loss(
-                logits, Ytest.to(self.device))
-            testAcc = self.accuracy(logits, Ytest.to(self.device)).item()
+            with torch.no_grad():
+                logits, _ = self.bonsaiObj(Xtest.to(self.device), self.sigmaI)
+                testLoss, marginLoss, regLoss = self.loss(
+                    logits, Ytest.to(self.device))
+                testAcc = self.accuracy(logits, Ytest.to(self.device)).item()
 
             if ihtDone == 0:
                 maxTestAcc = -10000
@@ -68,18 +68,18 @@ class FastTrainer:
         '''
         return torch.matmul(feats, self.FC) + self.FCbias
 
-    def computeLogits(self, input):
+    def computeLogits(self, input, lengths=None):
         '''
         Compute graph to unroll and predict on the FastObj
+        lengths is the optional number of valid timesteps of every sequence
         '''
         if self.FastObj.cellType == "LSTMLR":
-            feats, _ = self.RNN(input)
-            logits = self.classifier(feats[-1, :])
+            feats, _ = self.RNN(input, return_sequence=False, lengths=lengths)
         else:
-            feats = self.RNN(input)
-            logits = self.classifier(feats[-1, :])
+            feats = self.RNN(input, return_sequence=False, lengths=lengths)
+        logits = self.classifier(feats)
 
-        return logits, feats[:, -1]
+        return logits, feats
 
     def optimizer(self):
         '''
@@ -116,32 +116,16 @@ class FastTrainer:
         '''
         Function to run the IHT routine on FastObj
         '''
-        self.thrsdParams = []
-        thrsdParams = []
-        for i in range(0, self.numMatrices[0]):
-            thrsdParams.append(
-                utils.hardThreshold(self.FastParams[i].data.cpu(), self.sW))
-        for i in range(self.numMatrices[0], self.totalMatrices):
-            thrsdParams.append(
-                utils.hardThreshold(self.FastParams[i].data.cpu(), self.sU))
-        for i in range(0, self.totalMatrices):
-            self.FastParams[i].data = torch.FloatTensor(
-                thrsdParams[i]).to(self.device)
-        for i in range(0, self.totalMatrices):
-            self.thrsdParams.append(torch.FloatTensor(
-                np.copy(thrsdParams[i].detach())).to(self.device))
+        sparsities = [self.sW] * self.numMatrices[0] + \
+            [self.sU] * (self.totalMatrices - self.numMatrices[0])
+        utils.hardThresholdInPlace(self.FastParams[:self.totalMatrices], sparsities)
+        self.sparsityMask = utils.SparsityMask(self.FastParams[:self.totalMatrices])
 
     def runSparseTraining(self):
         '''
         Function to run the Sparse Retraining routine on FastObj
         '''
-        self.reTrainParams = []
-        for i in range(0, self.totalMatrices):
-            self.reTrainParams.append(
-                utils.copySupport(self.thrsdParams[i],
-                                  self.FastParams[i].data))
-        for i in range(0, self.totalMatrices):
-            self.FastParams[i].data = self.reTrainParams[i]
+        self.sparsityMask.apply()
 
     def getModelSize(self):
         '''
@@ -180,6 +164,16 @@ class FastTrainer:
 
         return totalnnZ, totalSize, hasSparse
 
+    def getMemorySize(self):
+        '''
+        Function to get the bytes the model holds in eval mode as
+        (dense, sparse): all the dense parameters and the sparse copies of
+        the W and U sparser than FastObj.sparse_threshold, kept next to
+        them. Set their sum against the estimate of getModelSize
+        '''
+        dense, sparse = self.FastObj.get_memory_size()
+        return dense + utils.tensorBytes(self.FC) + utils.tensorBytes(self.FCbias), sparse
+
     def saveParams(self, currDir):
         '''
         Function to save Parameter matrices
@@ -345,9 +339,13 @@ class FastTrainer:
         np.save(os.path.join(currDir, "FCbias.npy"), self.FCbias.data.cpu())
 
     def train(self, batchSize, totalEpochs, Xtrain, Xtest, Ytrain, Ytest,
-              decayStep, decayRate, dataDir, currDir):
+              decayStep, decayRate, dataDir, currDir,
+              lengthsTrain=None, lengthsTest=None):
         '''
         The Dense - IHT - Sparse Retrain Routine for FastCell Training
+        lengthsTrain and lengthsTest optionally give the number of valid
+        timesteps of every zero padded example, each sequence is then run
+        only over its own timesteps
         '''
         fileName = str(self.FastObj.cellType) + 'Results_pytorch.txt'
         resultFile = open(os.path.join(dataDir, fileName), 'a+')
@@ -391,9 +389,10 @@ class FastTrainer:
                 k = shuffled[j * batchSize:(j + 1) * batchSize]
                 batchX = Xtrain[:, k, :]
                 batchY = Ytrain[k]
+                batchLengths = None if lengthsTrain is None else lengthsTrain[k]
 
                 self.optimizer.zero_grad()
-                logits, _ = self.computeLogits(batchX.to(self.device))
+                logits, _ = self.computeLogits(batchX.to(self.device), batchLengths)
                 batchLoss = self.loss(logits, batchY.to(self.device))
                 batchAcc = self.accuracy(logits, batchY.to(self.device))
                 batchLoss.backward()
@@ -433,7 +432,7 @@ class FastTrainer:
                   " Train Accuracy: " + str(trainAcc),
                   file=self.outFile)
 
-            logits, _ = self.computeLogits(Xtest.to(self.device))
+            logits, _ = self.computeLogits(Xtest.to(self.device), lengthsTest)
             testLoss = self.loss(logits, Ytest.to(self.device)).item()
             testAcc = self.accuracy(logits, Ytest.to(self.device)).item()
 
@@ -459,6 +458,12 @@ class FastTrainer:
               " Model Size: " + str(float(self.getModelSize()[1]) / 1024.0) +
               " KB hasSparse: " + str(self.getModelSize()[2]) + "\n",
               file=self.outFile)
+        denseBytes, sparseBytes = self.getMemorySize()
+        print("In-memory Size (eval): " +
+              str(float(denseBytes + sparseBytes) / 1024.0) + " KB (dense: " +
+              str(float(denseBytes) / 1024.0) + " KB, sparse copies: " +
+              str(float(sparseBytes) / 1024.0) + " KB)\n",
+              file=self.outFile)
 
         resultFile.write("MaxTestAcc: " + str(maxTestAcc) +
                          " at Epoch(totalEpochs): " +
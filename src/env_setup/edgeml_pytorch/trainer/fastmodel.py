@@ -6,8 +6,18 @@ import torch.nn as nn
 import torch.nn.functional as F
 import numpy as np
 import sys
+import time
+from collections import deque
 from edgeml_pytorch.graph.rnn import *
 
+def last_step(output, lengths=None):
+    """ output[-1] of a [seq, batch, feature] output, or output[length - 1] of every
+        sequence when lengths are given """
+    if lengths is None:
+        return output[-1, :, :]
+    index = (torch.as_tensor(lengths).to(output.device, torch.long) - 1).clamp(min=0)
+    return output[index, torch.arange(output.shape[1], device=output.device)]
+
 def get_model_class(inheritance_class=nn.Module):
     class RNNClassifierModel(inheritance_class):
         """This class is a PyTorch Module that implements a 1, 2 or 3 layer
@@ -150,8 +160,136 @@ def get_model_class(inheritance_class=nn.Module):
             for l in range(self.num_layers):
                 self.hidden_states.append(None)
 
-        def forward(self, input):
-            """ Perform the forward processing of the given input and return the prediction """
+        def init_streams(self, num_streams, device=None, dtype=torch.float32, history=10000):
+            """ Prepare step/step_chunk for num_streams independent streams, batched together.
+                Allocates the per-layer state buffers (zeroed) and the workspace that the cells
+                reuse, and folds normalize(mean, std) into a scale and shift. Call it again
+                after changing the weights, mean/std or the number of streams.
+                history - number of per-frame latencies kept for latency_report
+            """
+            if device is None:
+                device = next(self.parameters()).device
+            self.num_streams = num_streams
+            self.stream_workspace = Workspace()
+            self.stream_states = []
+            for l in range(self.num_layers):
+                shape = [num_streams, self.hidden_units_list[l]]
+                if self.rnn_name == "LSTM":
+                    self.stream_states.append((torch.zeros(shape, dtype=dtype, device=device),
+                                               torch.zeros(shape, dtype=dtype, device=device)))
+                else:
+                    self.stream_states.append(torch.zeros(shape, dtype=dtype, device=device))
+            self.stream_scale = None
+            self.stream_shift = None
+            if getattr(self, 'mean', None) is not None:
+                # (x - mean) / std == x * scale + shift
+                std = torch.as_tensor(self.std, dtype=dtype, device=device)
+                mean = torch.as_tensor(self.mean, dtype=dtype, device=device)
+                self.stream_scale = 1.0 / std
+                self.stream_shift = -mean / std
+            self.frame_latency = deque(maxlen=history)
+
+        def reset_streams(self, streams=None):
+            """ Zero the state of the given streams (all by default), e.g. when a new
+                utterance starts on them """
+            for state in self.stream_states:
+                for buffer in (state if isinstance(state, tuple) else (state,)):
+                    if streams is None:
+                        buffer.zero_()
+                    else:
+                        buffer[streams] = 0.0
+
+        def _stream_layer(self, l, frames):
+            """ Run layer l over [T, num_streams, features] frames from its stream state and
+                return the [T, num_streams, hidden] outputs, kept in the workspace """
+            rnn = self.rnn_list[l]
+            state = self.stream_states[l]
+            if self.rnn_name == "FastGRNNCUDA":
+                # the fused kernels unroll the whole chunk in one call
+                outputs = rnn(frames, hiddenState=state)
+                state.copy_(outputs[-1])
+                return outputs
+            cell = rnn.cell
+            workspace = self.stream_workspace
+            timesteps = frames.shape[0]
+            projection = cell.input_projection_into(frames, workspace)
+            outputs = workspace.empty(self, "outputs%d" % l,
+                                      (timesteps,) + tuple(state[0].shape if isinstance(state, tuple)
+                                                           else state.shape),
+                                      frames.dtype, frames.device)
+            if isinstance(state, tuple):
+                h, c = state
+                for t in range(timesteps):
+                    # the cell state is updated in its stream buffer
+                    h, c = cell.step_into(projection[t], (h, c), (outputs[t], c), workspace)
+                state[0].copy_(h)
+            else:
+                h = state
+                for t in range(timesteps):
+                    h = cell.step_into(projection[t], h, outputs[t], workspace)
+                state.copy_(h)
+            return outputs
+
+        def step_chunk(self, frames):
+            """ Advance every stream by the frames [T, num_streams, input_dim] and return the
+                prediction after each frame, [T, num_streams, num_classes] (log probabilities
+                if apply_softmax), or the last layer's outputs if the model is not linear.
+
+                The input projection of each layer covers the whole chunk in one GEMM, states
+                live in the buffers of init_streams and temporaries in its workspace, so once
+                a chunk length has been seen a call allocates nothing and a frame costs the
+                same at any point of the stream. That holds for the FastGRNN, FastRNN, UGRNN,
+                GRU and LSTM cells, whose step_into writes every temporary into the workspace,
+                but not for FastGRNNCUDA (its fused kernels allocate their outputs), sparse W/U,
+                quantSigm nonlinearities or user callables (see Workspace). The returned tensor
+                is reused by the next call with the same chunk length.
+            """
+            start = time.perf_counter()
+            timesteps = frames.shape[0]
+            workspace = self.stream_workspace
+            with torch.no_grad():
+                if self.stream_scale is not None:
+                    normalized = workspace.empty(self, "frames", frames.shape, frames.dtype, frames.device)
+                    frames = torch.addcmul(self.stream_shift, frames, self.stream_scale, out=normalized)
+                rnn_in = frames
+                for l in range(self.num_layers):
+                    rnn_in = self._stream_layer(l, rnn_in)
+                output = rnn_in
+                if self.linear:
+                    rows = rnn_in.view(-1, rnn_in.shape[-1])
+                    logits = workspace.empty(self, "logits", (rows.shape[0], self.num_classes),
+                                             rows.dtype, rows.device)
+                    torch.addmm(self.hidden2keyword.bias, rows, self.hidden2keyword.weight.t(), out=logits)
+                    if self.apply_softmax:
+                        lse = workspace.empty(self, "logsumexp", (rows.shape[0], 1), rows.dtype, rows.device)
+                        logits.sub_(torch.logsumexp(logits, 1, keepdim=True, out=lse))
+                    output = logits.view(timesteps, -1, self.num_classes)
+            if output.is_cuda:
+                torch.cuda.synchronize(output.device)
+            latency = (time.perf_counter() - start) / timesteps
+            self.frame_latency.extend([latency] * timesteps)
+            return output
+
+        def step(self, frame):
+            """ Advance every stream by one frame [num_streams, input_dim], see step_chunk """
+            return self.step_chunk(frame.unsqueeze(0))[0]
+
+        def latency_report(self):
+            """ Per-frame latency of the recent step/step_chunk calls in milliseconds (a
+                chunk counts as its frames, each taking the average) """
+            if len(self.frame_latency) == 0:
+                return {}
+            latency = 1000.0 * np.array(self.frame_latency)
+            return {"frames": len(latency), "mean_ms": float(latency.mean()),
+                    "p50_ms": float(np.percentile(latency, 50)),
+                    "p99_ms": float(np.percentile(latency, 99)),
+                    "max_ms": float(latency.max())}
+
+        def forward(self, input, lengths=None):
+            """ Perform the forward processing of the given input and return the prediction
+                lengths - optional number of valid frames of every sequence of a padded input,
+                the recurrence stops at the end of each sequence (not supported by FastGRNNCUDA)
+            """
             # input is shape: [seq,batch,feature]
             if self.mean is not None:
                 input = (input - self.mean) / self.std
@@ -179,15 +317,15 @@ def get_model_class(inheritance_class=nn.Module):
                     rnn = self.rnn_list[l]
                     if self.hidden_states[l] is not None:
                         self.hidden_states[l] = self.hidden_states[l].clone().unsqueeze(0)
-                    model_output = rnn(rnn_in, hiddenState=self.hidden_states[l])
-                    self.hidden_states[l] = model_output.detach()[-1, :, :]
+                    model_output = rnn(rnn_in, hiddenState=self.hidden_states[l], lengths=lengths)
+                    self.hidden_states[l] = last_step(model_output.detach(), lengths)
                     if self.tracking:
                         weights = rnn.getVars()
                         model_output = onnx_exportable_rnn(rnn_in, weights, rnn.cell, output=model_output)
                     rnn_in = model_output
 
             if self.linear:
-                model_output = self.hidden2keyword(model_output[-1, :, :])
+                model_output = self.hidden2keyword(last_step(model_output, lengths))
             if self.apply_softmax:
                 model_output = F.log_softmax(model_output, dim=1)
             return model_output
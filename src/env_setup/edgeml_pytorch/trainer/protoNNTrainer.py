@@ -109,13 +109,8 @@ class ProtoNNTrainer:
 
     def hardThreshold(self):
         prtn = self.protoNNObj
-        W, B, Z = prtn.W.data, prtn.B.data, prtn.Z.data
-        newW = utils.hardThreshold(W, self.__sW)
-        newB = utils.hardThreshold(B, self.__sB)
-        newZ = utils.hardThreshold(Z, self.__sZ)
-        prtn.W.data = torch.FloatTensor(newW).to(self.device)
-        prtn.B.data = torch.FloatTensor(newB).to(self.device)
-        prtn.Z.data = torch.FloatTensor(newZ).to(self.device)
+        utils.hardThresholdInPlace([prtn.W, prtn.B, prtn.Z],
+                                   [self.__sW, self.__sB, self.__sZ])
 
     def train(self, batchSize, epochs, x_train, x_val, y_train, y_val,
               printStep=10, valStep=1):
@@ -2,6 +2,7 @@
 # Licensed under the MIT license.
 import sys
 import os
+import math
 import numpy as np
 import torch
 import torch.nn.functional as F
@@ -83,6 +84,61 @@ def hardThreshold(A: torch.Tensor, s):
     A_ = A_.reshape(A.shape)
     return torch.tensor(A_, requires_grad=True)
 
+def hardThresholdInPlace(params, sparsities):
+    '''
+    Hard thresholds every tensor of params in place on its own device,
+    keeping the same entries as hardThreshold (np.percentile with
+    interpolation='higher'), so nn.Parameter identity and optimizer state
+    are preserved. sparsities is one sparsity for all or one per tensor.
+    Tensors with the same size and sparsity share one batched kthvalue.
+    '''
+    if not isinstance(sparsities, (list, tuple)):
+        sparsities = [sparsities] * len(params)
+    groups = {}
+    for A, s in zip(params, sparsities):
+        n = A.numel()
+        if n == 0 or s >= 1.0:
+            continue
+        # np.percentile: index (n - 1) * q of the sorted magnitudes,
+        # rounded up, computed in the same floating point order
+        q = (1 - s) * 100.0 / 100
+        k = min(int(math.ceil((n - 1) * q)), n - 1) + 1
+        groups.setdefault((n, k, A.device, A.dtype), []).append(A)
+    with torch.no_grad():
+        for (n, k, _, _), group in groups.items():
+            magnitudes = torch.stack([A.detach().reshape(-1).abs() for A in group])
+            thresholds = magnitudes.kthvalue(k, dim=1, keepdim=True).values
+            below = magnitudes < thresholds
+            for A, mask in zip(group, below):
+                A.masked_fill_(mask.view(A.shape), 0.0)
+
+class SparsityMask(object):
+    '''
+    Support (non-zero pattern) of a list of tensors, captured once at the
+    end of IHT and re-imposed on the same tensors by apply with a single
+    fused in-place multiply, instead of rebuilding the zero index list of
+    copySupport on every batch. Masks follow the tensors to a new device
+    or dtype on the next apply.
+    '''
+    def __init__(self, params):
+        self.params = list(params)
+        with torch.no_grad():
+            self.masks = [(A != 0).to(A.dtype) for A in self.params]
+
+    def apply(self):
+        for i, A in enumerate(self.params):
+            if self.masks[i].device != A.device or self.masks[i].dtype != A.dtype:
+                self.masks[i] = self.masks[i].to(device=A.device, dtype=A.dtype)
+        with torch.no_grad():
+            torch._foreach_mul_(self.params, self.masks)
+
+    def density(self):
+        '''
+        Fraction of entries kept over all tensors
+        '''
+        kept = sum(float(mask.sum()) for mask in self.masks)
+        return kept / max(1, sum(mask.numel() for mask in self.masks))
+
 def supportBasedThreshold(dst: torch.Tensor, src: torch.Tensor):
     '''
     zero out entries in dst.data that are zeros in src tensor
@@ -133,6 +189,19 @@ def countNNZ(A: torch.nn.Parameter, isSparse):
             nnzs *= int(A.shape[i])
         return nnzs
 
+
+def tensorBytes(A):
+    '''
+    Returns the bytes held by a dense tensor or by the values and indices
+    of a sparse (COO or CSR) one
+    '''
+    if A.layout == torch.sparse_coo:
+        return tensorBytes(A._values()) + tensorBytes(A._indices())
+    if A.layout == getattr(torch, 'sparse_csr', None):
+        return tensorBytes(A.values()) + tensorBytes(A.crow_indices()) + \
+            tensorBytes(A.col_indices())
+    return A.numel() * A.element_size()
+
 def restructreMatrixBonsaiSeeDot(A, nClasses, nNodes):
     '''
     Restructures a matrix from [nNodes*nClasses, Proj] to
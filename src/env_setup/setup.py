@@ -1,5 +1,34 @@
 import setuptools  # enables develop
 import os
+import sys
+import warnings
+
+ext_modules = []
+cmdclass = {}
+
+# The fused FastGRNN CPU kernels (edgeml_pytorch/cpu) are built when torch and
+# a C++ compiler are available. EDGEML_CPU_EXTENSION=0 skips them; if the build
+# fails the package is installed without them and FastGRNNCUDA needs a GPU.
+if os.environ.get('EDGEML_CPU_EXTENSION', '1') != '0':
+    try:
+        from torch.utils.cpp_extension import BuildExtension, CppExtension
+    except ImportError:
+        BuildExtension = None
+
+    if BuildExtension is not None:
+        class OptionalBuildExtension(BuildExtension):
+            def run(self):
+                try:
+                    BuildExtension.run(self)
+                except Exception as e:
+                    warnings.warn('fastgrnn_cpu was not built (%s), '
+                                  'FastGRNNCUDA will need a GPU.' % e)
+
+        openmp = [] if sys.platform in ('darwin', 'win32') else ['-fopenmp']
+        ext_modules.append(CppExtension(
+            'fastgrnn_cpu', ['edgeml_pytorch/cpu/fastgrnn_cpu.cpp'],
+            extra_compile_args=['-O3'] + openmp, extra_link_args=openmp))
+        cmdclass['build_ext'] = OptionalBuildExtension
 
 setuptools.setup(
     name='edgeml',
@@ -7,6 +36,8 @@ setuptools.setup(
     description='PyTorch code for ML algorithms for edge devices developed at Microsoft Research India.',
     author_email="edgeml@microsoft.com",
     packages=['edgeml_pytorch', 'edgeml_pytorch.trainer', 'edgeml_pytorch.graph'],
+    ext_modules=ext_modules,
+    cmdclass=cmdclass,
     license='MIT License',
     long_description=open('README.md').read(),
     url='https://github.com/Microsoft/EdgeML',